@@ -0,0 +1,200 @@
+"""
+Streaming, mergeable summaries of the fleet's errors.
+
+RunningStats keeps the count, mean, variance, min and max of a stream
+with Welford's algorithm, and TDigest approximates its quantiles with a
+merging t-digest of at most about `compression` centroids. Both use
+constant memory whatever the number of values and can be merged, so each
+worker process summarises its own sites and the parent merges the
+summaries. ErrorSummary combines the two.
+"""
+import math
+
+import numpy as np
+
+TDIGEST_COMPRESSION = 200
+
+QUANTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99}
+
+
+class RunningStats():
+    """Count, mean, variance, min and max of a stream of values"""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """Adds the values summarised by other"""
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self):
+        """Sample variance, NaN for less than 2 values"""
+        if self.count < 2:
+            return math.nan
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+
+class TDigest():
+    """
+    Approximate quantiles of a stream of values, most accurate near the
+    tails. Values are buffered and merged into the centroids in batches.
+
+    Parameters
+    ----------
+    compression: float
+        bounds the number of centroids, higher is more accurate
+    """
+    def __init__(self, compression=TDIGEST_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.buffer = []
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __len__(self):
+        return int(self.weights.sum()) + len(self.buffer)
+
+    def add(self, value):
+        self.buffer.append(value)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self.buffer) >= 5 * self.compression:
+            self.compress()
+
+    def merge(self, other):
+        """Adds the values summarised by other"""
+        other.compress()
+        self.compress()
+        self.means = np.concatenate([self.means, other.means])
+        self.weights = np.concatenate([self.weights, other.weights])
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress(force=True)
+
+    def scale(self, q):
+        """The k1 scale function of the t-digest"""
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def inverse_scale(self, k):
+        if k >= self.compression / 4:
+            return 1.0
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def compress(self, force=False):
+        """Merges the buffered values into the centroids"""
+        if not self.buffer and not force:
+            return
+        means = np.concatenate([self.means, self.buffer])
+        weights = np.concatenate([self.weights, np.ones(len(self.buffer))])
+        self.buffer = []
+        if not len(means):
+            return
+
+        order = np.argsort(means, kind="stable")
+        means = means[order].tolist()
+        weights = weights[order].tolist()
+        total = sum(weights)
+
+        new_means = []
+        new_weights = []
+        mean, weight = means[0], weights[0]
+        merged_weight = 0.0
+        q_limit = self.inverse_scale(self.scale(0.0) + 1)
+        for next_mean, next_weight in zip(means[1:], weights[1:]):
+            if (merged_weight + weight + next_weight) / total <= q_limit:
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+            else:
+                new_means.append(mean)
+                new_weights.append(weight)
+                merged_weight += weight
+                q_limit = self.inverse_scale(
+                    self.scale(merged_weight / total) + 1
+                    )
+                mean, weight = next_mean, next_weight
+        new_means.append(mean)
+        new_weights.append(weight)
+
+        self.means = np.array(new_means)
+        self.weights = np.array(new_weights)
+
+    def quantile(self, q):
+        """Returns the approximate q quantile, NaN without values"""
+        self.compress()
+        if not len(self.means):
+            return math.nan
+
+        total = self.weights.sum()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        target = q * total
+        if target <= centers[0]:
+            return float(np.interp(
+                target, [0, centers[0]], [self.min, self.means[0]]
+                ))
+        if target >= centers[-1]:
+            return float(np.interp(
+                target, [centers[-1], total], [self.means[-1], self.max]
+                ))
+        return float(np.interp(target, centers, self.means))
+
+
+class ErrorSummary():
+    """
+    Mean, std, min, max and QUANTILES of a stream of errors. NaN errors,
+    e.g. of sites without PVOUTPUT data, are only counted.
+    """
+    def __init__(self, compression=TDIGEST_COMPRESSION):
+        self.stats = RunningStats()
+        self.digest = TDigest(compression)
+        self.missing = 0
+
+    def add(self, value):
+        if value is None or math.isnan(value):
+            self.missing += 1
+            return
+        self.stats.add(value)
+        self.digest.add(value)
+
+    def merge(self, other):
+        """Adds the errors summarised by other, e.g. in a worker process"""
+        self.stats.merge(other.stats)
+        self.digest.merge(other.digest)
+        self.missing += other.missing
+
+    def summary(self):
+        """Returns the summary as a dict of floats"""
+        summary = {
+            "count": self.stats.count, "missing": self.missing,
+            "mean": self.stats.mean if self.stats.count else math.nan,
+            "std": self.stats.std,
+            "min": self.stats.min if self.stats.count else math.nan,
+            "max": self.stats.max if self.stats.count else math.nan,
+            }
+        for name, q in QUANTILES.items():
+            summary[name] = self.digest.quantile(q)
+        return summary
@@ -0,0 +1,164 @@
+"""
+Persistent index of the artifacts in the output directory.
+
+The output directory is walked once with os.scandir and every directory
+is recorded with its modification time, subdirectories and files. A later
+refresh stats each known directory and only lists again the ones whose
+modification time changed, i.e. that had entries added, removed or
+replaced, so finding the joined files or site folders of a large fleet
+does not walk the whole tree every time. The index is kept in
+INDEX_FILE in the output directory.
+
+The pipeline writes its outputs through file_io.replacing, so rewriting
+a file also replaces its directory entry and changes the directory's
+modification time. A file rewritten in place by anything else keeps the
+modification time of the last listing of its directory.
+
+A run loads the index once with load_index and passes it to the stages
+that look up artifacts.
+"""
+import os
+import json
+import logging
+
+from render import SPEC_EXTENSION
+
+INDEX_FILE = "artifact_index.json"
+
+INDEX_VERSION = 1
+
+
+def artifact_kind(directory, name):
+    """
+    Returns the kind of an artifact from its directory, relative to the
+    output directory, and file name: "plot", "spec", "joined",
+    "joined_months", "stats",
+    the kind of a frame of a site's pvgis or pvoutput folder, the period
+    frame of an hourly series, e.g. "pvgis_week", or "other"
+    """
+    if name.endswith(SPEC_EXTENSION):
+        return "spec"
+    stem, extension = os.path.splitext(name)
+    if extension == ".png":
+        return "plot"
+
+    parts = directory.split(os.sep)
+    site = parts[0]
+    if len(parts) == 2 and stem == site:
+        return parts[1]
+    if len(parts) == 1:
+        if stem == f"joined_{site}":
+            return "joined"
+        if stem in ("stats", "joined_months") or stem.startswith("pvgis_"):
+            return stem
+    return "other"
+
+
+class ArtifactIndex():
+    """
+    Parameters
+    ----------
+    output_dir: str
+        directory of the index, loaded from its INDEX_FILE if there is one
+    """
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, INDEX_FILE)
+        self.dirs = {}
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as file:
+                    index = json.load(file)
+                if index.get("version") == INDEX_VERSION:
+                    self.dirs = index["dirs"]
+            except (ValueError, KeyError):
+                logging.warning(f"ignoring unreadable index {self.path}")
+
+    def refresh(self):
+        """
+        Brings the index up to date, listing only the directories that
+        changed since they were recorded. Returns the index.
+        """
+        dirs = {}
+        stack = [""]
+        while stack:
+            directory = stack.pop()
+            path = os.path.join(self.output_dir, directory)
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+
+            entry = self.dirs.get(directory)
+            if entry is None or entry["mtime_ns"] != mtime_ns:
+                entry = self.list_dir(path, mtime_ns)
+            dirs[directory] = entry
+            stack.extend(
+                os.path.join(directory, name) for name in entry["dirs"]
+                )
+        self.dirs = dirs
+        return self
+
+    @staticmethod
+    def list_dir(path, mtime_ns):
+        """Returns the index entry of a directory from one os.scandir"""
+        entry = {"mtime_ns": mtime_ns, "dirs": [], "files": {}}
+        with os.scandir(path) as children:
+            for child in children:
+                if child.is_dir():
+                    entry["dirs"].append(child.name)
+                elif child.name != INDEX_FILE:
+                    entry["files"][child.name] = child.stat().st_mtime_ns
+        entry["dirs"].sort()
+        return entry
+
+    def save(self):
+        """Writes the index to the output directory, if it exists"""
+        if not os.path.isdir(self.output_dir):
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"version": INDEX_VERSION, "dirs": self.dirs}, file)
+        os.replace(tmp_path, self.path)
+
+    def sites(self):
+        """Returns the names of the site folders"""
+        root = self.dirs.get("")
+        return list(root["dirs"]) if root is not None else []
+
+    def artifacts(self, site=None):
+        """
+        Returns the artifacts of a site, or of every site, by kind.
+
+        Returns
+        -------
+        artifacts: dict
+            kind, see artifact_kind, to a list of (path, mtime_ns) sorted
+            by path
+        """
+        artifacts = {}
+        for directory, entry in sorted(self.dirs.items()):
+            if not directory:
+                continue
+            if site is not None and directory.split(os.sep)[0] != site:
+                continue
+            for name, mtime_ns in sorted(entry["files"].items()):
+                artifacts.setdefault(artifact_kind(directory, name), []).append(
+                    (os.path.join(self.output_dir, directory, name), mtime_ns)
+                    )
+        return artifacts
+
+    def find(self, kind, extension=None):
+        """Returns the paths of every artifact of kind, with extension"""
+        return [
+            path for path, _ in self.artifacts().get(kind, [])
+            if extension is None or path.endswith(extension)
+            ]
+
+
+def load_index(output_dir):
+    """Returns the refreshed index of output_dir, saved for later runs"""
+    index = ArtifactIndex(output_dir).refresh()
+    index.save()
+    return index
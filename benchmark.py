@@ -0,0 +1,568 @@
+"""
+Benchmarks for the pv csv analysis pipeline.
+
+    python benchmark.py str_to_float
+    python benchmark.py pvgis_parser
+    python benchmark.py fleet --sites 1000 [--root DIR] [--json FILE]
+        [--baseline FILE] [--tolerance 0.25]
+
+The fleet benchmark generates synthetic PVGIS text files, PVGIS json files
+and PVOUTPUT csv exports for a number of sites in the layouts the pipeline
+reads, runs each stage over all of them and reports time, throughput and
+peak memory per stage. With --baseline it exits with an error when a
+stage is slower than the baseline run by more than the tolerance.
+"""
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import resource
+import tempfile
+import tracemalloc
+
+import pandas as pd
+import numpy as np
+
+import main
+import render
+import process_json
+import pvgis_script
+import pvoutput_csv
+from pvoutput_csv import to_str, str_to_float, str_to_float_legacy
+from statistics import calculate_stats, calculate_fleet_stats
+from storage import frame_path
+
+MONTHS = [
+    "Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct",
+    "Nov", "Dec",
+    ]
+
+# Average monthly yield in kWh per kWp, shaped like a mid latitude site
+MONTHLY_YIELD = np.array(
+    [45, 62, 98, 120, 140, 145, 150, 135, 105, 75, 48, 38], dtype="float64"
+    )
+
+DAYS_IN_MONTH = np.array(
+    [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], dtype="float64"
+    )
+
+def make_pvoutput_df(rows=1000, seed=0):
+    """
+    Builds a data frame shaped like a raw PVOUTPUT monthly export, with
+    values spread over MWh, kWh and kWh/kW strings.
+
+    Parameters
+    ----------
+    rows: int
+        number of rows in the data frame
+
+    seed: int
+        seed for the random number generator
+
+    Returns
+    -------
+    df: pandas.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    generated = rng.uniform(50, 5000, rows)
+    generated = [
+        f"{value / 1000:.3f}MWh" if value >= 1000 else f"{value:,.3f}kWh"
+        for value in generated
+        ]
+
+    frame = {
+        "Month": [f"Month {i}" for i in range(rows)],
+        "Generated": generated,
+        "Efficiency": [
+            f"{value:.3f}kWh/kW" for value in rng.uniform(0.5, 6, rows)
+            ],
+        "Low": [f"{value:,.3f}kWh" for value in rng.uniform(0, 20, rows)],
+        "High": [f"{value:,.3f}kWh" for value in rng.uniform(20, 2000, rows)],
+        "Average": [f"{value:,.3f}kWh" for value in rng.uniform(5, 50, rows)],
+        }
+    return pd.DataFrame(frame)
+
+
+def bench_str_to_float(rows=1000, number=5):
+    """
+    Times str_to_float against str_to_float_legacy on the same input and
+    checks that both give the same values.
+
+    Parameters
+    ----------
+    rows: int
+        number of rows in the benchmarked data frame
+
+    number: int
+        number of timed runs of each function
+
+    Returns
+    -------
+    timings: dict
+        best time in seconds of each function
+    """
+    df = to_str(make_pvoutput_df(rows))
+
+    expected = str_to_float_legacy(df.copy())
+    result = str_to_float(df.copy())
+    if list(expected) != list(result):
+        raise AssertionError(f"{list(result)} != {list(expected)}")
+
+    for column in list(result):
+        if result[column].dtype == "float32":
+            np.testing.assert_array_equal(
+                result[column].to_numpy(),
+                expected[column].to_numpy(dtype="float32"),
+                )
+
+    timings = {}
+    for function in (str_to_float_legacy, str_to_float):
+        timings[function.__name__] = min(timeit.repeat(
+            lambda: function(df.copy()), number=1, repeat=number
+            ))
+    return timings
+
+
+def bench_pvgis_parser(number=200):
+    """
+    Times pvgis_script.open_csv_file against open_csv_file_legacy on a
+    synthetic PVGIS file.
+
+    Returns
+    -------
+    timings: dict
+        best time per file of each function in seconds and its peak of
+        python allocations in bytes
+    """
+    with tempfile.TemporaryDirectory() as root:
+        generate_fleet(root, 1, with_json=False)
+        set_root(root)
+        filename = f"{site_name(0)}.csv"
+
+        new = pvgis_script.open_csv_file(filename)
+        legacy = pvgis_script.open_csv_file_legacy(filename)
+        assert new[1] == legacy[1]
+        assert np.array_equal(new[0].to_numpy(), legacy[0].to_numpy())
+
+        timings = {}
+        for function in (
+            pvgis_script.open_csv_file_legacy, pvgis_script.open_csv_file
+            ):
+            seconds = min(timeit.repeat(
+                lambda: function(filename), number=number, repeat=3
+                )) / number
+            tracemalloc.start()
+            function(filename)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            timings[function.__name__] = seconds, peak
+    return timings
+
+
+def format_energy(kwh):
+    """Formats energy like a PVOUTPUT export, in MWh from 1000 kWh up"""
+    if kwh >= 1000:
+        return f"{kwh / 1000:.3f}MWh"
+    return f"{kwh:,.3f}kWh"
+
+
+def site_name(i):
+    """Returns the name of the i-th synthetic site"""
+    return f"site{i:06d}"
+
+
+def write_pvgis_text(file, lat, lon, power, losses, angle, monthly):
+    """
+    Writes a PVGIS tab delimited monthly file in the layout read by
+    pvgis_script.parse_pvgis_file.
+    """
+    lines = [
+        f"Latitude (decimal degrees):\t{lat:.3f}",
+        f"Longitude (decimal degrees):\t{lon:.3f}",
+        "Radiation database:\tPVGIS-SARAH2",
+        f"Nominal power of the PV system (kW):\t{power:.1f}",
+        f"System losses (%):\t{losses:.1f}",
+        f"Slope angle (deg.):\t{angle}",
+        "Azimuth angle (deg.):\t0",
+        f"Fixed system: inclination={angle} deg., orientation=0 deg.",
+        "Month\tE_d\tE_m\tH(i)_d\tH(i)_m\tSD_m",
+        ]
+    for month, row in enumerate(monthly, start=1):
+        lines.append(f"{month}\t" + "\t".join(f"{value:.2f}" for value in row))
+    lines += [
+        "",
+        "E_d: Average daily energy production from the given system (kWh/d)",
+        "E_m: Average monthly energy production from the given system (kWh/mo)",
+        ]
+    with open(file, "w") as text_file:
+        text_file.write("\n".join(lines) + "\n")
+
+
+def write_pvgis_json(file, lat, lon, power, losses, angle, monthly):
+    """
+    Writes a PVGIS json response with the monthly outputs read by
+    process_json (DF_COLUMN_NAMES), and the inputs, totals and meta blocks
+    of a real response.
+    """
+    rows = [
+        dict(zip(["month", "E_d", "E_m", "H(i)_d", "H(i)_m", "SD_m"], [month, *row]))
+        for month, row in enumerate(np.round(monthly, 2).tolist(), start=1)
+        ]
+    totals = np.round(monthly.mean(axis=0), 2).tolist()
+    response = {
+        "inputs": {
+            "location": {"latitude": lat, "longitude": lon, "elevation": 250.0},
+            "meteo_data": {
+                "radiation_db": "PVGIS-SARAH2", "year_min": 2005,
+                "year_max": 2020,
+                },
+            "mounting_system": {
+                "vertical_axis": {
+                    "slope": {"value": angle, "optimal": False},
+                    "type": "vertical-axis",
+                    },
+                },
+            "pv_module": {
+                "technology": "c-Si", "peak_power": power,
+                "system_loss": losses,
+                },
+            },
+        "outputs": {
+            "monthly": {"vertical_axis": rows},
+            "totals": {
+                "vertical_axis": {
+                    "E_d": totals[0], "E_m": totals[1], "E_y": totals[1] * 12,
+                    "H(i)_d": totals[2], "H(i)_m": totals[3],
+                    "H(i)_y": totals[3] * 12, "SD_m": totals[4],
+                    "SD_y": totals[4] * 3, "l_aoi": -2.8, "l_spec": "1.5",
+                    "l_tg": -5.0, "l_total": -losses,
+                    },
+                },
+            },
+        "meta": {"inputs": {"location": {"description": "synthetic site"}}},
+        }
+    with open(file, "w") as json_file:
+        json.dump(response, json_file)
+
+
+def write_pvoutput_csv(file, power, generated, year=2023):
+    """
+    Writes a PVOUTPUT monthly export, newest month first, with a partial
+    current month on the first row as dropped by pvoutput_csv.to_str.
+    Energy values are mixed MWh and kWh strings.
+    """
+    rows = [{
+        "Month": f"{MONTHS[0]} {(year + 1) % 100:02d}",
+        "Generated": format_energy(generated[0] / 3),
+        "Efficiency": f"{generated[0] / 3 / power:.3f}kWh/kW",
+        "Exported": "0.000kWh", "Low": "0.000kWh",
+        "High": format_energy(generated[0] / 30),
+        "Average": format_energy(generated[0] / 93),
+        }]
+    for month in range(11, -1, -1):
+        average = generated[month] / DAYS_IN_MONTH[month]
+        rows.append({
+            "Month": f"{MONTHS[month]} {year % 100:02d}",
+            "Generated": format_energy(generated[month]),
+            "Efficiency": f"{generated[month] / power:.3f}kWh/kW",
+            "Exported": format_energy(generated[month] * 0.6),
+            "Low": format_energy(average * 0.2),
+            "High": format_energy(average * 1.6),
+            "Average": format_energy(average),
+            })
+    pd.DataFrame(rows).to_csv(file, index=False)
+
+
+def write_pvoutput_daily_csv(file, power, generated, years=(2022, 2023)):
+    """
+    Writes a PVOUTPUT daily export, newest day first, of the monthly
+    generated energy spread evenly over the days of each month of years
+    """
+    days = np.arange(
+        np.datetime64(f"{years[0]}-01-01"), np.datetime64(f"{years[-1] + 1}-01-01")
+        )
+    months = days.astype("datetime64[M]").astype("int64") % 12
+    daily = generated[months] / DAYS_IN_MONTH[months]
+    dates = pd.DatetimeIndex(days).strftime("%d/%m/%y")
+    pd.DataFrame({
+        "Date": dates,
+        "Generated": [f"{kwh:.3f}kWh" for kwh in daily],
+        "Efficiency": [f"{kwh / power:.3f}kWh/kW" for kwh in daily],
+        "Exported": "0.000kWh", "Peak Power": "0.000kW",
+        }).iloc[::-1].to_csv(file, index=False)
+
+
+def generate_fleet(root, n_sites, seed=0, with_json=True, pvoutput_layout="monthly"):
+    """
+    Generates the inputs of n_sites synthetic sites under root, in the
+    pvgis_data, json and csv directories the pipeline reads.
+
+    Parameters
+    ----------
+    root: str
+        directory to write the inputs to
+
+    n_sites: int
+        number of sites
+
+    seed: int
+        seed for the random number generator
+
+    with_json: bool
+        also write a PVGIS json file for every site
+
+    pvoutput_layout: str
+        "monthly" or "daily", the PVOUTPUT export to write
+
+    Returns
+    -------
+    sites: list
+        names of the generated sites
+    """
+    rng = np.random.default_rng(seed)
+    for directory in ("pvgis_data", "json", "csv"):
+        os.makedirs(os.path.join(root, directory), exist_ok=True)
+
+    sites = []
+    for i in range(n_sites):
+        site = site_name(i)
+        lat = float(rng.uniform(35, 60))
+        lon = float(rng.uniform(-10, 30))
+        power = float(rng.choice([1.5, 3.0, 4.5, 6.0, 10.0, 25.0, 50.0]))
+        losses = 14.0
+        angle = int(rng.integers(10, 45))
+
+        e_m = MONTHLY_YIELD * power * rng.uniform(0.85, 1.15)
+        h_m = MONTHLY_YIELD * rng.uniform(1.1, 1.3, 12)
+        monthly = np.column_stack([
+            e_m / DAYS_IN_MONTH, e_m, h_m / DAYS_IN_MONTH, h_m,
+            e_m * rng.uniform(0.05, 0.2, 12),
+            ])
+
+        write_pvgis_text(
+            os.path.join(root, "pvgis_data", f"{site}.csv"), lat, lon,
+            power, losses, angle, monthly,
+            )
+        if with_json:
+            write_pvgis_json(
+                os.path.join(root, "json", f"{site}.json"), lat, lon, power,
+                losses, angle, monthly,
+                )
+        write_pvoutput = (
+            write_pvoutput_daily_csv if pvoutput_layout == "daily"
+            else write_pvoutput_csv
+            )
+        write_pvoutput(
+            os.path.join(root, "csv", f"{site}.csv"), power,
+            e_m * rng.normal(1.0, 0.12, 12).clip(0.3),
+            )
+        sites.append(site)
+    return sites
+
+
+def set_root(root):
+    """Points the input and output directories of the pipeline at root"""
+    output_dir = os.path.join(root, "output_dir")
+    process_json.JSON_DIR = os.path.join(root, "json")
+    process_json.SERIES_DIR = os.path.join(root, "json_hourly")
+    process_json.OUTPUT_DIR = output_dir
+    pvgis_script.CSV_DIR = os.path.join(root, "pvgis_data")
+    pvgis_script.OUTPUT_DIR = output_dir
+    pvoutput_csv.CSV_DIR = os.path.join(root, "csv")
+    pvoutput_csv.OUTPUT_DIR = output_dir
+    main.PARENT_FOLDER = output_dir
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of the process so far in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 2 ** 20
+    return peak / 2 ** 10
+
+
+def time_stage(function, items, trace_memory=False, n_items=None):
+    """
+    Calls function on every item and measures the stage, its throughput
+    being n_items, by default the number of items, per second.
+
+    Returns
+    -------
+    result: dict
+        seconds, items per second, peak rss and, with trace_memory, the
+        peak of python allocations during the stage in MB
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    for item in items:
+        function(item)
+    seconds = time.perf_counter() - start
+
+    result = {
+        "seconds": seconds,
+        "per_second": (
+            (len(items) if n_items is None else n_items) / seconds
+            if seconds else float("inf")
+            ),
+        "peak_rss_mb": peak_rss_mb(),
+        }
+    if trace_memory:
+        result["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return result
+
+
+def bench_fleet(root, sites, trace_memory=False):
+    """
+    Runs the parse, join, stats and plot stages over every site in the
+    current process, one stage at a time. The sites are joined in one
+    main.join_sites block, as a chunk of a run is, and nothing is drawn
+    before the plot stage.
+
+    Returns
+    -------
+    results: dict
+        time_stage result of each stage
+    """
+    set_root(root)
+    site_infos = {}
+    joined = {}
+
+    def parse(site):
+        site_infos[site] = main.parse_site(site)
+
+    def join(sites):
+        block = main.join_sites(sites)
+        for row, site in enumerate(sites):
+            joined[site] = main.joined_site(block, row)
+
+    def stats(site):
+        calculate_stats(frame_path(
+            os.path.join(main.PARENT_FOLDER, site, f"joined_{site}")
+            ))
+
+    def plot(site):
+        main.plot(*joined[site], site_infos[site])
+
+    plot_mode = render.PLOT_MODE
+    render.PLOT_MODE = "off"
+    try:
+        results = {
+            "parse": time_stage(parse, sites, trace_memory),
+            "join": time_stage(join, [sites], trace_memory, len(sites)),
+            "stats": time_stage(stats, sites, trace_memory),
+            }
+    finally:
+        render.PLOT_MODE = plot_mode
+    results["plot"] = time_stage(plot, sites, trace_memory)
+
+    start = time.perf_counter()
+    calculate_fleet_stats(main.PARENT_FOLDER)
+    results["fleet_stats"] = {
+        "seconds": time.perf_counter() - start, "per_second": None,
+        "peak_rss_mb": peak_rss_mb(),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the stages that are slower than in baseline by more than
+    tolerance, as a fraction of the baseline time.
+    """
+    regressions = []
+    for stage, result in results.items():
+        if stage not in baseline:
+            continue
+        limit = baseline[stage]["seconds"] * (1 + tolerance)
+        if result["seconds"] > limit:
+            regressions.append(
+                f"{stage}: {result['seconds']:.3f}s > {limit:.3f}s"
+                )
+    return regressions
+
+
+def print_results(results, n_sites):
+    """Prints a table of time, throughput and memory per stage"""
+    print(f"{n_sites} sites")
+    print(f"{'stage':<12}{'seconds':>10}{'sites/s':>12}{'peak rss MB':>14}")
+    for stage, result in results.items():
+        per_second = result["per_second"]
+        per_second = f"{per_second:.1f}" if per_second else "-"
+        print(
+            f"{stage:<12}{result['seconds']:>10.3f}{per_second:>12}"
+            f"{result['peak_rss_mb']:>14.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter,
+        )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("str_to_float", help="benchmark str_to_float")
+    commands.add_parser(
+        "pvgis_parser", help="benchmark the PVGIS text file parser"
+        )
+
+    fleet_parser = commands.add_parser("fleet", help="benchmark every stage")
+    fleet_parser.add_argument("--sites", type=int, default=100)
+    fleet_parser.add_argument("--seed", type=int, default=0)
+    fleet_parser.add_argument(
+        "--root", default=None,
+        help="directory for the generated inputs and outputs, defaults to a "
+        "temporary directory",
+        )
+    fleet_parser.add_argument(
+        "--trace-memory", action="store_true",
+        help="also measure the peak of python allocations of each stage",
+        )
+    fleet_parser.add_argument("--json", help="write the results to a file")
+    fleet_parser.add_argument(
+        "--baseline", help="results file of an earlier run to compare with"
+        )
+    fleet_parser.add_argument("--tolerance", type=float, default=0.25)
+    fleet_parser.add_argument(
+        "--pvoutput-layout", choices=["monthly", "daily"], default="monthly",
+        help="layout of the generated PVOUTPUT exports",
+        )
+    args = parser.parse_args()
+
+    if args.command == "str_to_float":
+        for rows in (100, 1000, 10000):
+            timings = bench_str_to_float(rows)
+            speedup = timings["str_to_float_legacy"] / timings["str_to_float"]
+            print(
+                f"rows={rows} legacy={timings['str_to_float_legacy']:.4f}s "
+                f"vectorized={timings['str_to_float']:.4f}s "
+                f"speedup={speedup:.1f}x"
+                )
+        sys.exit()
+
+    if args.command == "pvgis_parser":
+        for name, (seconds, peak) in bench_pvgis_parser().items():
+            print(f"{name} {seconds * 1e6:.0f}us {peak / 1024:.0f}KiB peak")
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = args.root or tmp_dir
+        sites = generate_fleet(
+            root, args.sites, args.seed, pvoutput_layout=args.pvoutput_layout
+            )
+        results = bench_fleet(root, sites, args.trace_memory)
+
+    print_results(results, len(sites))
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump({"sites": len(sites), "stages": results}, json_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as json_file:
+            baseline = json.load(json_file)["stages"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("regressions:\n" + "\n".join(regressions))
+            sys.exit(1)
@@ -0,0 +1,155 @@
+"""
+Precomputed calendar of the years FIRST_YEAR to LAST_YEAR.
+
+Every array is indexed by year - FIRST_YEAR and dates are days since
+1970-01-01, the integer value of datetime64[D]. Month lengths, month and
+ISO week boundaries and day offsets are built once at import, so binning
+hourly or daily data of many years is a table lookup instead of
+per row datetime work.
+"""
+import numpy as np
+
+FIRST_YEAR = 1900
+
+LAST_YEAR = 2100
+
+PERIODS = ("day", "week", "month")
+
+N_MONTHS = 12
+
+YEARS = np.arange(FIRST_YEAR, LAST_YEAR + 1)
+
+IS_LEAP = (YEARS % 4 == 0) & ((YEARS % 100 != 0) | (YEARS % 400 == 0))
+
+_months = np.arange(
+    np.datetime64(f"{FIRST_YEAR}-01"), np.datetime64(f"{LAST_YEAR + 1}-02")
+    ).astype("datetime64[D]").astype("int64")
+
+# (years x 13) first day of each month and of the next year
+MONTH_STARTS = np.column_stack([
+    _months[:-1].reshape(-1, N_MONTHS), _months[N_MONTHS::N_MONTHS]
+    ])
+
+YEAR_STARTS = MONTH_STARTS[:, 0]
+
+MONTH_DAYS = np.diff(MONTH_STARTS, axis=1)
+
+# (years x 13) day of the year each month starts at, the last is the
+# number of days of the year
+DAY_OFFSETS = MONTH_STARTS - YEAR_STARTS[:, None]
+
+# (2 x 366) month of each day of the year, of common and leap years
+DAY_MONTHS = np.array([
+    np.repeat(np.arange(1, N_MONTHS + 1), MONTH_DAYS[IS_LEAP.argmin()]).tolist()
+    + [N_MONTHS],
+    np.repeat(np.arange(1, N_MONTHS + 1), MONTH_DAYS[IS_LEAP.argmax()]),
+    ])
+
+
+def weekday(days):
+    """Returns the ISO weekday counted from 0, Monday, of days"""
+    # 1970-01-01 was a Thursday
+    return (np.asarray(days) + 3) % 7
+
+
+# Monday of ISO week 1, the week with January 4, of each year and the next
+_january_4 = np.append(YEAR_STARTS, MONTH_STARTS[-1, -1]) + 3
+ISO_WEEK_STARTS = _january_4 - weekday(_january_4)
+
+WEEKS_IN_YEAR = np.diff(ISO_WEEK_STARTS) // 7
+
+for _array in (
+    IS_LEAP, MONTH_STARTS, YEAR_STARTS, MONTH_DAYS, DAY_OFFSETS, DAY_MONTHS,
+    ISO_WEEK_STARTS, WEEKS_IN_YEAR,
+    ):
+    _array.flags.writeable = False
+
+
+def year_index(year):
+    """
+    Returns the row of year in the tables.
+
+    Raises
+    ------
+    ValueError
+        if a year is outside FIRST_YEAR to LAST_YEAR
+    """
+    index = np.asarray(year) - FIRST_YEAR
+    if np.any((index < 0) | (index >= len(YEARS))):
+        raise ValueError(
+            f"years must be within {FIRST_YEAR} and {LAST_YEAR}, got "
+            f"{np.min(year)} to {np.max(year)}"
+            )
+    return index
+
+
+def to_days(year, month, day):
+    """Returns the days since 1970-01-01 of year, month and day arrays"""
+    return MONTH_STARTS[year_index(year), np.asarray(month) - 1] + (
+        np.asarray(day) - 1
+        )
+
+
+def year_month_day(days):
+    """Returns the year, month and day of each of days"""
+    days = np.asarray(days)
+    row = np.searchsorted(YEAR_STARTS, days, side="right") - 1
+    year_index(row + FIRST_YEAR)
+    offset = days - YEAR_STARTS[row]
+    month = DAY_MONTHS[IS_LEAP[row].astype("int64"), offset]
+    return row + FIRST_YEAR, month, offset - DAY_OFFSETS[row, month - 1] + 1
+
+
+def iso_week(days):
+    """Returns the ISO year and week of each of days"""
+    days = np.asarray(days)
+    row = np.searchsorted(ISO_WEEK_STARTS, days, side="right") - 1
+    year_index(row + FIRST_YEAR)
+    return row + FIRST_YEAR, (days - ISO_WEEK_STARTS[row]) // 7 + 1
+
+
+def period_edges(year, period):
+    """
+    Returns the first day of each day or month of a year and the first day
+    of the next year, or the Monday of each ISO week of the ISO year and
+    the Monday of the next ISO year, as datetime64[D]
+    """
+    return series_edges(year, year, period)
+
+
+def series_edges(first_year, last_year, period):
+    """
+    Returns the edges of the periods of the years first_year to last_year,
+    one of PERIODS, see period_edges
+    """
+    first = year_index(first_year)
+    last = year_index(last_year)
+    if period == "day":
+        edges = np.arange(YEAR_STARTS[first], MONTH_STARTS[last, -1] + 1)
+    elif period == "week":
+        edges = np.arange(
+            ISO_WEEK_STARTS[first], ISO_WEEK_STARTS[last + 1] + 1, 7
+            )
+    elif period == "month":
+        edges = np.append(MONTH_STARTS[first:last + 1, :-1], MONTH_STARTS[last, -1])
+    else:
+        raise ValueError(
+            f"unknown period {period!r}, expected one of {', '.join(PERIODS)}"
+            )
+    return edges.astype("datetime64[D]")
+
+
+def period_labels(starts, period):
+    """
+    Returns the calendar columns of periods starting at datetime64[D]
+    starts: "Year" and "Month" or "Day", or ISO "Year" and "Week"
+    """
+    days = np.asarray(starts).astype("datetime64[D]").astype("int64")
+    if period == "week":
+        year, week = iso_week(days)
+        return {"Year": year, "Week": week}
+    year, month, day = year_month_day(days)
+    labels = {"Year": year, "Month": month}
+    if period == "day":
+        labels["Day"] = day
+    return labels
@@ -0,0 +1,336 @@
+"""
+Multi-year analytics cube of the errors of PVGIS against PVOUTPUT.
+
+The joined months of every site, see month_join.MonthJoin, are scattered
+into one (sites x years x 12 x metrics) float32 cube of the METRICS of
+each measured month, NaN where a site has no data. Alongside it the
+additive components of the metrics, COMPONENTS, are summed once per
+(size bin x year x month), size bins being the nominal power of the
+systems in SIZE_EDGES from the SiteTable, and the rollups by month of
+year, by year and by size bin are derived from those sums. Everything is
+written to CUBE_FILE in the output directory as one array per column, so
+fleet questions such as the PVGIS bias in December of systems of 10 KW
+and more are answered from the sums without reading any site again:
+
+    python cube.py query --month 12 --min-power 10
+
+The error of a month is (actual - predicted) / actual and its bias
+predicted - actual, in KWh. Rolled up, error and abs_error are the means
+over the months and bias the relative bias sum(predicted - actual) /
+sum(actual), positive where PVGIS overestimates.
+"""
+import os
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+
+import storage
+from storage import extension, frame_stem, list_frames, read_frames, split_stem
+from artifact_index import load_index
+from site_info import SiteTable
+from month_join import JOINED_MONTHS_COLUMNS
+from file_io import replacing
+
+CUBE_FILE = "analytics_cube.npz"
+
+N_MONTHS = 12
+
+METRICS = ("error", "abs_error", "bias", "actual")
+
+COMPONENTS = ("count", "error", "abs_error", "bias", "actual")
+
+ROLLUPS = ("month", "year", "size")
+
+# Lower edges, in KW, of the size bins. Sites without a known power are
+# in a last "unknown" bin.
+SIZE_EDGES = np.array([0, 4, 10, 30, 100, np.inf])
+
+SIZE_LABELS = (
+    "<4 kW", "4-10 kW", "10-30 kW", "30-100 kW", ">=100 kW", "unknown",
+    )
+
+
+def size_bins(power):
+    """Returns the size bin of each of power, the last bin if NaN"""
+    power = np.asarray(power, dtype="float64")
+    bins = np.searchsorted(SIZE_EDGES, power, side="right") - 1
+    bins[np.isnan(power)] = len(SIZE_LABELS) - 1
+    return bins
+
+
+def load_joined_months(dir_, paths=None, fmt=None):
+    """
+    Returns the joined months of every site under dir_ as one data frame
+    with a site column, from the joined_months frames at paths, by default
+    those in dir_ of fmt, one of storage.FORMATS, or else the intermediate
+    format
+    """
+    if paths is None:
+        if (fmt or storage.INTERMEDIATE_FORMAT) == "sqlite":
+            paths = list_frames(dir_, "joined_months")
+        else:
+            paths = load_index(dir_).find("joined_months", extension(fmt))
+    if not paths:
+        return pd.DataFrame(columns=["site"] + JOINED_MONTHS_COLUMNS)
+
+    df = read_frames(paths)
+    sites = np.array([split_stem(frame_stem(path))[2] for path in paths])
+    df.insert(0, "site", sites[df.pop("frame").to_numpy(dtype="int64")])
+    return df
+
+
+class AnalyticsCube():
+    """
+    Parameters
+    ----------
+    sites: numpy.ndarray
+        site of each row of the cube
+
+    power: numpy.ndarray
+        nominal power in KW of each site, NaN if unknown
+
+    years: numpy.ndarray
+        year of each column of the cube
+
+    cube: numpy.ndarray
+        (sites x years x 12 x METRICS) float32
+
+    sums: numpy.ndarray
+        (size bins x years x 12 x COMPONENTS) float64 sums of the months
+        with a finite error, see sum_components
+    """
+    def __init__(self, sites, power, years, cube, sums=None):
+        self.sites = np.asarray(sites, dtype=str)
+        self.power = np.asarray(power, dtype="float32")
+        self.years = np.asarray(years, dtype="int64")
+        self.cube = cube
+        self.size = size_bins(self.power)
+        self.sums = self.sum_components() if sums is None else sums
+
+    @classmethod
+    def from_frame(cls, df, site_table=None):
+        """
+        Builds the cube of joined months with a site column, see
+        load_joined_months, and the power of the sites in site_table
+        """
+        sites, site = np.unique(df["site"].to_numpy(dtype=str), return_inverse=True)
+        years, year = np.unique(df["Year"].to_numpy(dtype="int64"), return_inverse=True)
+        month = df["Month"].to_numpy(dtype="int64") - 1
+        predicted = df["PVGIS Generated"].to_numpy(dtype="float32")
+        actual = df["PVOUTPUT Generated"].to_numpy(dtype="float32")
+        error = df["Error"].to_numpy(dtype="float32")
+
+        cube = np.full(
+            (len(sites), len(years), N_MONTHS, len(METRICS)), np.nan,
+            dtype="float32",
+            )
+        cube[site, year, month] = np.column_stack(
+            (error, np.abs(error), predicted - actual, actual)
+            )
+
+        power = np.full(len(sites), np.nan, dtype="float32")
+        if site_table is not None:
+            rows = [site_table.index.get(name, -1) for name in sites.tolist()]
+            rows = np.array(rows, dtype="int64")
+            known = rows >= 0
+            power[known] = site_table.array["power"][rows[known]]
+        return cls(sites, power, years, cube)
+
+    @classmethod
+    def build(cls, dir_, paths=None, fmt=None):
+        """
+        Builds the cube of every site under dir_, or of the joined_months
+        frames at paths, and saves it in dir_, see load_joined_months.
+
+        Raises
+        ------
+        ValueError
+            if no joined months are found, a saved cube is left as it is
+        """
+        df = load_joined_months(dir_, paths, fmt)
+        if not len(df):
+            raise ValueError(
+                f"no joined months found in {dir_}"
+                + (f" in the {fmt} format" if fmt else "")
+                )
+        try:
+            site_table = SiteTable.load(dir_)
+        except FileNotFoundError:
+            logging.warning(f"no site table in {dir_}, sizes are unknown")
+            site_table = None
+        analytics_cube = cls.from_frame(df, site_table)
+        analytics_cube.save(dir_)
+        return analytics_cube
+
+    def sum_components(self):
+        """
+        Returns the (size bins x years x 12 x COMPONENTS) sums of the
+        months of each size bin, skipping months without a finite error
+        """
+        values = self.cube.astype("float64")
+        valid = np.isfinite(values[..., METRICS.index("error")])
+        values[~valid] = 0
+        components = np.concatenate(
+            (valid[..., None].astype("float64"), values), axis=-1
+            )
+
+        sums = np.zeros(
+            (len(SIZE_LABELS),) + components.shape[1:], dtype="float64"
+            )
+        np.add.at(sums, self.size, components)
+        return sums
+
+    def save(self, dir_):
+        """Writes the cube, its sums and rollups to CUBE_FILE in dir_"""
+        rollups = {
+            f"by_{by}": np.stack(list(self.rollup(by).values()), axis=-1)
+            for by in ROLLUPS
+            }
+        path = os.path.join(dir_, CUBE_FILE)
+        with replacing(path) as tmp_path, open(tmp_path, "wb") as file:
+            np.savez_compressed(
+                file, sites=self.sites, power=self.power, years=self.years,
+                cube=self.cube, sums=self.sums, metrics=np.array(METRICS),
+                components=np.array(COMPONENTS), **rollups,
+                )
+
+    @classmethod
+    def load(cls, dir_):
+        """Reads the cube written by save to dir_"""
+        with np.load(os.path.join(dir_, CUBE_FILE)) as arrays:
+            return cls(
+                arrays["sites"], arrays["power"], arrays["years"],
+                arrays["cube"], arrays["sums"],
+                )
+
+    @staticmethod
+    def metrics(sums):
+        """
+        Returns the rolled up metrics of component sums, the
+        COMPONENTS being the last axis
+        """
+        count, error, abs_error, bias, actual = np.moveaxis(sums, -1, 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return {
+                "count": count,
+                "error": error / count,
+                "abs_error": abs_error / count,
+                "bias": bias / actual,
+                }
+
+    def rollup(self, by):
+        """
+        Returns the metrics of every month of year, year or size bin,
+        one of ROLLUPS, as a dict of arrays
+        """
+        axes = {"size": (1, 2), "year": (0, 2), "month": (0, 1)}
+        if by not in axes:
+            raise ValueError(
+                f"unknown rollup {by!r}, expected one of {', '.join(ROLLUPS)}"
+                )
+        return self.metrics(self.sums.sum(axis=axes[by]))
+
+    def query(self, months=None, years=None, min_power=None, max_power=None):
+        """
+        Returns the rolled up metrics of the months, years and systems with
+        min_power <= power < max_power, in KW. Powers on SIZE_EDGES are
+        answered from the sums, other powers from the cube.
+
+        Parameters
+        ----------
+        months, years: list
+            calendar months (1 to 12) and years, every one if not given
+
+        Returns
+        -------
+        metrics: dict
+            count, error, abs_error and bias as floats
+        """
+        month_mask = np.ones(N_MONTHS, dtype=bool)
+        if months is not None:
+            month_mask[:] = False
+            month_mask[np.asarray(months, dtype="int64") - 1] = True
+        year_mask = np.ones(len(self.years), dtype=bool)
+        if years is not None:
+            year_mask = np.isin(self.years, years)
+
+        edges = SIZE_EDGES.tolist()
+        if all(power is None or power in edges for power in (min_power, max_power)):
+            bins = np.arange(len(SIZE_LABELS))
+            if min_power is not None or max_power is not None:
+                lower = edges[:-1]
+                bins = bins[:-1][
+                    (np.array(lower) >= (min_power or 0))
+                    & (np.array(edges[1:]) <= (max_power or np.inf))
+                    ]
+            sums = self.sums[bins][:, year_mask][:, :, month_mask]
+        else:
+            power = self.power.astype("float64")
+            site_mask = (power >= (min_power or 0)) & (
+                power < (np.inf if max_power is None else max_power)
+                )
+            selected = AnalyticsCube(
+                self.sites[site_mask], self.power[site_mask], self.years,
+                self.cube[site_mask][:, year_mask][:, :, month_mask],
+                )
+            sums = selected.sums
+
+        sums = sums.reshape(-1, len(COMPONENTS)).sum(axis=0)
+        return {name: float(value) for name, value in self.metrics(sums).items()}
+
+
+def main():
+    dir_ = os.path.join(os.path.dirname(__file__), "output_dir")
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-d", "--dir", default=dir_, help="output directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser(
+        "build", help=f"build {CUBE_FILE} from the joined months"
+        )
+    build.add_argument(
+        "-f", "--format", choices=list(storage.FORMATS), default=None,
+        help="format of the joined months, defaults to "
+        "$PV_INTERMEDIATE_FORMAT or csv",
+        )
+    query = commands.add_parser("query", help="metrics of a slice of the fleet")
+    query.add_argument("--month", type=int, nargs="+", default=None)
+    query.add_argument("--year", type=int, nargs="+", default=None)
+    query.add_argument("--min-power", type=float, default=None, help="KW")
+    query.add_argument("--max-power", type=float, default=None, help="KW")
+    rollup = commands.add_parser("rollup", help="metrics by month, year or size")
+    rollup.add_argument("by", choices=ROLLUPS)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        try:
+            analytics_cube = AnalyticsCube.build(args.dir, fmt=args.format)
+        except ValueError as err:
+            parser.error(err)
+        print(
+            f"{len(analytics_cube.sites)} sites, "
+            f"{len(analytics_cube.years)} years written to "
+            f"{os.path.join(args.dir, CUBE_FILE)}"
+            )
+        return
+
+    analytics_cube = AnalyticsCube.load(args.dir)
+    if args.command == "query":
+        metrics = analytics_cube.query(
+            args.month, args.year, args.min_power, args.max_power
+            )
+        print(" ".join(f"{name}={value:.4g}" for name, value in metrics.items()))
+    else:
+        labels = {
+            "month": range(1, N_MONTHS + 1),
+            "year": analytics_cube.years.tolist(),
+            "size": SIZE_LABELS,
+            }[args.by]
+        print(pd.DataFrame(
+            analytics_cube.rollup(args.by), index=pd.Index(labels, name=args.by)
+            ).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Discovery and concurrent loading of the pipeline's input files.
+
+Directories are listed with os.scandir, which gets the file type from the
+directory entry instead of a stat per file. Input files are read by a
+small thread pool, a bounded number of files or sites ahead of the
+parsers, so on high latency storage the reads of the next files overlap
+the parsing of the current one. Parsers take the bytes of a FileBuffer
+instead of opening the file themselves.
+
+Files of MMAP_THRESHOLD bytes or more, e.g. multi-year PVOUTPUT exports,
+are memory mapped instead of read, and the parsers read the map through
+as_file without copying the whole file into a bytes object.
+
+Outputs are written through replacing, to a temporary file moved over
+the output, so every write changes the modification time of the output's
+directory and artifact_index.ArtifactIndex sees it without a stat per
+file.
+"""
+import io
+import os
+import mmap
+from contextlib import contextmanager
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+
+PREFETCH_WORKERS = 8
+
+PREFETCH_AHEAD = 32
+
+MMAP_THRESHOLD = 1 << 20
+
+
+class FileBuffer(namedtuple("FileBuffer", ["path", "data", "stat"])):
+    """
+    A file read by read_file: its path, content and os.stat_result. The
+    content is bytes, or a read only mmap.mmap released by close.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def mapped(self):
+        return isinstance(self.data, mmap.mmap)
+
+    def close(self):
+        if self.mapped:
+            self.data.close()
+
+
+def scan_files(directory, extension):
+    """
+    Returns the sorted names of the files in directory ending with
+    extension, an empty list if directory does not exist
+    """
+    try:
+        with os.scandir(directory) as entries:
+            return sorted(
+                entry.name for entry in entries
+                if entry.name.endswith(extension) and entry.is_file()
+                )
+    except FileNotFoundError:
+        return []
+
+
+def scan_dirs(directory):
+    """
+    Returns the sorted names of the directories in directory, an empty list
+    if directory does not exist
+    """
+    try:
+        with os.scandir(directory) as entries:
+            return sorted(entry.name for entry in entries if entry.is_dir())
+    except FileNotFoundError:
+        return []
+
+
+def read_file(path, mmap_threshold=MMAP_THRESHOLD):
+    """
+    Reads a whole file, or maps it if it has at least mmap_threshold bytes.
+
+    Returns
+    -------
+    buffer: FileBuffer
+        the path, content and os.stat_result of the file, taken when it was
+        opened
+    """
+    with open(path, "rb") as file:
+        stat = os.fstat(file.fileno())
+        if stat.st_size and stat.st_size >= mmap_threshold:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            return FileBuffer(path, data, stat)
+        return FileBuffer(path, file.read(), stat)
+
+
+def as_file(data):
+    """
+    Returns a binary file like object over the content of a FileBuffer,
+    for parsers that read files, without copying it
+    """
+    if isinstance(data, mmap.mmap):
+        data.seek(0)
+        return data
+    return io.BytesIO(data)
+
+
+def prefetch(paths, workers=PREFETCH_WORKERS, ahead=PREFETCH_AHEAD):
+    """
+    Reads files concurrently with at most ahead reads in flight or waiting
+    to be consumed.
+
+    Parameters
+    ----------
+    paths: iterable
+        paths of the files, consumed lazily
+
+    workers: int
+        number of reader threads
+
+    ahead: int
+        number of files read ahead of the consumer
+
+    Yields
+    ------
+    buffer: FileBuffer
+        in the order the reads complete
+    """
+    paths = iter(paths)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {
+            executor.submit(read_file, path) for path in islice(paths, ahead)
+            }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for path in islice(paths, 1):
+                    pending.add(executor.submit(read_file, path))
+                yield future.result()
+
+
+def prefetch_groups(groups, workers=PREFETCH_WORKERS, ahead=PREFETCH_AHEAD):
+    """
+    Reads the files of groups, e.g. the inputs of each site, concurrently
+    with at most ahead groups read ahead of the consumer.
+
+    Parameters
+    ----------
+    groups: iterable
+        (key, paths) pairs, consumed lazily
+
+    Yields
+    ------
+    group: tuple
+        (key, buffers) in the order of groups, where buffers maps each path
+        of the group to its FileBuffer
+    """
+    groups = iter(groups)
+    queue = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit(group):
+            key, paths = group
+            queue.append((key, {
+                path: executor.submit(read_file, path) for path in paths
+                }))
+
+        for group in islice(groups, ahead):
+            submit(group)
+        while queue:
+            key, futures = queue.popleft()
+            for group in islice(groups, 1):
+                submit(group)
+            yield key, {path: future.result() for path, future in futures.items()}
+
+
+@contextmanager
+def replacing(path):
+    """
+    Yields a temporary path next to path, to write the new content of path
+    to, and moves it over path once written. The temporary file is removed
+    if writing it fails.
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        yield tmp_path
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
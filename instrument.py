@@ -0,0 +1,263 @@
+"""
+Logging setup and per-stage instrumentation of the pipeline.
+
+Every stage of a site, e.g. parsing a file, a join or a plot, is run in
+a stage context (or a function decorated with timed) that records its
+wall time, CPU time, rows processed and peak memory. The records of a run
+are collected with pop_records, also from worker processes, and turned
+into a json run report and a human summary by build_report and summary.
+
+Stages can be nested, e.g. the plot of a file inside its parse stage.
+The wall and cpu times of a stage include its nested stages, self_wall
+and self_cpu exclude them, so the self times of all stages add up to
+the time of the run spent in stages.
+
+Peak memory is the peak of python allocations during the stage when
+tracemalloc is tracing, and the peak resident set size of the process
+otherwise.
+"""
+import sys
+import json
+import time
+import logging
+import resource
+import functools
+import tracemalloc
+from contextlib import contextmanager
+
+from file_io import replacing
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+LOG_FILE = "debug.log"
+
+REPORT_FILE = "run_report.json"
+
+RECORDS = []
+
+CURRENT_SITE = None
+
+_STACK = []
+
+
+def configure_logging(level=logging.INFO, log_file=LOG_FILE):
+    """Logs to stderr and, if log_file is given, to log_file"""
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.insert(0, logging.FileHandler(log_file))
+    logging.basicConfig(level=level, format=LOG_FORMAT, handlers=handlers)
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of the process so far in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 2 ** 20
+    return peak / 2 ** 10
+
+
+@contextmanager
+def site(name):
+    """Attributes the stages run in the context to the site name"""
+    global CURRENT_SITE
+    previous = CURRENT_SITE
+    CURRENT_SITE = name
+    try:
+        yield
+    finally:
+        CURRENT_SITE = previous
+
+
+@contextmanager
+def stage(name, rows=None):
+    """
+    Records the wall time, CPU time, rows and peak memory of the code run
+    in the context. Stages can be nested, the time of a nested stage is
+    also counted in its parents' wall and cpu but not in their self_wall
+    and self_cpu.
+
+    Parameters
+    ----------
+    name: str
+        name of the stage
+
+    rows: int
+        number of rows processed, can also be set later with count_rows
+
+    Yields
+    ------
+    record: dict
+        the record of the stage
+    """
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        if _STACK:
+            _STACK[-1]["traced_peak"] = max(
+                _STACK[-1]["traced_peak"], tracemalloc.get_traced_memory()[1]
+                )
+        tracemalloc.reset_peak()
+
+    record = {
+        "site": CURRENT_SITE, "stage": name, "depth": len(_STACK),
+        "rows": rows,
+        }
+    _STACK.append({
+        "record": record, "traced_peak": 0, "nested_wall": 0.0,
+        "nested_cpu": 0.0,
+        })
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record["wall"] = time.perf_counter() - wall
+        record["cpu"] = time.process_time() - cpu
+        frame = _STACK.pop()
+        record["self_wall"] = record["wall"] - frame["nested_wall"]
+        record["self_cpu"] = record["cpu"] - frame["nested_cpu"]
+        if _STACK:
+            _STACK[-1]["nested_wall"] += record["wall"]
+            _STACK[-1]["nested_cpu"] += record["cpu"]
+        if tracing:
+            traced_peak = max(
+                frame["traced_peak"], tracemalloc.get_traced_memory()[1]
+                )
+            if _STACK:
+                _STACK[-1]["traced_peak"] = max(
+                    _STACK[-1]["traced_peak"], traced_peak
+                    )
+            record["peak_mb"] = traced_peak / 2 ** 20
+        else:
+            record["peak_mb"] = peak_rss_mb()
+        RECORDS.append(record)
+
+
+def timed(name):
+    """
+    Decorates a function to run it as the stage name. The rows of the
+    stage are the length of a data frame passed as first argument, unless
+    the function sets them with count_rows.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            rows = None
+            if args and hasattr(args[0], "shape"):
+                rows = args[0].shape[0]
+            with stage(name, rows):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count_rows(rows):
+    """Sets the rows processed by the innermost running stage"""
+    if _STACK:
+        _STACK[-1]["record"]["rows"] = int(rows)
+
+
+def pop_records():
+    """Returns and clears the records of the stages run so far"""
+    records = RECORDS[:]
+    RECORDS.clear()
+    return records
+
+
+def build_report(records, wall, **info):
+    """
+    Builds the run report of a run.
+
+    Parameters
+    ----------
+    records: list
+        stage records of the run
+
+    wall: float
+        wall time of the whole run in seconds
+
+    info:
+        further items of the report, e.g. the number of workers
+
+    Returns
+    -------
+    report: dict
+        with the totals of each stage in "stages", wall and cpu including
+        nested stages and self_wall and self_cpu without, the totals of
+        the top level stages of each site in "sites" and every record in
+        "records"
+    """
+    stages = {}
+    sites = {}
+    for record in records:
+        totals = stages.setdefault(record["stage"], {
+            "count": 0, "wall": 0.0, "cpu": 0.0, "self_wall": 0.0,
+            "self_cpu": 0.0, "rows": 0, "peak_mb": 0.0,
+            })
+        totals["count"] += 1
+        totals["wall"] += record["wall"]
+        totals["cpu"] += record["cpu"]
+        totals["self_wall"] += record.get("self_wall", record["wall"])
+        totals["self_cpu"] += record.get("self_cpu", record["cpu"])
+        totals["rows"] += record["rows"] or 0
+        totals["peak_mb"] = max(totals["peak_mb"], record["peak_mb"])
+
+        if record["depth"] == 0 and record["site"] is not None:
+            totals = sites.setdefault(record["site"], {"wall": 0.0, "cpu": 0.0})
+            totals["wall"] += record["wall"]
+            totals["cpu"] += record["cpu"]
+
+    return {
+        "started": time.strftime(
+            "%Y-%m-%dT%H:%M:%S", time.localtime(time.time() - wall)
+            ),
+        "wall": wall,
+        "memory": "traced" if tracemalloc.is_tracing() else "rss",
+        **info,
+        "stages": stages,
+        "sites": sites,
+        "records": records,
+        }
+
+
+def write_report(report, path):
+    """Writes a run report as json"""
+    with replacing(path) as tmp_path, open(tmp_path, "w") as file:
+        json.dump(report, file, indent=1)
+
+
+def summary(report, top=5):
+    """
+    Returns a text summary of a run report with the stages by total self
+    wall time, which add up without counting nested stages twice, and the
+    top slowest sites.
+    """
+    lines = [
+        f"run took {report['wall']:.2f}s",
+        f"{'stage':<22}{'count':>8}{'self s':>10}{'wall s':>10}{'cpu s':>10}"
+        f"{'rows':>10}{'peak MB':>10}",
+        ]
+    stages = sorted(
+        report["stages"].items(),
+        key=lambda item: item[1].get("self_wall", item[1]["wall"]),
+        reverse=True,
+        )
+    for name, totals in stages:
+        lines.append(
+            f"{name:<22}{totals['count']:>8}"
+            f"{totals.get('self_wall', totals['wall']):>10.2f}"
+            f"{totals['wall']:>10.2f}{totals['cpu']:>10.2f}"
+            f"{totals['rows']:>10}{totals['peak_mb']:>10.1f}"
+            )
+
+    sites = sorted(
+        report["sites"].items(), key=lambda item: item[1]["wall"],
+        reverse=True,
+        )[:top]
+    if sites:
+        lines.append(f"slowest {len(sites)} sites")
+        for name, totals in sites:
+            lines.append(
+                f"  {name:<20}{totals['wall']:>10.2f}s wall"
+                f"{totals['cpu']:>10.2f}s cpu"
+                )
+    return "\n".join(lines)
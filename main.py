@@ -1,116 +1,525 @@
 import os
-from pathlib import Path
+import time
 import logging
-from math import floor
+import argparse
+import tracemalloc
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
-import pandas as pd
 import numpy as np
-from matplotlib import pyplot as plt
-
-from .process_json import main as json_main
-from .pvgis_script import main as pvgis_main
-from .pvoutput_script import pvoutput_main
-from .statistics import calculate_stats
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler("debug.log"),
-        logging.StreamHandler()
-    ]
-)
+
+import process_json
+import pvgis_script
+import pvoutput_csv
+from statistics import calculate_stats, calculate_fleet_stats
+from manifest import Manifest, code_version
+import storage
+from storage import (
+    frame_path, read_frames, write_frame, write_joined,
+    )
+import render as renderer
+from render import render
+import instrument
+from instrument import count_rows, timed
+from site_info import SiteInfo, SiteTable
+from monthly_block import MonthlyBlock
+from month_join import MonthJoin, climatology
+from aggregate import ErrorSummary
+from file_io import prefetch_groups, scan_files
+from artifact_index import load_index
+from cube import AnalyticsCube
 
 PARENT_FOLDER = os.path.join(os.path.dirname(__file__), "output_dir")
 
+VERSION = code_version(__file__)
+
+WORKER_MANIFEST = None
 
-def main():
-    json_main()
-    pvoutput_main()
-    pvgis_main()
-    error_list = []
-    df_list = join_dfs()
-    for item in df_list:
-        plot(item[0], item[1], item[2], item[3], item[4]) 
-        error_list.append(item[4])
-    mean_error = sum(error_list) / len(error_list)
-    sorted_error = sorted(error_list)
-    median_error = sorted_error[(floor(len(error_list) / 2))]
+EXPORT_CSV = False
 
-    print(sorted_error)
-    print("Mean error", mean_error, len(error_list))
-    print("Median Error", median_error)
-    calculate_stats()
+JOINED_COLUMNS = ["Month", "PVGIS Generated", "PVOUTPUT Generated", "Error"]
 
+N_MONTHS = 12
 
-def get_folder_names():
-    """Returns all folder names in output directory"""
-    folder_list = []
-    
-    for folder in os.listdir(PARENT_FOLDER):
-        folder_list.append(folder)
-    
-    return folder_list
+SiteInput = namedtuple("SiteInput", ["parse", "manifest_entry", "version", "path"])
 
-def truncate(num):
-    return round(num, 2)
 
-def join_dfs():
+def main(
+    workers=None, fmt=None, export_csv=False, plot_mode=None,
+    fleet_stats=False, trace_memory=False, analytics_cube=False,
+    ):
     """
-    Creates a csv file with generated power from processed PVGIS and 
-    PVOUTPUT files as columns, using month as index
+    Parses, joins, plots and calculates statistics for every site, fanning
+    the sites out over a process pool. Sites whose inputs are unchanged
+    since the last run are skipped, see manifest.Manifest.
+
+    Parameters
+    ----------
+    workers: int
+        number of worker processes, defaults to the number of CPUs. With 1
+        every site is processed in the current process.
+
+    fmt: str
+        format of the files passed between stages, one of storage.FORMATS,
+        defaults to storage.INTERMEDIATE_FORMAT
+
+    export_csv: bool
+        also write the joined files as csv when fmt is not csv
+
+    plot_mode: str
+        one of render.PLOT_MODES, defaults to render.PLOT_MODE. With
+        "deferred" only the data of the plots is recorded, to be drawn
+        later by render_service.
+
+    fleet_stats: bool
+        also write the statistics of every site to one fleet_stats.csv
+
+    trace_memory: bool
+        report the peak of python allocations of each stage, with
+        tracemalloc, instead of the peak resident memory of the process
+
+    analytics_cube: bool
+        also build the cube of the errors of every site by year and month,
+        see cube.AnalyticsCube
+
+    The time, rows and memory of every stage of every site are written to
+    a run report in the output directory, see instrument.build_report.
     """
-    folder_list = get_folder_names()
+    start = time.perf_counter()
+    fmt = fmt or storage.INTERMEDIATE_FORMAT
+    plot_mode = plot_mode or renderer.PLOT_MODE
+    configure(fmt, export_csv, plot_mode, trace_memory)
+    manifest = Manifest(PARENT_FOLDER)
+    sites = get_site_names(load_index(PARENT_FOLDER))
+    errors = ErrorSummary()
+    records = []
+
+    workers = workers or os.cpu_count()
+
+    if workers == 1:
+        errors = process_sites(sites, manifest)
+        records = instrument.pop_records()
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker,
+            initargs=(manifest, fmt, export_csv, plot_mode, trace_memory),
+            ) as executor:
+            chunksize = max(1, len(sites) // (workers * 4))
+            chunks = [
+                sites[i:i + chunksize] for i in range(0, len(sites), chunksize)
+                ]
+            for chunk_errors, changes, chunk_records in executor.map(
+                process_sites_in_worker, chunks
+                ):
+                errors.merge(chunk_errors)
+                manifest.update(changes)
+                records.extend(chunk_records)
+    collect_site_infos(manifest, sites).save(PARENT_FOLDER)
+    manifest.save()
+
+    summary = errors.summary()
+    print(
+        "Error", " ".join(f"{name}={value:.4g}" for name, value in summary.items())
+        )
+
+    if fleet_stats:
+        with instrument.stage("calculate_fleet_stats"):
+            calculate_fleet_stats(PARENT_FOLDER, joined_frames(sites))
+        records.extend(instrument.pop_records())
+
+    if analytics_cube:
+        with instrument.stage("build_cube"):
+            try:
+                AnalyticsCube.build(
+                    PARENT_FOLDER, joined_frames(sites, "joined_months")
+                    )
+            except ValueError as err:
+                logging.warning(f"analytics cube not built: {err}")
+        records.extend(instrument.pop_records())
+
+    report = instrument.build_report(
+        records, time.perf_counter() - start, sites=len(sites),
+        workers=workers, format=fmt, plot_mode=plot_mode, errors=summary,
+        )
+    instrument.write_report(
+        report, os.path.join(PARENT_FOLDER, instrument.REPORT_FILE)
+        )
+    print(instrument.summary(report))
 
-    df_list = []
-    for folder in folder_list:
-        pvoutput_file = os.path.join(
-            PARENT_FOLDER, folder, "pvoutput", f"{folder}.csv"
-            )
-        logging.info(pvoutput_file)
-        pvoutput_df = pd.read_csv(pvoutput_file)
 
-        pvgis_file = os.path.join(
-            PARENT_FOLDER, folder, "pvgis", f"{folder}.csv"
+def configure(fmt, export_csv, plot_mode, trace_memory=False):
+    """
+    Sets the intermediate format, csv export, plot mode and memory tracing
+    of the current process
+    """
+    global EXPORT_CSV
+    storage.check_format(fmt)
+    if plot_mode not in renderer.PLOT_MODES:
+        raise ValueError(
+            f"unknown plot mode {plot_mode!r}, expected one of "
+            f"{', '.join(renderer.PLOT_MODES)}"
             )
-        pvgis_df = pd.read_csv(pvgis_file)
+    storage.INTERMEDIATE_FORMAT = fmt
+    renderer.PLOT_MODE = plot_mode
+    EXPORT_CSV = export_csv
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
 
-        month = pd.Series(pvgis_df["Month"],)
 
-        pvgis_generated = pd.Series(pvgis_df["Avg Monthly Energy Production"],)
+def init_worker(manifest, fmt, export_csv, plot_mode, trace_memory=False):
+    """Stores the run's manifest and configuration in a worker process"""
+    global WORKER_MANIFEST
+    WORKER_MANIFEST = manifest
+    configure(fmt, export_csv, plot_mode, trace_memory)
 
-        pvoutput_generated = pd.Series(pvoutput_df["Generated (KWh)"],)
 
-        frame = {
-            "Month": month, "PVGIS Generated": pvgis_generated, 
-            "PVOUTPUT Generated": pvoutput_generated
-            }
-        joined_df = pd.DataFrame(frame)
-        joined_df["Error"] = (
-            (joined_df["PVOUTPUT Generated"] - joined_df["PVGIS Generated"]) 
-            / joined_df["PVOUTPUT Generated"]
-            )
+def process_sites_in_worker(folders):
+    """
+    Runs process_sites for folders in a worker process.
+
+    Returns
+    -------
+    result: tuple
+        (errors, changes, records) where errors is the ErrorSummary of the
+        sites' p_error, changes are the manifest entries recorded for the
+        sites, to be merged into the run's manifest, and records are the
+        stage records of the sites
+    """
+    errors = process_sites(folders, WORKER_MANIFEST)
+    return errors, WORKER_MANIFEST.pop_changes(), instrument.pop_records()
+
+
+def process_sites(folders, manifest=None):
+    """
+    Runs the whole pipeline (parse, join, stats and plot) for folders,
+    reading the inputs that need processing a few sites ahead with
+    file_io.prefetch_groups. The sites whose join is not fresh in the
+    manifest are joined together in one join_sites block. Sites without
+    both a PVGIS and a PVOUTPUT frame, e.g. with only an hourly series,
+    are parsed but not joined, and count as missing in the errors.
+
+    Parameters
+    ----------
+    folders: list
+        names of the sites, shared by their input files and their folders
+        in the output directory
+
+    manifest: Manifest
+        if given, stages whose inputs are unchanged are skipped
+
+    Returns
+    -------
+    errors: ErrorSummary
+        of the sites' p_error, the relative error between their PVGIS and
+        PVOUTPUT means
+    """
+    errors = ErrorSummary()
+    site_infos = {}
+    groups = ((folder, stale_inputs(folder, manifest)) for folder in folders)
+    for folder, buffers in prefetch_groups(groups):
+        with instrument.site(folder):
+            site_infos[folder] = parse_site(folder, manifest, buffers)
+
+    joinable = []
+    stale = []
+    for folder in folders:
+        key, inputs, outputs = join_manifest_entry(folder)
+        missing = [path for path in inputs if not storage.exists(path)]
+        if missing:
+            logging.warning(
+                f"skipping the join and stats of {folder}, missing "
+                f"{', '.join(missing)}"
+                )
+            errors.add(None)
+            continue
+        joinable.append(folder)
+        if manifest is not None and manifest.is_fresh(
+            key, inputs, outputs, VERSION):
+            errors.add(manifest.result(key))
+        else:
+            stale.append(folder)
+
+    if stale:
+        block = join_sites(stale, manifest)
+        for row, folder in enumerate(block.sites):
+            with instrument.site(folder):
+                joined = joined_site(block, row)
+                plot(*joined, site_infos[folder])
+            errors.add(joined[4])
+
+    for folder in joinable:
+        with instrument.site(folder):
+            calculate_stats(
+                frame_path(
+                    os.path.join(PARENT_FOLDER, folder, f"joined_{folder}")
+                    ),
+                manifest,
+                )
+    return errors
+
+
+def site_inputs(folder):
+    """
+    Returns a SiteInput for each of the PVGIS json, PVGIS hourly json,
+    PVOUTPUT csv and PVGIS csv inputs of a site
+    """
+    return [
+        SiteInput(
+            process_json.process_file, process_json.manifest_entry,
+            process_json.VERSION,
+            os.path.join(process_json.JSON_DIR, f"{folder}.json"),
+            ),
+        SiteInput(
+            process_json.process_series_file,
+            process_json.series_manifest_entry, process_json.VERSION,
+            os.path.join(process_json.SERIES_DIR, f"{folder}.json"),
+            ),
+        SiteInput(
+            pvoutput_csv.process_file, pvoutput_csv.manifest_entry,
+            pvoutput_csv.VERSION,
+            os.path.join(pvoutput_csv.CSV_DIR, f"{folder}.csv"),
+            ),
+        SiteInput(
+            pvgis_script.process_file, pvgis_script.manifest_entry,
+            pvgis_script.VERSION,
+            os.path.join(pvgis_script.CSV_DIR, f"{folder}.csv"),
+            ),
+        ]
+
+
+def stale_inputs(folder, manifest=None):
+    """
+    Returns the paths of the existing inputs of a site that are not fresh
+    in the manifest, i.e. that parse_site will read
+    """
+    paths = []
+    for site_input in site_inputs(folder):
+        if not os.path.exists(site_input.path):
+            continue
+        if manifest is None or not manifest.is_fresh(
+            *site_input.manifest_entry(os.path.basename(site_input.path)),
+            site_input.version):
+            paths.append(site_input.path)
+    return paths
+
+
+def parse_site(folder, manifest=None, buffers=None):
+    """
+    Processes the inputs of site_inputs into the site's folder in the
+    output directory. Missing inputs are skipped.
+
+    Parameters
+    ----------
+    buffers: dict
+        file_io.FileBuffer of the inputs already read, by path, closed
+        once parsed. Other inputs are read by their module.
+
+    Returns
+    -------
+    site_info: SiteInfo
+        the pv system of the site, None without a PVGIS csv input
+    """
+    site_info = None
+    buffers = buffers or {}
+    for site_input in site_inputs(folder):
+        filename = os.path.basename(site_input.path)
+        buffer = buffers.get(site_input.path)
+        if buffer is None:
+            if not os.path.exists(site_input.path):
+                continue
+            result = site_input.parse(filename, manifest=manifest)
+        else:
+            with buffer:
+                if manifest is not None:
+                    manifest.remember(buffer)
+                result = site_input.parse(
+                    filename, manifest=manifest, data=buffer.data
+                    )
+        if site_input.parse is pvgis_script.process_file:
+            site_info = result
+    return site_info
+
+
+def collect_site_infos(manifest, sites):
+    """
+    Returns a SiteTable of the pv systems recorded in the manifest for
+    sites
+    """
+    site_infos = []
+    for site in sites:
+        entry = manifest.entries.get(pvgis_script.manifest_entry(f"{site}.csv")[0])
+        if entry is not None and entry["result"] is not None:
+            site_infos.append(SiteInfo(**entry["result"]))
+    return SiteTable.from_records(site_infos)
+
+
+def get_site_names(index=None):
+    """
+    Returns the names of all sites with input files or an existing folder
+    in the output directory, see get_folder_names
+    """
+    sites = set()
+    for directory, extension in (
+        (process_json.JSON_DIR, ".json"),
+        (process_json.SERIES_DIR, ".json"),
+        (pvoutput_csv.CSV_DIR, ".csv"),
+        (pvgis_script.CSV_DIR, ".csv"),
+        ):
+        for file in scan_files(directory, extension):
+            sites.add(file.split(".")[0])
+
+    sites.update(get_folder_names(index))
+    return sorted(sites)
+
+
+def get_folder_names(index=None):
+    """
+    Returns all folder names in output directory, from its
+    artifact_index.ArtifactIndex, loaded if not given
+    """
+    return (index or load_index(PARENT_FOLDER)).sites()
+
 
-        
-        joined_df.T.round(2).to_csv(
-            os.path.join(PARENT_FOLDER, folder, (f"joined_{folder}.csv")),
+def joined_frames(sites, kind="joined"):
+    """
+    Returns the paths of the existing joined, or joined_months, frames of
+    sites, without listing the output directory again
+    """
+    paths = (
+        frame_path(storage.join_stem(PARENT_FOLDER, kind, site))
+        for site in sites
+        )
+    return [path for path in paths if storage.exists(path)]
+
+
+def join_manifest_entry(folder):
+    """Returns the manifest key, input files and output files of a join"""
+    return (
+        f"join/{folder}",
+        [
+            frame_path(os.path.join(PARENT_FOLDER, folder, "pvoutput", folder)),
+            frame_path(os.path.join(PARENT_FOLDER, folder, "pvgis", folder)),
+        ],
+        [
+            frame_path(os.path.join(PARENT_FOLDER, folder, f"joined_{folder}")),
+            frame_path(os.path.join(PARENT_FOLDER, folder, "joined_months")),
+        ],
         )
-        std = joined_df.std().astype("float32")
-        pvgis_std = std[1]
-        pvoutput_std = std[2]
-        standard_deviation = pvgis_std, pvoutput_std
 
-        mean = joined_df.mean().astype("float32")
-        pvgis_mean = mean[1]
-        pvoutput_mean = mean[2]
-        p_error = round(abs((pvoutput_mean - pvgis_mean) / pvoutput_mean), 3)
-        mean = pvgis_mean, pvoutput_mean
 
-        df_list.append((joined_df, folder, standard_deviation, mean, p_error))
-    return df_list
+@timed("join_dfs")
+def join_sites(folders, manifest=None):
+    """
+    Joins the generated power of the processed PVGIS and PVOUTPUT files of
+    many sites, read together with storage.read_frames, on (site, year,
+    month) in one month_join.MonthJoin, and
+    writes each site's joined months. The mean PVOUTPUT power of each
+    calendar month over the years is joined with the PVGIS power in one
+    (sites x 12 x 4) float32 MonthlyBlock with the JOINED_COLUMNS series,
+    written as each site's joined file. If a manifest is given, each join
+    and its p_error are recorded in it.
+
+    Returns
+    -------
+    block: MonthlyBlock
+        with the MonthJoin as join, the (sites x 2) float32 arrays stds
+        and means, of the PVGIS and PVOUTPUT generated power, and the list
+        p_errors as attributes
+    """
+    pvoutput_df = read_frames([
+        frame_path(os.path.join(PARENT_FOLDER, folder, "pvoutput", folder))
+        for folder in folders
+        ])
+    pvgis_df = read_frames([
+        frame_path(os.path.join(PARENT_FOLDER, folder, "pvgis", folder))
+        for folder in folders
+        ])
+
+    block = MonthlyBlock(folders, JOINED_COLUMNS)
+    block.join = None
+    if folders:
+        year, month = pvoutput_csv.month_keys(pvoutput_df)
+        block.join = MonthJoin(
+            folders,
+            climatology(
+                pvgis_df["frame"].to_numpy(), pvgis_df["Month"].to_numpy(),
+                pvgis_df["Avg Monthly Energy Production"].to_numpy(),
+                len(folders),
+                ),
+            pvoutput_df["frame"].to_numpy(), year, month,
+            pvoutput_df["Generated (KWh)"].to_numpy(),
+            )
+        count_rows(len(block.join))
+
+        block.set_column(
+            "Month", np.tile(np.arange(1, N_MONTHS + 1), (len(folders), 1))
+            )
+        block.set_column("PVGIS Generated", block.join.climatology)
+        block.set_column("PVOUTPUT Generated", block.join.profile())
+
+    pvgis_generated = block.series("PVGIS Generated")
+    pvoutput_generated = block.series("PVOUTPUT Generated")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        block.series("Error")[:] = (
+            (pvoutput_generated - pvgis_generated) / pvoutput_generated
+            )
+
+    generated = ["PVGIS Generated", "PVOUTPUT Generated"]
+    block.stds = block.std(generated)
+    block.means = block.mean(generated)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        errors = np.abs(
+            (block.means[:, 1] - block.means[:, 0]) / block.means[:, 1]
+            )
+    block.p_errors = [round(float(error), 3) for error in errors]
+
+    for row, folder in enumerate(folders):
+        joined_stem = os.path.join(PARENT_FOLDER, folder, f"joined_{folder}")
+        joined_df = block.frame(row)
+        write_joined(joined_df, joined_stem)
+        if EXPORT_CSV and storage.INTERMEDIATE_FORMAT != "csv":
+            write_joined(joined_df, joined_stem, "csv")
+        write_frame(
+            block.join.frame(row),
+            os.path.join(PARENT_FOLDER, folder, "joined_months"),
+            )
+
+        if manifest is not None:
+            manifest.record(
+                *join_manifest_entry(folder), VERSION,
+                result=block.p_errors[row],
+                )
+    return block
+
+
+def join_site(folder, manifest=None):
+    """
+    Creates a csv file with generated power from processed PVGIS and 
+    PVOUTPUT files of one site as columns, using month as index. If a
+    manifest is given, the join and its p_error are recorded in it.
+
+    Returns
+    -------
+    joined: tuple
+        (joined_df, folder, standard_deviation, mean, p_error)
+    """
+    block = join_sites([folder], manifest)
+    return joined_site(block, 0)
+
+
+def joined_site(block, row):
+    """
+    Returns the joined tuple of join_site, the arguments of plot, for the
+    site at row of a block of join_sites
+    """
+    return (
+        block.frame(row), block.sites[row], tuple(block.stds[row]),
+        tuple(block.means[row]), block.p_errors[row],
+        )
 
 
-def plot(df, folder, std, mean, p_error):
+@timed("plot_joined")
+def plot(df, folder, std, mean, p_error, site_info=None):
     """
     Plots 'Generated' in KWh VS 'Month' and saves plot 
 	as '*.png' file.
@@ -121,113 +530,85 @@ def plot(df, folder, std, mean, p_error):
 	df: pandas.DataFrame 
     folder: str
         folder containing df to be plotted
+    site_info: SiteInfo
+        pv system of the site, left out of the plots if None
     """
-    txt_file = os.path.join(PARENT_FOLDER, folder, "info.txt")
-
-    with open (txt_file, "r") as txt_file:
-        pv_info = (txt_file.readlines())
-        
-        lon = str(pv_info[0].split("\\")[0]) + "N"
-        lat = str(pv_info[1].split("\\")[0]) + "E"
-
-        if lon.startswith("-"):
-            lon = lon[:-1] + "S"
-        
-        if lat.startswith("-"):
-            lat = lat[:-1] + "W"
-        
-        power =  pv_info[2].split("\\")[0]
-        losses = pv_info[3].split("\\")[0]
-        angle = pv_info[4].split("\\")[0]
-
     fig_text = (f"PVGIS Mean:{round(float(mean[0]),3)}kWh\nPVOUTPUT Mean:"
         f"{round(float(mean[1]),3)}KWh\n"
         f"Mean Error:{round(float(p_error),3)}\n"
         f"PVGIS STD:{round(float(std[0]),3)}kWh\nPVOUTPUT STD:"
-        f"{round(float(std[1]),3)}KWh\nLocation:({lon},{lat})\n"
-        f"System Power:{power}KW\nInclination Angle(deg):{angle}")
+        f"{round(float(std[1]),3)}KWh")
+    if site_info is not None:
+        fig_text += (f"\nLocation:({site_info.location()})\n"
+            f"System Power:{site_info.power:g}KW\n"
+            f"Inclination Angle(deg):{site_info.angle:g}")
 
-    color = "red"
-    df_columns = list(df)
     label = [
         "Month", "PVGIS Generated", "PVOUTPUT Generated"
         ]
     filename = f"{folder}_joined"
 
-    figure_title = f"{folder} Month VS Generated"
-    fig = plt.figure(figure_title)
-
-    fig.set_size_inches(13.6, 7.06)
-    plot_no = df.shape
-
     months = ["", "Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul",
         "Aug", "Sept", "Oct", "Nov", "Dec",
         ]
-    x_axis = np.arange(len(months))
-    
-    color="blue"
-    plt.xticks(x_axis, months)
-    plt.xlabel("Month")
-    plt.ylabel("Generated (KWh)")
-    plt.grid()
-    plt.margins(x=0)
-    plt.ticklabel_format(useOffset=False, axis="y", style="plain")
-
-    width=0.3
-    plt.bar(
-        x=df[label[0]] - width/2, height=df[label[1]], 
-        width=width, align='center', label='PVGIS Generated'
-        )
-    plt.bar(
-        x=df[label[0]] + width/2, height=df[label[2]],
-        width=width, align='center', label='PVOUTPUT Generated'
-        )
-    plt.legend()
-    plt.figtext(
-        .15, .7, fig_text, backgroundcolor="white", fontfamily="monospace",
-        fontsize="x-small",
-        )
+    x_axis = list(range(len(months)))
+    series = [df[label[1]], df[label[2]]]
 
     bar_plot_name = os.path.join(
         PARENT_FOLDER, folder, f"{filename}_bar.png"
         )
-    plt.savefig(bar_plot_name)
-    #plt.show()
-    plt.close()
-
-    figure_title = f"{folder} Month VS Generated"
-    fig = plt.figure(figure_title)
-    fig.set_size_inches(13.6, 7.06)	
-    plot_no = df.shape
-    color="blue"
-
-    plt.xticks(x_axis, months)
-    plt.xlabel("Month")
-    plt.ylabel("Energy Generated (KWh)")
-    plt.grid()
-    plt.margins(x=0)
-    plt.ticklabel_format(useOffset=False, axis="y", style="plain")
-
-    plt.plot(
-        df[label[0]], df[label[1]], color=color, linewidth=1, 
-        label="PVGIS Generated"
-    )
-    plt.plot(
-    df[label[0]], df[label[2]], color="orange", linewidth=1, 
-    label="PVOUTPUT Generated"
-    )
-    plt.legend()
-    plt.figtext(
-        .15, .7, fig_text, backgroundcolor="white", fontfamily="monospace",
-        fontsize="x-small",
+    render(
+        "bar", df[label[0]], series, bar_plot_name, label[1:], "Month",
+        "Generated (KWh)", xticks=x_axis, xticklabels=months, text=fig_text,
         )
 
-    line_plot_name = bar_plot_name = os.path.join(
+    line_plot_name = os.path.join(
         PARENT_FOLDER, folder, f"{filename}_line.png"
         )
-    plt.savefig(line_plot_name)
-    #plt.show()
-    plt.close()
+    render(
+        "line", df[label[0]], series, line_plot_name, label[1:], "Month",
+        "Energy Generated (KWh)", xticks=x_axis, xticklabels=months,
+        colors=["blue", "orange"], text=fig_text,
+        )
 
 if __name__=="__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "-w", "--workers", type=int, default=None,
+        help="number of worker processes, defaults to the number of CPUs",
+        )
+    parser.add_argument(
+        "-f", "--format", choices=list(storage.FORMATS), default=None,
+        help="format of the files passed between stages, defaults to "
+        "$PV_INTERMEDIATE_FORMAT or csv",
+        )
+    parser.add_argument(
+        "--export-csv", action="store_true",
+        help="also write the joined files as csv",
+        )
+    parser.add_argument(
+        "-p", "--plot", choices=renderer.PLOT_MODES, default=None,
+        help="draw plots now (eager), record them for render_service "
+        "(deferred) or skip them (off), defaults to $PV_PLOT_MODE or eager",
+        )
+    parser.add_argument(
+        "--fleet-stats", action="store_true",
+        help="also write the statistics of every site to fleet_stats.csv",
+        )
+    parser.add_argument(
+        "--trace-memory", action="store_true",
+        help="report the peak python allocations of each stage instead of "
+        "the peak resident memory, slows the run down",
+        )
+    parser.add_argument(
+        "--cube", action="store_true",
+        help="also build the error analytics cube, analytics_cube.npz, see "
+        "cube.py",
+        )
+    args = parser.parse_args()
+    instrument.configure_logging()
+    main(
+        workers=args.workers, fmt=args.format, export_csv=args.export_csv,
+        plot_mode=args.plot, fleet_stats=args.fleet_stats,
+        trace_memory=args.trace_memory, analytics_cube=args.cube,
+        )
@@ -0,0 +1,176 @@
+"""Manifest of pipeline inputs and artifacts used to skip unchanged work"""
+import os
+import json
+import hashlib
+import logging
+
+from storage import exists, is_store_uri, store_fingerprint
+
+MANIFEST_FILE = "manifest.json"
+
+
+def file_hash(path):
+    """Returns the sha1 hex digest of the content of a file"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint(path):
+    """
+    Returns the size, modification time and content hash of a file, or
+    the row count, write time and content hash of a frame in a store.
+
+    Parameters
+    ----------
+    path: str
+
+    Returns
+    -------
+    fingerprint: dict
+    """
+    if is_store_uri(path):
+        return store_fingerprint(path)
+    stat = os.stat(path)
+    return {
+        "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+        "sha1": file_hash(path),
+        }
+
+
+def code_version(source_file):
+    """
+    Returns the content hash of a module's source file, used as the version
+    of the code that produced an artifact.
+
+    Parameters
+    ----------
+    source_file: str
+        path of the module, usually its __file__
+    """
+    return file_hash(source_file)
+
+
+def is_unchanged(path, recorded):
+    """
+    Checks a file against its recorded fingerprint. The content is only
+    hashed when the size matches but the modification time does not.
+    """
+    if is_store_uri(path):
+        current = store_fingerprint(path)
+        return current is not None and current["sha1"] == recorded["sha1"]
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+
+    if stat.st_size != recorded["size"]:
+        return False
+    if stat.st_mtime_ns == recorded["mtime_ns"]:
+        return True
+    return file_hash(path) == recorded["sha1"]
+
+
+class Manifest():
+    """
+    Records, for each artifact key (e.g. "pvoutput/<site>"), the
+    fingerprints of its inputs, its output files and the code version that
+    produced it. Stages ask is_fresh before doing any work and call record
+    once their outputs are written. Delete manifest.json in the output
+    directory to force a full rebuild.
+    """
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, MANIFEST_FILE)
+        self.entries = {}
+        self.changes = {}
+        self.digests = {}
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as file:
+                    self.entries = json.load(file)
+            except ValueError:
+                logging.warning(f"ignoring unreadable manifest {self.path}")
+
+    def is_fresh(self, key, inputs, outputs, version):
+        """
+        Returns True when key was produced by the same code version from
+        unchanged inputs and all of its outputs still exist.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry["version"] != version:
+            return False
+
+        if sorted(entry["inputs"]) != sorted(inputs):
+            return False
+
+        for path in outputs:
+            if not exists(path):
+                return False
+
+        for path in inputs:
+            if not is_unchanged(path, entry["inputs"][path]):
+                return False
+        return True
+
+    def record(self, key, inputs, outputs, version, result=None):
+        """
+        Records the inputs, outputs and code version of key. result is any
+        json serialisable value the stage wants back when it is skipped.
+        """
+        entry = {
+            "version": version,
+            "inputs": {path: self.fingerprint(path) for path in inputs},
+            "outputs": list(outputs),
+            "result": result,
+            }
+        self.entries[key] = entry
+        self.changes[key] = entry
+
+    def remember(self, buffer):
+        """
+        Keeps the fingerprint of a file already read into a
+        file_io.FileBuffer, so recording it does not read the file again
+        """
+        self.digests[buffer.path] = {
+            "size": buffer.stat.st_size, "mtime_ns": buffer.stat.st_mtime_ns,
+            "sha1": hashlib.sha1(buffer.data).hexdigest(),
+            }
+
+    def fingerprint(self, path):
+        """
+        Returns the fingerprint of path, from remember if the file is
+        unchanged since it was read
+        """
+        known = self.digests.pop(path, None)
+        if known is not None:
+            stat = os.stat(path)
+            if (stat.st_size, stat.st_mtime_ns) == (
+                known["size"], known["mtime_ns"]):
+                return known
+        return fingerprint(path)
+
+    def result(self, key):
+        """Returns the result recorded for key"""
+        return self.entries[key]["result"]
+
+    def pop_changes(self):
+        """Returns and clears the entries recorded since the last call"""
+        changes = self.changes
+        self.changes = {}
+        return changes
+
+    def update(self, changes):
+        """Merges entries recorded by another Manifest, e.g. in a worker"""
+        self.entries.update(changes)
+
+    def save(self):
+        """Writes the manifest to the output directory"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.entries, file)
+        os.replace(tmp_path, self.path)
+        self.changes = {}
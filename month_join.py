@@ -0,0 +1,107 @@
+"""
+Month keyed join of PVGIS and PVOUTPUT.
+
+PVGIS gives a climatology per site, the average energy of each calendar
+month, and PVOUTPUT the energy measured in each (year, month). A MonthJoin
+matches them on (site, year, month) for many sites at once: the months of
+every site are concatenated into flat arrays and the PVGIS value of each
+is looked up in a (sites x 12) climatology with one fancy index, which
+broadcasts the climatology over every year of PVOUTPUT data. The result
+does not depend on the row order of either input.
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+N_MONTHS = 12
+
+JOINED_MONTHS_COLUMNS = [
+    "Year", "Month", "PVGIS Generated", "PVOUTPUT Generated", "Error",
+    ]
+
+
+def climatology(site, month, value, n_sites):
+    """
+    Scatters the monthly values of many sites into a (sites x 12) float32
+    array, NaN where a site has no value for a month.
+
+    Parameters
+    ----------
+    site, month, value: numpy.ndarray
+        row of the site, calendar month (1 to 12) and value of each entry
+    """
+    table = np.full((n_sites, N_MONTHS), np.nan, dtype="float32")
+    table[site, np.asarray(month, dtype="int64") - 1] = value
+    return table
+
+
+class MonthJoin():
+    """
+    Parameters
+    ----------
+    sites: list
+        site of each row of climatology
+
+    climatology: numpy.ndarray
+        (sites x 12) PVGIS value of each calendar month, see climatology
+
+    site, year, month, actual: numpy.ndarray
+        row of the site, year, calendar month and PVOUTPUT value of each
+        measured month, in any order
+
+    Attributes
+    ----------
+    site, year, month, predicted, actual, error: numpy.ndarray
+        the joined months sorted by site, year and month. error is
+        (actual - predicted) / actual.
+    """
+    def __init__(self, sites, climatology, site, year, month, actual):
+        self.sites = list(sites)
+        self.climatology = climatology
+
+        site = np.asarray(site, dtype="int64")
+        year = np.asarray(year, dtype="int64")
+        month = np.asarray(month, dtype="int64")
+        if np.any((month < 1) | (month > N_MONTHS)):
+            raise ValueError("months must be within 1 and 12")
+
+        order = np.lexsort((month, year, site))
+        self.site = site[order]
+        self.year = year[order]
+        self.month = month[order]
+        self.actual = np.asarray(actual, dtype="float32")[order]
+        self.predicted = climatology[self.site, self.month - 1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.error = (self.actual - self.predicted) / self.actual
+
+        self.bounds = np.searchsorted(self.site, np.arange(len(self.sites) + 1))
+
+    def __len__(self):
+        return len(self.site)
+
+    def profile(self):
+        """
+        Returns the (sites x 12) float32 mean PVOUTPUT value of each
+        calendar month over the years, skipping NaNs, accumulated in
+        float64
+        """
+        keys = self.site * N_MONTHS + self.month - 1
+        valid = ~np.isnan(self.actual)
+        size = len(self.sites) * N_MONTHS
+        sums = np.bincount(
+            keys[valid], weights=self.actual[valid], minlength=size
+            )
+        counts = np.bincount(keys[valid], minlength=size)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            means = sums / counts
+        return means.reshape(len(self.sites), N_MONTHS).astype("float32")
+
+    def frame(self, row):
+        """Returns the joined months of the site at row as a data frame"""
+        rows = slice(self.bounds[row], self.bounds[row + 1])
+        return pd.DataFrame(dict(zip(JOINED_MONTHS_COLUMNS, (
+            self.year[rows], self.month[rows], self.predicted[rows],
+            self.actual[rows], self.error[rows],
+            ))))
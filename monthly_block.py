@@ -0,0 +1,99 @@
+"""
+Monthly series of many sites in one preallocated float32 array.
+
+A MonthlyBlock holds k monthly series of every site as a
+(sites x months x k) float32 array. Statistics over all sites are
+computed with vectorized NumPy calls on the block, and a site's data
+frame is only built when asked for, e.g. to write or plot it.
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+N_MONTHS = 12
+
+
+class MonthlyBlock():
+    """
+    Parameters
+    ----------
+    sites: list
+        site of each row of the block
+
+    columns: list
+        name of each series, the last axis of the block
+
+    n_months: int
+        length of the month axis, longer series are cut
+    """
+    def __init__(self, sites, columns, n_months=N_MONTHS):
+        self.sites = list(sites)
+        self.columns = list(columns)
+        self.values = np.full(
+            (len(self.sites), n_months, len(self.columns)), np.nan,
+            dtype="float32",
+            )
+        self.lengths = np.zeros(len(self.sites), dtype="int64")
+
+    def __len__(self):
+        return len(self.sites)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.lengths.nbytes
+
+    def set_series(self, row, column, values):
+        """
+        Sets a series of the site at row. The length of the site is the
+        longest of its series, the rest is NaN.
+        """
+        values = np.asarray(values, dtype="float32")[:self.values.shape[1]]
+        self.values[row, :len(values), self.columns.index(column)] = values
+        self.lengths[row] = max(self.lengths[row], len(values))
+
+    def set_column(self, column, values):
+        """
+        Sets a series of every site from a (sites x months) array. The
+        length of each site is at least the number of months of values.
+        """
+        values = np.asarray(values, dtype="float32")[:, :self.values.shape[1]]
+        self.values[:, :values.shape[1], self.columns.index(column)] = values
+        self.lengths = np.maximum(self.lengths, values.shape[1])
+
+    def series(self, column):
+        """Returns a (sites x months) view of a series"""
+        return self.values[:, :, self.columns.index(column)]
+
+    def mean(self, columns):
+        """
+        Returns the (sites x len(columns)) float32 means of series,
+        skipping NaNs like pandas, accumulated in float64
+        """
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return np.nanmean(
+                self.values[:, :, self.column_indices(columns)], axis=1,
+                dtype="float64",
+                ).astype("float32")
+
+    def std(self, columns):
+        """
+        Returns the (sites x len(columns)) float32 sample standard
+        deviations of series, skipping NaNs like pandas
+        """
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return np.nanstd(
+                self.values[:, :, self.column_indices(columns)], axis=1,
+                dtype="float64", ddof=1,
+                ).astype("float32")
+
+    def column_indices(self, columns):
+        return [self.columns.index(column) for column in columns]
+
+    def frame(self, row):
+        """Returns the data frame of the site at row"""
+        return pd.DataFrame(
+            self.values[row, :self.lengths[row]], columns=self.columns
+            )
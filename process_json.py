@@ -6,11 +6,24 @@ import json
 import re
 import glob
 import logging
-import datetime
-import matplotlib.pyplot as plt
+
+from manifest import Manifest, code_version
+from storage import frame_path, write_frame
+from render import render
+from instrument import configure_logging, count_rows, timed
+from file_io import prefetch, read_file, scan_files
+import calendar_table
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
 
 PWD = os.path.dirname(__file__)
 JSON_DIR = os.path.join(PWD, "json")
+SERIES_DIR = os.path.join(PWD, "json_hourly")
+OUTPUT_DIR = os.path.join(PWD, "output_dir")
+VERSION = code_version(__file__)
 
 DF_COLUMN_NAMES = [
 		"outputs.vertical_axis.SD_m_y", "outputs.vertical_axis.H(i)_m_y", 
@@ -18,6 +31,31 @@ DF_COLUMN_NAMES = [
 		"outputs.vertical_axis.E_d_y", "outputs.vertical_axis.month"
 		]
 
+MOUNTING_SYSTEM = "vertical_axis"
+
+MONTHLY_KEYS = {
+	"SD_m": "Monthly Avg Standard Deviation",
+	"H(i)_m": "Avg Monthly Sum Of Global Irradiation",
+	"H(i)_d": "Avg Daily Sum Of Global Irradiation",
+	"E_m": "Avg Monthly Energy Production",
+	"E_d": "Avg Daily Energy Production",
+	"month": "Month",
+	}
+
+# PVGIS seriescalc key: (column, reduction, scale). Sums of the hourly
+# power and irradiance are energies, in KWh and KWh/m2.
+HOURLY_KEYS = {
+	"P": ("Energy Production", "sum", 1e-3),
+	"G(i)": ("Global Irradiation", "sum", 1e-3),
+	"T2m": ("Air Temperature", "mean", 1.0),
+	"WS10m": ("Wind Speed", "mean", 1.0),
+	}
+
+SERIES_PERIODS = calendar_table.PERIODS
+
+# Length of a seriescalc timestamp, "YYYYMMDD:HHMM"
+SERIES_TIME_LENGTH = 13
+
 NEW_DF_COLUMNS = {
 	"outputs.vertical_axis.SD_m_y": "Monthly Avg Standard Deviation", 
 	"outputs.vertical_axis.H(i)_m_y": "Avg Monthly Sum Of Global Irradiation", 
@@ -39,11 +77,12 @@ def get_json_files():
 		List of all json files in the json directory of the current 
 		working directory
 	"""
-	json_files = []
-	for file in os.listdir(JSON_DIR):
-		if file.endswith(".json"):
-			json_files.append(file)
-	return json_files
+	return scan_files(JSON_DIR, ".json")
+
+
+def get_series_files():
+	"""Gets all hourly seriescalc json files in the json_hourly directory"""
+	return scan_files(SERIES_DIR, ".json")
 
 
 def process_json_files():
@@ -61,62 +100,231 @@ def process_json_files():
 	json_files = get_json_files()
 	processed_list = []
 	for filename in json_files:
-		file = os.path.join(PWD, "json", filename)
-		with open(file) as file:
-			file = json.load(file)
-
-		df = pd.DataFrame(file)
-		df = flat_table.normalize(df)
-		df_columns = list(df)
-		processed_list.append((df, df_columns, filename))
+		processed_list.append(process_json_file(filename))
 		
 	return processed_list
 
 
-def aggregate_monthly_data(df, year):
+def process_json_file(filename):
 	"""
-	Calculates monthly average of all the columns in the dataframe and 
-	adds a "Period" column which is a columns for the number of the 
-	months in a year.
+	Takes a json file in the json directory and converts it to a
+	dataframe.
 
 	Parameters
 	----------
-	df: pandas.DataFrame
-		DataFrame to be aggregated
+	filename: str
+		name of the file without preceeding path information
 
-	year: Year()
-		Python object which contains information about a year.
-	
 	Returns
 	-------
-	aggregate_df: pandas.DataFrame
-		DataFrame with aggregate data calculated
+	processed_file: tuple
+		(df, df_columns, filename)
+	"""
+	file = os.path.join(JSON_DIR, filename)
+	with open(file) as file:
+		file = json.load(file)
+
+	df = pd.DataFrame(file)
+	df = flat_table.normalize(df)
+	df_columns = list(df)
+	return df, df_columns, filename
+
+
+def load_json(file, data=None):
 	"""
-	days = year.days
-	for month in year.months:
-		period = year.months[month]
-		aggregate_df(df, period)
-	return aggregate_df
+	Parses a json file, or its content if data is given, with orjson when
+	it is installed. orjson parses a memory mapped file in place. Without
+	it the content is decoded straight from the mapping into the str json
+	parses, the one copy of the file that path makes.
+	"""
+	if data is None:
+		with read_file(file) as buffer:
+			return load_json(file, buffer.data)
+	if orjson is not None:
+		with memoryview(data) as view:
+			return orjson.loads(view)
+	return json.loads(str(data, "utf-8"))
 
 
-def add_periods_to_df(year, df):
+def load_monthly_json(file, mounting_system=MOUNTING_SYSTEM, data=None):
 	"""
-	Adds "Periods" (weeks in a year) columns to the data frame
+	Reads the monthly outputs of a PVGIS json file straight into a data
+	frame with the columns drop_dummy_columns and rename_columns produce
+	from the flattened file, sorted by month. Nothing but
+	outputs.monthly is turned into columns.
 
 	Parameters
 	----------
+	file: str
+		path to the json file
+
+	mounting_system: str
+		key of the monthly block, used as is if it is the only one
+
+	data: bytes or mmap.mmap
+		content of the file, read from file if not given
+
+	Returns
+	-------
 	df: pandas.DataFrame
-		DataFrame for which the periods are to be calculated
+	"""
+	try:
+		monthly = load_json(file, data)["outputs"]["monthly"]
+	except (KeyError, TypeError):
+		raise ValueError(f"{file} has no outputs.monthly block")
+
+	if mounting_system not in monthly and len(monthly) == 1:
+		mounting_system = next(iter(monthly))
+	try:
+		rows = monthly[mounting_system]
+	except KeyError:
+		raise ValueError(
+			f"{file} has no outputs.monthly.{mounting_system} block"
+			)
+
+	columns = {
+		name: np.fromiter(
+			(row[key] for row in rows), dtype="float64", count=len(rows)
+			)
+		for key, name in MONTHLY_KEYS.items()
+		}
+	order = np.argsort(columns["Month"], kind="stable")
+	return pd.DataFrame(
+		{name: values[order] for name, values in columns.items()}
+		)
+
+
+def load_hourly_json(file, data=None):
+	"""
+	Reads the hourly outputs of a PVGIS seriescalc json file.
+
+	Parameters
+	----------
+	file: str
+		path to the json file
+
+	data: bytes or mmap.mmap
+		content of the file, read from file if not given
+
+	Returns
+	-------
+	times: numpy.ndarray
+		datetime64[m] time of each hour, see parse_series_times
+
+	values: dict
+		float64 array of each of HOURLY_KEYS in the file
+	"""
+	try:
+		rows = load_json(file, data)["outputs"]["hourly"]
+	except (KeyError, TypeError):
+		raise ValueError(f"{file} has no outputs.hourly block")
+	if not rows:
+		raise ValueError(f"{file} has an empty outputs.hourly block")
+
+	times = parse_series_times([row["time"] for row in rows], file)
+	values = {
+		key: np.fromiter(
+			(row[key] for row in rows), dtype="float64", count=len(rows)
+			)
+		for key in HOURLY_KEYS if key in rows[0]
+		}
+	return times, values
+
+
+def parse_series_times(times, file=None):
+	"""
+	Converts seriescalc timestamps, "YYYYMMDD:HHMM", to datetime64[m] with
+	array arithmetic on their digits instead of parsing each one.
+
+	Raises
+	------
+	ValueError
+		if a timestamp does not have this layout
+	"""
+	text = "".join(times).encode("ascii")
+	if len(text) != SERIES_TIME_LENGTH * len(times):
+		raise ValueError(f"{file}: expected times as 'YYYYMMDD:HHMM'")
+
+	digits = np.frombuffer(text, dtype="uint8").reshape(
+		len(times), SERIES_TIME_LENGTH
+		).astype("int64") - ord("0")
+	digits = np.delete(digits, 8, axis=1)
+	if digits.min() < 0 or digits.max() > 9:
+		raise ValueError(f"{file}: expected times as 'YYYYMMDD:HHMM'")
+
+	def number(start, stop):
+		return digits[:, start:stop] @ 10 ** np.arange(stop - start - 1, -1, -1)
+
+	days = calendar_table.to_days(number(0, 4), number(4, 6), number(6, 8))
+	minutes = days * 24 * 60 + number(8, 10) * 60 + number(10, 12)
+	return minutes.astype("datetime64[m]")
+
+
+def aggregate_hourly(times, values, period="month"):
+	"""
+	Aggregates an hourly series into calendar days, weeks or months with
+	one np.add.reduceat over all of its columns.
+
+	Parameters
+	----------
+	times: numpy.ndarray
+		datetime64 time of each value
+
+	values: dict
+		array of hourly values of each of HOURLY_KEYS, reduced and scaled
+		as described there
+
+	period: str
+		one of SERIES_PERIODS
 
-	year: Year()
-		Python object which contains information about a year.
-	
 	Returns
 	-------
-	aggregate_df: pandas.DataFrame
-		DataFrame with aggregate data calculated
+	df: pandas.DataFrame
+		one row per period from the first to the last time, with its
+		"Year" and "Month" or "Day", or ISO "Year" and "Week", see
+		calendar_table.period_labels, "Hours", the number of values in
+		the period, and one column per key of values. Periods without
+		values are NaN.
 	"""
-	period_list = Year.get_weeks_in_year(year)
+	order = None
+	if np.any(times[1:] < times[:-1]):
+		order = np.argsort(times, kind="stable")
+		times = times[order]
+
+	# The years around the series hold the ISO weeks crossing the new year
+	years = times[[0, -1]].astype("datetime64[Y]").astype("int64") + 1970
+	edges = calendar_table.series_edges(years[0] - 1, years[1] + 1, period)
+	positions = np.searchsorted(times, edges.astype(times.dtype))
+	counts = np.diff(positions)
+	filled = counts > 0
+
+	keys = list(values)
+	stacked = np.column_stack([
+		values[key] if order is None else values[key][order] for key in keys
+		]) if keys else np.empty((len(times), 0))
+	totals = np.full((len(counts), len(keys)), np.nan)
+	# reduceat would return the value at the start of an empty period
+	# instead of 0, so only the starts of filled periods are passed
+	totals[filled] = np.add.reduceat(stacked, positions[:-1][filled], axis=0)
+
+	# Drop the periods of the years around the series
+	starts = edges[:-1]
+	first = np.searchsorted(starts, times[0], side="right") - 1
+	last = np.searchsorted(starts, times[-1], side="right")
+	starts, counts, totals = (
+		starts[first:last], counts[first:last], totals[first:last]
+		)
+
+	df = pd.DataFrame(calendar_table.period_labels(starts, period))
+	df["Hours"] = counts
+	with np.errstate(invalid="ignore"):
+		for column, key in enumerate(keys):
+			name, reduction, scale = HOURLY_KEYS[key]
+			total = totals[:, column]
+			if reduction == "mean":
+				total = total / counts
+			df[name] = total * scale
+	return df
 
 
 def drop_meta(df):
@@ -254,23 +462,6 @@ def drop_empty_cells(df):
 	return df
   
 
-def aggregate_df(df, period=168):
-	"""
-	Calculates average data for a set number of rows.
-
-	Parameters
-	---------
-	df: pandas.DataFrame
-
-	period: int
-		period for which the data should be calculated, defaults to 168 
-		for converting hourly data to weekly data
-	"""
-	df = df.groupby(np.arange(len(df))//period).mean()
-	df = df[::-1]
-	return df
-
-
 def rename_columns(df):
 	df.rename(columns=NEW_DF_COLUMNS, inplace=True)
 	return df
@@ -305,6 +496,7 @@ def get_lon_lat_from_filename(processed_file):
 		return None
 
 
+@timed("plot_pvgis_json")
 def plot(df, processed_file):
 	"""
 	Plots 'Average Monthly Energy Production' VS 'Month' and saves plot 
@@ -321,131 +513,201 @@ def plot(df, processed_file):
 	
 	try:
 		if not os.path.exists(
-		os.path.join(PWD,  "output_dir", f"{str(filename)}", "pvgis")):
+		os.path.join(OUTPUT_DIR, f"{str(filename)}", "pvgis")):
 			os.mkdir(
-				(os.path.join(PWD,  "output_dir", f"{str(filename)}", "pvgis")
+				(os.path.join(OUTPUT_DIR, f"{str(filename)}", "pvgis")
 				))
 			
 	except Exception as err:
 		print(f"{err} occured")
 
 	label = ["Month", "Avg Monthly Energy Production"]
-	figure_title = f"{plt.xlabel} VS {plt.ylabel}"
-	fig = plt.figure(figure_title)
-	fig.set_size_inches(13.6, 7.06)	
-	plot_no = df.shape
-
-	color="orange"
-	plt.xlabel(label[0])
-	plt.ylabel(label[1] + ("KWh"))
-	plt.grid()
-	plt.margins(x=0)
-	plt.ticklabel_format(useOffset=False, axis="y", style="plain")
-
-	plt.bar(df[label[0]], df["Avg Monthly Energy Production"])
-	plt.legend()
 
 	bar_plot_name = os.path.join(
-		PWD,  "output_dir", f"{str(filename)}", "pvgis", f"{filename}_bar.png"
+		OUTPUT_DIR, f"{str(filename)}", "pvgis", f"{filename}_bar.png"
 		)
-	plt.savefig(bar_plot_name)
-	plt.close()
-
-	figure_title = f"{plt.xlabel} VS {plt.ylabel}"
-	fig = plt.figure(figure_title)
-	fig.set_size_inches(13.6, 7.06)	
-	plot_no = df.shape
-	color="orange"
-	plt.xlabel(label[0])
-	plt.ylabel(label[1] + ("KWh"))
-	plt.grid()
-	plt.margins(x=0)
-	plt.ticklabel_format(useOffset=False, axis="y", style="plain")
-	plt.plot(
-		df[label[0]], df[label[1]], color=color, linewidth=1, label=label
+	render(
+		"bar", df[label[0]], [df[label[1]]], bar_plot_name, [label[1]],
+		label[0], label[1] + ("KWh"),
 		)
-	plt.legend()
 
 	line_plot_name = os.path.join(
-		PWD,  "output_dir", f"{str(filename)}", "pvgis", f"{filename}_line.png"
+		OUTPUT_DIR, f"{str(filename)}", "pvgis", f"{filename}_line.png"
+		)
+	render(
+		"line", df[label[0]], [df[label[1]]], line_plot_name, [label[1]],
+		label[0], label[1] + ("KWh"), colors=["orange"],
 		)
-	plt.savefig(line_plot_name)
-	plt.close()
 
 
 def main():
-	processed_list = process_json_files()
-	for processed_file in processed_list:
-		df_dropped = drop_dummy_columns(processed_file[0])
-		renamed_df = rename_columns(df_dropped)
+	manifest = Manifest(OUTPUT_DIR)
+	stale_files = [
+		os.path.join(JSON_DIR, filename) for filename in get_json_files()
+		if not manifest.is_fresh(*manifest_entry(filename), VERSION)
+		]
+	stale_series = [
+		os.path.join(SERIES_DIR, filename) for filename in get_series_files()
+		if not manifest.is_fresh(*series_manifest_entry(filename), VERSION)
+		]
+	for buffer in prefetch(stale_files + stale_series):
+		with buffer:
+			manifest.remember(buffer)
+			filename = os.path.basename(buffer.path)
+			if os.path.dirname(buffer.path) == SERIES_DIR:
+				process_series_file(filename, manifest, buffer.data)
+			else:
+				process_file(filename, manifest, buffer.data)
+	manifest.save()
+
+
+@timed("process_json_files")
+def process_file(filename, manifest=None, data=None):
+	"""
+	Processes, writes and plots a single json file of the json directory.
 
-		filename = processed_file[2].split(".")[0]
-		
-		if not os.path.exists(os.path.join(PWD, "output_dir")):
-			os.mkdir(os.path.join(PWD, "output_dir"))
-		
-		if not os.path.exists(os.path.join(PWD, "output_dir", f"{filename}")):
-			os.mkdir(os.path.join(PWD, "output_dir", f"{filename}"))
+	Parameters
+	----------
+	filename: str
+		name of the file without preceeding path information
 
-		if not os.path.exists(os.path.join(PWD, "output_dir", f"{filename}", "pvgis")):
-			os.mkdir(os.path.join(PWD, "output_dir", f"{filename}", "pvgis"))
+	manifest: Manifest
+		if given, the file is skipped when its input and output are
+		unchanged since it was last processed
 
-		
-		csv_file = os.path.join(
-			PWD, "output_dir", f"{filename}", "pvgis",  f"{filename}.csv"
+	data: bytes or mmap.mmap
+		content of the file if it was already read, see file_io
+
+	Returns
+	-------
+	processed: bool
+		False if the file was skipped
+	"""
+	if manifest is not None and manifest.is_fresh(
+		*manifest_entry(filename), VERSION):
+		return False
+
+	df = load_monthly_json(os.path.join(JSON_DIR, filename), data=data)
+	count_rows(len(df))
+	save_monthly_df(df, filename, manifest)
+	return True
+
+
+def manifest_entry(filename):
+	"""
+	Returns the manifest key, input files and output files of a json file
+	of the json directory.
+	"""
+	name = filename.split(".")[0]
+	return (
+		f"pvgis_json/{name}", [os.path.join(JSON_DIR, filename)],
+		[frame_path(os.path.join(OUTPUT_DIR, name, "pvgis", name))],
+		)
+
+
+@timed("process_series_files")
+def process_series_file(filename, manifest=None, data=None):
+	"""
+	Aggregates a single hourly seriescalc json file of the json_hourly
+	directory into each of SERIES_PERIODS and writes them to output_dir,
+	for comparisons at a higher resolution than the 12 monthly values.
+
+	Parameters
+	----------
+	filename: str
+		name of the file without preceeding path information
+
+	manifest: Manifest
+		if given, the file is skipped when its input and outputs are
+		unchanged since it was last processed
+
+	data: bytes or mmap.mmap
+		content of the file if it was already read, see file_io
+
+	Returns
+	-------
+	processed: bool
+		False if the file was skipped
+	"""
+	key, inputs, outputs = series_manifest_entry(filename)
+	if manifest is not None and manifest.is_fresh(
+		key, inputs, outputs, VERSION):
+		return False
+
+	times, values = load_hourly_json(inputs[0], data)
+	count_rows(len(times))
+	name = filename.split(".")[0]
+	os.makedirs(os.path.join(OUTPUT_DIR, name), exist_ok=True)
+	for period in SERIES_PERIODS:
+		write_frame(
+			aggregate_hourly(times, values, period),
+			os.path.join(OUTPUT_DIR, name, f"pvgis_{period}"),
 			)
 
-		drop_empty_cells(renamed_df).to_csv((csv_file))
-		plot(drop_empty_cells(renamed_df), processed_file)
+	if manifest is not None:
+		manifest.record(key, inputs, outputs, VERSION)
+	logging.info(f"series {filename} aggregated to {', '.join(SERIES_PERIODS)}")
+	return True
 
 
-if __name__=="__main__":
-	main()
+def series_manifest_entry(filename):
+	"""
+	Returns the manifest key, input files and output files of a json file
+	of the json_hourly directory.
+	"""
+	name = filename.split(".")[0]
+	return (
+		f"pvgis_series/{name}", [os.path.join(SERIES_DIR, filename)],
+		[
+			frame_path(os.path.join(OUTPUT_DIR, name, f"pvgis_{period}"))
+			for period in SERIES_PERIODS
+			],
+		)
 
 
-class Year():
-	"""Class for year object, its attributes and methods"""
-	def __init__(self, year=2020):
-		self.year = year
-		self.is_leap_year = False
-		self.days = 365
-		self.months = {
-		"Jan": 31, "Feb": 28, "Mar": 31, "Apr": 30, "May": 31, "Jun": 30,
-		"Jul": 31, "Aug": 31, "Sept": 30, "Oct":31 , "Nov": 30, "Dec": 31,
-		}
+def save_processed_file(processed_file, manifest=None):
+	"""
+	Writes the monthly PVGIS data of processed_file to output_dir and
+	plots it.
 
-	"""if is_leap_year == True:
-		self.days = 366
-		self.months["Feb"] = 29"""
+	Parameters
+	----------
+	processed_file: tuple
+		(df, df_columns, filename) as returned by process_json_file
 
-	def check_leap_yr(self, year):	
-		if year < 1999: logging.error("Enter a year in the 21st century.")
+	manifest: Manifest
+		if given, the written file is recorded in it
+	"""
+	df_dropped = drop_dummy_columns(processed_file[0])
+	renamed_df = rename_columns(df_dropped)
+	save_monthly_df(drop_empty_cells(renamed_df), processed_file[2], manifest)
 
-		if year > datetime.datetime.year:
-			logging.error("This year does not exit yet.")
 
-		if year % 4 == 0:
-			is_leap_year = True
-			self.days = 366
-			self.months["Feb"] = 29
-		return is_leap_year
+def save_monthly_df(df, filename, manifest=None):
+	"""
+	Writes monthly PVGIS data to output_dir and plots it.
 
-	def get_jan_1_weekday(self, year):
-		weekday = datetime.datetime.date(year=year, month=1, day=1).isoweekday()
-		return weekday
+	Parameters
+	----------
+	df: pandas.DataFrame
+		monthly data with the columns of NEW_DF_COLUMNS
 
-	def get_weeks_in_year(self, year):
-		weekday = get_jan_1_weekday(year)
-		week_1days = 7 - weekday
-		periods = float((days - week_1days) / 7)
+	filename: str
+		name of the json file the data comes from
 
-		if week_1_day < 7:
-			periods += 1
-		
-		if week_1days > 7:
-			logging.error("Week cannot be more than 7 days long")
-		
-		period_list = []
-		
-		period_list = [(f"{year}-i") for i in range(period)]
-		return period_list
+	manifest: Manifest
+		if given, the written file is recorded in it
+	"""
+	name = filename.split(".")[0]
+	os.makedirs(os.path.join(OUTPUT_DIR, name, "pvgis"), exist_ok=True)
+
+	write_frame(df, os.path.join(OUTPUT_DIR, name, "pvgis", name))
+	plot(df, (df, list(df), filename))
+
+	if manifest is not None:
+		manifest.record(*manifest_entry(filename), VERSION)
+
+
+if __name__=="__main__":
+	configure_logging()
+	main()
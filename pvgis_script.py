@@ -6,18 +6,13 @@ from pathlib import Path
 import pandas as pd
 import numpy as np
 import flat_table
-from matplotlib import pyplot as plt
 from process_json import get_lon_lat_from_filename
-
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler("debug.log"),
-        logging.StreamHandler()
-    ]
-)
+from manifest import Manifest, code_version
+from storage import frame_path, write_frame
+from render import render
+from instrument import configure_logging, count_rows, timed
+from site_info import SiteInfo, SiteTable
+from file_io import as_file, prefetch, read_file, scan_files
 
 
 PWD = os.path.dirname(__file__)
@@ -27,6 +22,18 @@ if not os.path.join(PWD, "pvgis_data"):
 
 CSV_DIR = os.path.join(PWD, "pvgis_data")
 
+OUTPUT_DIR = os.path.join(PWD, "output_dir")
+
+VERSION = code_version(__file__)
+
+# Non blank lines of a PVGIS monthly file holding the latitude, longitude,
+# nominal power, system losses and slope angle of the pv system
+PV_INFO_LINES = (0, 1, 3, 4, 5)
+
+HEADER_LINE = 8
+
+N_MONTHS = 12
+
 NEW_DF_COLUMNS = {
 	"SD_m": "Monthly Avg Standard Deviation", 
 	"H(i)_m": "Avg Monthly Sum Of Global Irradiation", 
@@ -38,44 +45,112 @@ NEW_DF_COLUMNS = {
 
 
 def main():
-	processed_list = open_csv_files()
-	for processed_file in processed_list:
-		df_dropped = process_df(processed_file[0])
-		pv_info = get_pv_info(processed_file[0])[1]
-		renamed_df = rename_columns(df_dropped).astype("float32")
-
-		filename = processed_file[2].split(".")[0]
-		
-		if not os.path.exists(os.path.join(PWD, "output_dir")):
-			os.mkdir(os.path.join(PWD, "output_dir"))
-		
-		if not os.path.exists(os.path.join(PWD, "output_dir", f"{filename}")):
-			os.mkdir(os.path.join(PWD, "output_dir", f"{filename}"))
-
-		if not os.path.exists(os.path.join(PWD, "output_dir", f"{filename}", "pvgis")):
-			os.mkdir(os.path.join(PWD, "output_dir", f"{filename}", "pvgis"))
-
-		
-		csv_file = os.path.join(
-			PWD, "output_dir", f"{filename}", "pvgis",  f"{filename}.csv"
-			)
-		
-		if os.path.exists(os.path.join(PWD, "output_dir", f"{filename}", "info.txt")):
-			os.remove(os.path.join(PWD, "output_dir", f"{filename}", "info.txt"))
-		
-		txt_file = os.path.join(PWD, "output_dir", f"{filename}", "info.txt")
-		with open(txt_file, "w") as text_file:
-			text_file.write("\n".join(pv_info))
-			text_file.close()
-			
-		renamed_df.to_csv((csv_file))
-		plot(renamed_df, processed_file)
-		
-		logging.info(f"file {csv_file} saved to "
-		f"{os.path.join(PWD, 'csv_files',)}")
+	manifest = Manifest(OUTPUT_DIR)
+	site_infos = []
+	stale_files = []
+	for filename in get_csv_files():
+		key = manifest_entry(filename)[0]
+		if manifest.is_fresh(*manifest_entry(filename), VERSION):
+			site_infos.append(SiteInfo(**manifest.result(key)))
+		else:
+			stale_files.append(os.path.join(CSV_DIR, filename))
+
+	for buffer in prefetch(stale_files):
+		with buffer:
+			manifest.remember(buffer)
+			site_infos.append(process_file(
+				os.path.basename(buffer.path), manifest, buffer.data
+				))
+	SiteTable.from_records(site_infos).save(OUTPUT_DIR)
+	manifest.save()
 	logging.info("done")
 
 
+@timed("open_csv_files")
+def process_file(filename, manifest=None, data=None):
+	"""
+	Processes, writes and plots a single csv file of the pvgis_data
+	directory.
+
+	Parameters
+	----------
+	filename: str
+		name of the file without preceeding path information
+
+	manifest: Manifest
+		if given, the file is skipped when its input and outputs are
+		unchanged since it was last processed
+
+	data: bytes
+		content of the file if it was already read, see file_io
+
+	Returns
+	-------
+	site_info: SiteInfo
+		the pv system of the file, as recorded in the manifest if the file
+		was skipped
+	"""
+	key = manifest_entry(filename)[0]
+	if manifest is not None and manifest.is_fresh(
+		*manifest_entry(filename), VERSION):
+		return SiteInfo(**manifest.result(key))
+
+	processed_file = open_csv_file(filename, data)
+	count_rows(len(processed_file[0]))
+	return save_processed_file(processed_file, manifest)
+
+
+def manifest_entry(filename):
+	"""
+	Returns the manifest key, input files and output files of a csv file
+	of the pvgis_data directory.
+	"""
+	name = filename.split(".")[0]
+	return (
+		f"pvgis/{name}", [os.path.join(CSV_DIR, filename)],
+		[frame_path(os.path.join(OUTPUT_DIR, name, "pvgis", name))],
+		)
+
+
+def save_processed_file(processed_file, manifest=None):
+	"""
+	Writes the monthly PVGIS data of processed_file to output_dir and
+	plots it.
+
+	Parameters
+	----------
+	processed_file: tuple
+		(df, pv_info, filename) as returned by open_csv_file
+
+	manifest: Manifest
+		if given, the written file and the pv system are recorded in it
+
+	Returns
+	-------
+	site_info: SiteInfo
+		the pv system of processed_file
+	"""
+	renamed_df = rename_columns(processed_file[0])
+	filename = processed_file[2].split(".")[0]
+	site_info = SiteInfo.from_pv_info(filename, processed_file[1])
+
+	os.makedirs(os.path.join(OUTPUT_DIR, filename, "pvgis"), exist_ok=True)
+
+	csv_file = write_frame(
+		renamed_df, os.path.join(OUTPUT_DIR, filename, "pvgis", filename)
+		)
+	plot(renamed_df, processed_file)
+
+	if manifest is not None:
+		manifest.record(
+			*manifest_entry(processed_file[2]), VERSION,
+			result=site_info.to_dict(),
+			)
+
+	logging.info(f"file {csv_file} saved to "
+	f"{os.path.join(OUTPUT_DIR, filename, 'pvgis')}")
+	return site_info
+
 
 def get_csv_files():
 	"""
@@ -88,16 +163,14 @@ def get_csv_files():
 		List of all csv files in the csv directory of the current 
 		working directory
 	"""
-	csv_files = []
-
-	for file in os.listdir(CSV_DIR):
-		if file.endswith(".csv"):
-			csv_files.append(file)
-	return csv_files
+	return scan_files(CSV_DIR, ".csv")
 
 
 def get_pv_info(df):
-	"""Gets information on the pv system"""
+	"""
+	Gets information on the pv system from a data frame read by
+	open_csv_file_legacy
+	"""
 	lon = df[1][0]
 	
 	lat = df[1][1]
@@ -112,31 +185,155 @@ def get_pv_info(df):
 
 def open_csv_files():
 	"""
-	Takes csv files in the current directory and opens them as a Data Frame
+	Takes csv files in the current directory and opens them with
+	open_csv_file
 
 	Returns
 	-------
-	df: pandas.DataFrame
-
-	df_columns: list
-		list of the data frame columns as string
+	processed_list: list
+		(df, pv_info, filename) of every file
 	"""
 	csv_files = get_csv_files()
 	processed_list = []
 
 	for filename in csv_files:
-		file = os.path.join(PWD, "pvgis_data", filename)
-		df = pd.read_csv(file, delimiter="\t", names=list(range(11)))
-		df_columns = list(df)
-
-		processed_list.append((df, df_columns, filename))
+		processed_list.append(open_csv_file(filename))
 	return processed_list
 
 
+def open_csv_file(filename, data=None):
+	"""
+	Opens a csv file in the pvgis_data directory with parse_pvgis_file.
+
+	Parameters
+	----------
+	filename: str
+		name of the file without preceeding path information
+
+	data: bytes or mmap.mmap
+		content of the file, read from the file if not given
+
+	Returns
+	-------
+	processed_file: tuple
+		(df, pv_info, filename) where df holds the monthly data as float32
+		and pv_info the pv system information, see parse_pvgis_file
+	"""
+	df, pv_info = parse_pvgis_file(os.path.join(CSV_DIR, filename), data)
+	return df, pv_info, filename
+
+
+def open_csv_file_legacy(filename):
+	"""
+	Opens a csv file in the pvgis_data directory as a padded 11 column
+	Data Frame and processes it like open_csv_file. Superseded by
+	open_csv_file, kept as the reference implementation for benchmark.py.
+	"""
+	file = os.path.join(CSV_DIR, filename)
+	df = pd.read_csv(file, delimiter="\t", names=list(range(11)))
+	pv_info = get_pv_info(df)[1]
+	return process_df(df).astype("float32"), pv_info, filename
+
+
+def parse_pvgis_file(file, data=None):
+	"""
+	Parses a PVGIS monthly text file in a single pass over its lines.
+
+	Blank lines are skipped. Of the remaining lines the first 8 hold the
+	pv system information, PV_INFO_LINES as "name:<tab>value", the ninth the tab
+	separated header of the monthly table starting with "Month" and the
+	next 12 the months 1 to 12. The footnotes after the table are not read.
+
+	Parameters
+	----------
+	file: str
+		path to the file
+
+	data: bytes or mmap.mmap
+		content of the file, read with file_io.read_file if not given
+
+	Returns
+	-------
+	df: pandas.DataFrame
+		one float32 column per header field and one row per month
+
+	pv_info: tuple
+		(lat, lon, power, losses, angle) as written in the file
+
+	Raises
+	------
+	ValueError
+		if the file does not have this layout
+	"""
+	if data is None:
+		with read_file(file) as buffer:
+			return parse_pvgis_file(file, buffer.data)
+
+	pv_info = []
+	header = None
+	months = np.empty((N_MONTHS, 0), dtype="float32")
+	n_months = 0
+	line_number = 0
+
+	lines = iter(as_file(data).readline, b"")
+	for line_number, line in enumerate(lines, start=1):
+		line = line.decode()
+		fields = line.rstrip().split("\t")
+		if not fields[0]:
+			continue
+
+		if header is None and len(pv_info) < HEADER_LINE:
+			if len(pv_info) in PV_INFO_LINES and len(fields) < 2:
+				raise ValueError(
+					f"{file}:{line_number}: expected pv system "
+					f"information as 'name:<tab>value', got {line!r}"
+					)
+			pv_info.append(fields[1] if len(fields) > 1 else None)
+		elif header is None:
+			if fields[0] != "Month":
+				raise ValueError(
+					f"{file}:{line_number}: expected the monthly header "
+					f"starting with 'Month', got {line!r}"
+					)
+			header = fields
+			months = np.empty((N_MONTHS, len(header)), dtype="float32")
+		else:
+			if len(fields) != len(header):
+				raise ValueError(
+					f"{file}:{line_number}: expected {len(header)} "
+					f"fields for month {n_months + 1}, got {len(fields)}"
+					)
+			try:
+				months[n_months] = fields
+			except ValueError as err:
+				raise ValueError(
+					f"{file}:{line_number}: non numeric value in month "
+					f"{n_months + 1}: {line!r}"
+					) from err
+			n_months += 1
+			if n_months == N_MONTHS:
+				break
+
+	if header is None or n_months < N_MONTHS:
+		raise ValueError(
+			f"{file}: expected {HEADER_LINE} lines of pv system information, "
+			f"a header and {N_MONTHS} months, the file ends at line "
+			f"{line_number}"
+			)
+	if not np.array_equal(months[:, 0], np.arange(1, N_MONTHS + 1)):
+		raise ValueError(
+			f"{file}: expected months 1 to {N_MONTHS}, got "
+			f"{months[:, 0].tolist()}"
+			)
+
+	df = pd.DataFrame(months, columns=header)
+	return df, tuple(pv_info[line] for line in PV_INFO_LINES)
+
+
 def process_df(df):
     """
-    Process df by dropping NaNs, input information and meta data and 
-    changes the header.
+    Process df, as read by open_csv_file_legacy, by dropping NaNs, input
+    information and meta data and changes the header.
 
     Parameters
     ----------
@@ -164,6 +361,7 @@ def rename_columns(df):
 	return df
 
 
+@timed("plot_pvgis")
 def plot(df, processed_file):
 	"""
 	Plots 'Average Monthly Energy Production' VS 'Month' and saves plot 
@@ -180,9 +378,9 @@ def plot(df, processed_file):
 	
 	try:
 		if not os.path.exists(
-		os.path.join(PWD,  "output_dir", f"{str(filename)}", "pvgis")):
+		os.path.join(OUTPUT_DIR, f"{str(filename)}", "pvgis")):
 			os.mkdir(
-				(os.path.join(PWD,  "output_dir", f"{str(filename)}", "pvgis")
+				(os.path.join(OUTPUT_DIR, f"{str(filename)}", "pvgis")
 				))
 			
 	except Exception as err:
@@ -190,51 +388,23 @@ def plot(df, processed_file):
 
 	label = ["Month", "Avg Monthly Energy Production"]
 
-	figure_title = f"{plt.xlabel} VS {plt.ylabel}"
-	fig = plt.figure(figure_title)
-
-	fig.set_size_inches(13.6, 7.06)	
-	plot_no = df.shape
-
-	color="orange"
-	plt.xlabel(label[0])
-	plt.ylabel(label[1] + ("KWh"))
-	plt.grid()
-	plt.margins(x=0)
-	plt.ticklabel_format(useOffset=False, axis="y", style="plain")
-
-	plt.bar(df[label[0]], df["Avg Monthly Energy Production"], label=label)
-	plt.legend()
-
 	bar_plot_name = os.path.join(
-		PWD,  "output_dir", f"{str(filename)}", "pvgis", f"{filename}_bar.png"
+		OUTPUT_DIR, f"{str(filename)}", "pvgis", f"{filename}_bar.png"
 		)
-	plt.savefig(bar_plot_name)
-	plt.close()
-
-	figure_title = f"{plt.xlabel} VS {plt.ylabel}"
-	fig = plt.figure(figure_title)
-
-	fig.set_size_inches(13.6, 7.06)	
-	plot_no = df.shape
-	
-	color="orange"
-	plt.xlabel(label[0])
-	plt.ylabel(label[1] + ("KWh"))
-	plt.grid()
-	plt.margins(x=0)
-	plt.ticklabel_format(useOffset=False, axis="y", style="plain")
-	plt.plot(
-		df[label[0]], df[label[1]], color=color, linewidth=1, label=label
+	render(
+		"bar", df[label[0]], [df[label[1]]], bar_plot_name, [label[1]],
+		label[0], label[1] + ("KWh"),
 		)
-	plt.legend()
 
 	line_plot_name = os.path.join(
-		PWD,  "output_dir", f"{str(filename)}", "pvgis", f"{filename}_line.png"
+		OUTPUT_DIR, f"{str(filename)}", "pvgis", f"{filename}_line.png"
+		)
+	render(
+		"line", df[label[0]], [df[label[1]]], line_plot_name, [label[1]],
+		label[0], label[1] + ("KWh"), colors=["orange"],
 		)
-	plt.savefig(line_plot_name)
-	plt.close()
 
 
 if __name__=="__main__":
+	configure_logging()
 	main()
\ No newline at end of file
@@ -1,60 +1,189 @@
-"""Process csv data downloaded from PVOUTPUT"""
+"""
+Process csv data downloaded from PVOUTPUT.
+
+Monthly exports are converted as they are. Daily exports and 5 minute
+interval (status) exports are streamed in chunks and resampled into
+calendar months with the number of days covered, see resample_csv_file.
+"""
+import io
 import os
 import re
 import glob
 import logging
 import datetime
 
-import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 
 from process_json import get_lon_lat_from_filename
+from manifest import Manifest, code_version
+from storage import frame_path, frame_writer, write_frame
+import render as renderer
+from render import render
+from instrument import configure_logging, count_rows, timed
+from file_io import as_file, prefetch, read_file, scan_files
+import calendar_table
 
 PWD = os.path.dirname(__file__)
 
 CSV_DIR = os.path.join(PWD, "csv")
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler("debug.log"),
-        logging.StreamHandler()
-    ]
-)
+OUTPUT_DIR = os.path.join(PWD, "output_dir")
 
-def main():
-	processed_list = process_csv_files()
-	for processed_file in processed_list:
+FLOAT_COLUMNS = ["Generated", "Efficiency", "Low", "High", "Average"]
 
-		df_to_string = to_str(processed_file[0])
-		df_to_float = str_to_float(df_to_string)
+UNIT_SUFFIXES = ["mwh", "kwh", "kwh/kw"]
 
-		filename = processed_file[2].split(".")[0]
+UNIT_SCALES = {"mwh": 1000, "kwh": 1, "kwh/kw": 1000}
 
-		if not os.path.exists(os.path.join(PWD, "output_dir")):
-			os.mkdir(os.path.join(PWD, "output_dir"))
-		
-		if not os.path.exists(os.path.join(PWD, "output_dir", f"{filename}")):
-			os.mkdir(os.path.join(PWD, "output_dir", f"{filename}"))
-		
-		if not os.path.exists(os.path.join(PWD, "output_dir", f"{filename}", "pvoutput")):
-			os.mkdir(os.path.join(PWD, "output_dir", f"{filename}", "pvoutput"))
+UNIT_LABELS = {"mwh": "(KWh)", "kwh": "(KWh)", "kwh/kw": "(KWh/KW)"}
 
+MONTH_NAMES = [
+	"Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct",
+	"Nov", "Dec",
+	]
 
-		csv_file = os.path.join(
-			PWD, "output_dir", f"{filename}", "pvoutput",  f"{filename}.csv"
-			)
-		df_to_float = df_to_float[::-1]
-		df_to_float.to_csv(csv_file)
-		plot(df_to_float, processed_file)
-		
-		logging.info(f"file {csv_file} saved to "
-		f"{os.path.join(PWD, 'csv_files',)}")
+MONTH_NUMBERS = {name: number for number, name in enumerate(MONTH_NAMES, 1)}
+
+# Energy column of the daily and interval layouts. In interval exports it
+# is the energy generated so far that day.
+ENERGY_COLUMNS = {"daily": "Generated", "interval": "Energy"}
+
+# Date layouts of PVOUTPUT exports, day first as on pvoutput.org
+DATE_FORMATS = [
+	(r"^\d{8}$", "%Y%m%d"),
+	(r"^\d{4}-\d{1,2}-\d{1,2}$", "%Y-%m-%d"),
+	(r"^\d{1,2}/\d{1,2}/\d{2}$", "%d/%m/%y"),
+	(r"^\d{1,2}/\d{1,2}/\d{4}$", "%d/%m/%Y"),
+	]
+
+RESAMPLE_CHUNKSIZE = 100_000
+
+# Bytes of a monthly export searched for line ends at once by
+# iter_csv_chunks
+SCAN_BLOCK = 1 << 24
+
+# Months covering less of their days have no Generated value
+MIN_MONTH_COVERAGE = 0.8
+
+FIRST_DAY = calendar_table.YEAR_STARTS[0]
+
+N_DAYS = calendar_table.MONTH_STARTS[-1, -1] - FIRST_DAY
+
+NAT_DAY = np.datetime64("NaT").astype("int64")
+
+VERSION = code_version(__file__)
+
+def main(chunksize=None):
+	"""
+	Reads, converts, writes and plots the csv files one file at a time so
+	that only a single file is held in memory.
+
+	Parameters
+	----------
+	chunksize: int
+		if given, each monthly csv file is read, converted and written
+		chunksize rows at a time, see save_csv_chunks, and daily and
+		interval files are resampled in chunks of chunksize rows
+	"""
+	manifest = Manifest(OUTPUT_DIR)
+	stale_files = [
+		os.path.join(CSV_DIR, filename) for filename in get_csv_files()
+		if not manifest.is_fresh(*manifest_entry(filename), VERSION)
+		]
+	for buffer in prefetch(stale_files):
+		with buffer:
+			manifest.remember(buffer)
+			process_file(
+				os.path.basename(buffer.path), chunksize, manifest, buffer.data
+				)
+	manifest.save()
 	logging.info("done")
 
 
+@timed("process_csv_files")
+def process_file(filename, chunksize=None, manifest=None, data=None):
+	"""
+	Converts, writes and plots a single csv file of the csv directory.
+
+	Parameters
+	----------
+	filename: str
+		name of the file without preceeding path information
+
+	chunksize: int
+		passed on to load_csv_file. Monthly exports are then written chunk
+		by chunk with save_csv_chunks.
+
+	manifest: Manifest
+		if given, the file is skipped when its input and output are
+		unchanged since it was last processed
+
+	data: bytes or mmap.mmap
+		content of the file if it was already read, see file_io
+
+	Returns
+	-------
+	processed: bool
+		False if the file was skipped
+	"""
+	if manifest is not None and manifest.is_fresh(
+		*manifest_entry(filename), VERSION):
+		return False
+
+	file = os.path.join(CSV_DIR, filename) if data is None else as_file(data)
+	if chunksize is not None and csv_layout(file) == "monthly":
+		count_rows(save_csv_chunks(file, filename, chunksize, manifest))
+		return True
+
+	df = load_csv_file(file, chunksize)
+	count_rows(len(df))
+	save_processed_file((df, list(df), filename), manifest)
+	return True
+
+
+def manifest_entry(filename):
+	"""
+	Returns the manifest key, input files and output files of a csv file
+	of the csv directory.
+	"""
+	name = filename.split(".")[0]
+	return (
+		f"pvoutput/{name}", [os.path.join(CSV_DIR, filename)],
+		[frame_path(os.path.join(OUTPUT_DIR, name, "pvoutput", name))],
+		)
+
+
+def save_processed_file(processed_file, manifest=None):
+	"""
+	Writes the converted data frame of processed_file to output_dir and
+	plots it.
+
+	Parameters
+	----------
+	processed_file: tuple
+		(df, df_columns, filename) as yielded by iter_csv_files, with df in
+		chronological order
+
+	manifest: Manifest
+		if given, the written file is recorded in it
+	"""
+	filename = processed_file[2].split(".")[0]
+	os.makedirs(os.path.join(OUTPUT_DIR, filename, "pvoutput"), exist_ok=True)
+
+	df_to_float = processed_file[0]
+	csv_file = write_frame(
+		df_to_float, os.path.join(OUTPUT_DIR, filename, "pvoutput", filename)
+		)
+	plot(df_to_float, processed_file)
+
+	if manifest is not None:
+		manifest.record(*manifest_entry(processed_file[2]), VERSION)
+
+	logging.info(f"file {csv_file} saved to "
+	f"{os.path.join(OUTPUT_DIR, filename, 'pvoutput')}")
+
+
 def get_csv_files():
 	"""
 	Gets all csv files in the csv directory in the present working 
@@ -66,18 +195,14 @@ def get_csv_files():
 		List of all csv files in the csv directory of the current 
 		working directory
 	"""
-	csv_files = []
-
-	for file in os.listdir(CSV_DIR):
-		if file.endswith(".csv"):
-			csv_files.append(file)
-	return csv_files
+	return scan_files(CSV_DIR, ".csv")
 
 
 def process_csv_files():
 	"""
 	Takes csv files in the current directory and converts them to a
-	dataframe.
+	dataframe. All files are held in memory at once, use iter_csv_files
+	to process them one at a time.
 
 	Returns
 	-------
@@ -90,7 +215,7 @@ def process_csv_files():
 	processed_list = []
 
 	for filename in csv_files:
-		file = os.path.join(PWD, "csv", filename)
+		file = os.path.join(CSV_DIR, filename)
 		df = pd.read_csv(file)
 		df_columns = list(df)
 
@@ -98,6 +223,396 @@ def process_csv_files():
 	return processed_list
 
 
+def iter_csv_files(chunksize=None, manifest=None):
+	"""
+	Lazily reads and converts the csv files in the csv directory. Files
+	are read ahead concurrently by file_io.prefetch and converted in the
+	order the reads complete.
+
+	Parameters
+	----------
+	chunksize: int
+		passed on to load_csv_file
+
+	manifest: Manifest
+		if given, files that are unchanged since they were last processed
+		are skipped
+
+	Yields
+	------
+	processed_file: tuple
+		(df, df_columns, filename) where df is the chronological monthly
+		data of load_csv_file
+	"""
+	stale_files = [
+		os.path.join(CSV_DIR, filename) for filename in get_csv_files()
+		if manifest is None or not manifest.is_fresh(
+			*manifest_entry(filename), VERSION)
+		]
+	for buffer in prefetch(stale_files):
+		if manifest is not None:
+			manifest.remember(buffer)
+		with buffer:
+			df = load_csv_file(as_file(buffer.data), chunksize)
+		yield df, list(df), os.path.basename(buffer.path)
+
+
+def load_csv_file(file, chunksize=None):
+	"""
+	Reads a PVOUTPUT export of any layout into chronological monthly data.
+
+	Parameters
+	----------
+	file: str or file like
+		path to the csv file or a buffer of its content
+
+	chunksize: int
+		passed on to convert_csv_file for monthly exports, the chunk size
+		of resample_csv_file otherwise
+
+	Returns
+	-------
+	df: pandas.DataFrame
+		the converted monthly export, oldest month first, or the monthly
+		data of resample_csv_file
+	"""
+	layout = csv_layout(file)
+	if layout == "monthly":
+		return convert_csv_file(file, chunksize)[::-1]
+	return resample_csv_file(file, layout, chunksize or RESAMPLE_CHUNKSIZE)
+
+
+def month_keys(df):
+	"""
+	Returns the year and calendar month of each row of monthly data of
+	load_csv_file, from its "Year" and "Month Number" columns or else its
+	"Month" labels, e.g. "Jan 23". Rows of both layouts can be mixed, as
+	when the frames of many sites are read together with
+	storage.read_frames.
+
+	Raises
+	------
+	ValueError
+		if a label is not a month name and two digit year
+	"""
+	year = np.zeros(len(df), dtype="int64")
+	month = np.zeros(len(df), dtype="int64")
+	labelled = np.ones(len(df), dtype=bool)
+	if "Year" in df and "Month Number" in df:
+		labelled = (df["Year"].isna() | df["Month Number"].isna()).to_numpy()
+		year[~labelled] = df["Year"].to_numpy()[~labelled]
+		month[~labelled] = df["Month Number"].to_numpy()[~labelled]
+	if not labelled.any():
+		return year, month
+
+	labels = df["Month"][labelled].astype(str).str.strip()
+	label_month = labels.str[:3].str.title().map(MONTH_NUMBERS)
+	label_year = pd.to_numeric(labels.str[-2:], errors="coerce") + 2000
+	invalid = label_month.isna() | label_year.isna() | (labels.str.len() != 6)
+	if invalid.any():
+		raise ValueError(
+			f"expected months as 'Jan 23', got {labels[invalid].iloc[0]!r}"
+			)
+	year[labelled] = label_year
+	month[labelled] = label_month
+	return year, month
+
+
+def csv_layout(file):
+	"""
+	Returns the layout of a PVOUTPUT export from its header: "monthly",
+	"daily" or "interval"
+
+	Raises
+	------
+	ValueError
+		if the header matches none of them
+	"""
+	if isinstance(file, str):
+		with open(file, "rb") as csv_file:
+			header = csv_file.readline()
+	else:
+		header = file.readline()
+		file.seek(0)
+	columns = [
+		column.strip().strip('"')
+		for column in header.decode("utf-8-sig").split(",")
+		]
+
+	if "Month" in columns:
+		return "monthly"
+	if "Date" in columns and "Time" in columns and "Energy" in columns:
+		return "interval"
+	if "Date" in columns and "Generated" in columns:
+		return "daily"
+	raise ValueError(f"unknown PVOUTPUT export layout with columns {columns}")
+
+
+def resample_csv_file(file, layout, chunksize=RESAMPLE_CHUNKSIZE):
+	"""
+	Streams a daily or interval PVOUTPUT export into calendar months.
+
+	Each chunk of chunksize rows has its dates converted to day numbers
+	and its energy to KWh, and is folded into one array of the energy of
+	each day, taking the largest value of a day so the running total of
+	an interval export gives the day's energy. Only these two columns of
+	one chunk are held as strings at once.
+
+	Parameters
+	----------
+	file: str or file like
+		path to the csv file, read through a memory map, or a buffer of
+		its content
+
+	layout: str
+		"daily" or "interval", see csv_layout
+
+	Returns
+	-------
+	df: pandas.DataFrame
+		see monthly_from_days
+	"""
+	energy_column = ENERGY_COLUMNS[layout]
+	day_energy = np.full(N_DAYS, np.nan)
+	day_samples = np.zeros(N_DAYS, dtype="int64")
+	date_format = None
+	dropped = 0
+
+	with pd.read_csv(
+		file, usecols=["Date", energy_column], dtype=str, chunksize=chunksize,
+		memory_map=isinstance(file, str),
+		) as reader:
+		for chunk in reader:
+			days, date_format = to_days(chunk["Date"], date_format)
+			energy = to_kwh(chunk[energy_column])[0]
+			index = days - FIRST_DAY
+			valid = (
+				~np.isnan(energy) & (days != NAT_DAY)
+				& (index >= 0) & (index < N_DAYS)
+				)
+			dropped += len(valid) - np.count_nonzero(valid)
+
+			np.fmax.at(day_energy, index[valid], energy[valid])
+			day_samples += np.bincount(index[valid], minlength=N_DAYS)
+
+	if dropped:
+		logging.warning(f"dropped {dropped} rows without a date or energy")
+	return monthly_from_days(day_energy, day_samples)
+
+
+def to_days(dates, date_format=None):
+	"""
+	Converts PVOUTPUT dates to days since 1970-01-01, NAT_DAY where a
+	date cannot be read.
+
+	Parameters
+	----------
+	dates: pandas.Series
+		strings in one of DATE_FORMATS
+
+	date_format: str
+		format of the dates, detected from the first one if not given
+
+	Returns
+	-------
+	days: numpy.ndarray
+
+	date_format: str
+	"""
+	if date_format is None:
+		first = dates.dropna().str.strip()
+		first = first.iloc[0] if len(first) else ""
+		for pattern, candidate in DATE_FORMATS:
+			if re.match(pattern, first):
+				date_format = candidate
+				break
+		else:
+			raise ValueError(f"unknown PVOUTPUT date layout {first!r}")
+
+	days = pd.to_datetime(
+		dates.str.strip(), format=date_format, errors="coerce"
+		).to_numpy(dtype="datetime64[D]")
+	return days.astype("int64"), date_format
+
+
+def monthly_from_days(day_energy, day_samples):
+	"""
+	Sums the energy of each day into calendar months.
+
+	Parameters
+	----------
+	day_energy: numpy.ndarray
+		energy of each day since FIRST_DAY, NaN for days without data
+
+	day_samples: numpy.ndarray
+		number of rows of each day
+
+	Returns
+	-------
+	df: pandas.DataFrame
+		one row per month from the first to the last month with data,
+		with its "Month" label as in monthly exports, e.g. "Jan 23",
+		"Generated (KWh)", the measured energy scaled to the whole month,
+		NaN if less than MIN_MONTH_COVERAGE of its days have data,
+		"Measured (KWh)", "Year", "Month Number", "Days" with data, "Days
+		In Month", "Coverage", the fraction of days with data, and
+		"Samples", the number of rows
+	"""
+	days = np.flatnonzero(day_samples)
+	if not len(days):
+		raise ValueError("no dated energy values in the PVOUTPUT export")
+
+	years, months, _ = calendar_table.year_month_day(days + FIRST_DAY)
+	keys = (years - calendar_table.FIRST_YEAR) * 12 + months - 1
+	first = keys.min()
+	n_months = keys.max() - first + 1
+	local = keys - first
+
+	measured = np.bincount(local, weights=day_energy[days], minlength=n_months)
+	covered = np.bincount(local, minlength=n_months)
+	samples = np.bincount(
+		local, weights=day_samples[days], minlength=n_months
+		).astype("int64")
+
+	month_keys = np.arange(first, first + n_months)
+	days_in_month = calendar_table.MONTH_DAYS.ravel()[month_keys]
+	coverage = covered / days_in_month
+	with np.errstate(divide="ignore", invalid="ignore"):
+		generated = np.where(
+			coverage >= MIN_MONTH_COVERAGE, measured / coverage, np.nan
+			)
+
+	year = month_keys // 12 + calendar_table.FIRST_YEAR
+	month = month_keys % 12 + 1
+	labels = [
+		f"{MONTH_NAMES[m - 1]} {y % 100:02d}"
+		for y, m in zip(year.tolist(), month.tolist())
+		]
+	return pd.DataFrame({
+		"Month": labels,
+		"Generated (KWh)": generated.astype("float32"),
+		"Measured (KWh)": measured.astype("float32"),
+		"Year": year,
+		"Month Number": month,
+		"Days": covered,
+		"Days In Month": days_in_month,
+		"Coverage": coverage.astype("float32"),
+		"Samples": samples,
+		})
+
+
+def convert_csv_file(file, chunksize=None):
+	"""
+	Reads a PVOUTPUT csv file and converts its values to float.
+
+	Parameters
+	----------
+	file: str or file like
+		path to the csv file, read through a memory map, or a buffer of
+		its content
+
+	chunksize: int
+		if given, the file is read and converted chunksize rows at a time
+		with iter_csv_chunks. Only the converted float32 chunks are kept,
+		use save_csv_chunks to write them without keeping them.
+
+	Returns
+	-------
+	df: pandas.DataFrame
+		in the order of the file, newest month first
+	"""
+	memory_map = isinstance(file, str)
+	if chunksize is None:
+		return str_to_float(to_str(pd.read_csv(file, memory_map=memory_map)))
+	return pd.concat(list(iter_csv_chunks(file, chunksize)))[::-1]
+
+
+def iter_csv_chunks(file, chunksize):
+	"""
+	Reads a monthly PVOUTPUT export, newest month first, from its end
+	chunksize rows at a time and yields each chunk converted to float with
+	its oldest month first, so the chunks are in chronological order. The
+	line ends are found in SCAN_BLOCK byte blocks of the file, and only the
+	raw strings of one chunk are parsed at once. The rows keep their
+	position in the file as index.
+
+	Parameters
+	----------
+	file: str or file like
+		path to the csv file, read with file_io.read_file, or a buffer of
+		its content as returned by file_io.as_file
+	"""
+	if isinstance(file, str):
+		with read_file(file) as buffer:
+			yield from iter_csv_chunks(as_file(buffer.data), chunksize)
+		return
+
+	view = file.getbuffer() if isinstance(file, io.BytesIO) else file
+	data = np.frombuffer(view, dtype="uint8")
+	line_ends = [
+		np.flatnonzero(data[start:start + SCAN_BLOCK] == ord("\n")) + start + 1
+		for start in range(0, len(data), SCAN_BLOCK)
+		]
+	if len(data) and data[-1] != ord("\n"):
+		line_ends.append(np.array([len(data)]))
+	if not line_ends:
+		raise ValueError("empty PVOUTPUT export")
+	line_ends = np.concatenate(line_ends)
+	header = bytes(data[:line_ends[0]])
+
+	columns = None
+	stop = len(line_ends)
+	while True:
+		start = max(1, stop - chunksize)
+		rows = bytes(data[line_ends[start - 1]:line_ends[stop - 1]])
+		chunk = pd.read_csv(io.BytesIO(header + rows))
+		chunk.index = pd.RangeIndex(start - 1, start - 1 + len(chunk))
+		chunk = to_str(chunk)
+		if len(chunk):
+			chunk = str_to_float(chunk)[::-1]
+			if columns is None:
+				columns = chunk.columns
+			chunk.columns = columns
+			yield chunk
+		stop = start
+		if stop <= 1:
+			break
+
+
+def save_csv_chunks(file, filename, chunksize, manifest=None):
+	"""
+	Converts a monthly PVOUTPUT export with iter_csv_chunks and writes each
+	chunk to output_dir, oldest month first, as soon as it is converted,
+	with storage.frame_writer. Only the month and generated columns are
+	kept, to plot the file, and nothing when plots are off.
+
+	Returns
+	-------
+	rows: int
+		number of rows written
+	"""
+	name = filename.split(".")[0]
+	os.makedirs(os.path.join(OUTPUT_DIR, name, "pvoutput"), exist_ok=True)
+	stem = os.path.join(OUTPUT_DIR, name, "pvoutput", name)
+
+	plotted = []
+	rows = 0
+	with frame_writer(stem) as append:
+		for chunk in iter_csv_chunks(file, chunksize):
+			append(chunk)
+			if renderer.PLOT_MODE != "off":
+				plotted.append(chunk.iloc[:, :2])
+			rows += len(chunk)
+	if plotted:
+		df = pd.concat(plotted)
+		plot(df, (df, list(df), filename))
+
+	if manifest is not None:
+		manifest.record(*manifest_entry(filename), VERSION)
+	logging.info(f"file {frame_path(stem)} saved to {os.path.dirname(stem)}")
+	return rows
+
+
 def to_str(df):
 	"""
 	Converts dtype of data frame columns to string.
@@ -115,13 +630,85 @@ def to_str(df):
 
 	for column in columns:
 		df[column] = df[column].astype("string")
-	df = df.drop(0)
+	df = df.drop(0, errors="ignore")
+	return df
+
+
+@timed("str_to_float")
+def str_to_float(df, columns=FLOAT_COLUMNS):
+	"""
+	Converts df values of df items from string to floats, one column at a
+	time. Thousands separators are stripped, the unit suffix of each row is
+	detected and values are scaled to KWh.
+
+	Parameters
+	----------
+	df: pandas.DataFrame
+
+	columns: list
+		columns to be converted, defaults to FLOAT_COLUMNS
+
+	Returns
+	-------
+	df: pandas.DataFrame
+		Pandas dataframe with columns as float32 and renamed with their
+		unit.
+	"""
+	for column in columns:
+		number, label = to_kwh(df[column], "float32")
+		df[column] = pd.Series(number, index=df.index)
+
+		if label is not None:
+			new_column = f"{column.split(' ')[0]} {label}"
+			df.rename(columns={column: new_column}, inplace=True)
 	return df
 
 
-def str_to_float(df):
+def to_kwh(values, dtype="float64"):
 	"""
-	Converts df values of df items from string to floats
+	Converts PVOUTPUT energy strings, e.g. "1,234.5kWh" or "1.2MWh", to
+	KWh, or KWh/KW for efficiencies, by their unit suffix. Values without
+	a known suffix are NaN.
+
+	Parameters
+	----------
+	values: pandas.Series
+
+	dtype: str
+		dtype of the result
+
+	Returns
+	-------
+	values: numpy.ndarray
+
+	label: str
+		unit label of the result, one of UNIT_LABELS, None if no value had
+		a unit
+	"""
+	values = values.to_numpy(dtype=object, na_value="").astype(str)
+	values = np.char.lower(
+		np.char.replace(np.char.replace(values, ",", ""), " ", "")
+		)
+
+	scale = np.full(len(values), np.nan, dtype=dtype)
+	label = None
+	for unit in UNIT_SUFFIXES:
+		matched = np.isnan(scale) & np.char.endswith(values, unit)
+		scale[matched] = UNIT_SCALES[unit]
+		if matched.any():
+			label = UNIT_LABELS[unit]
+
+	number = pd.to_numeric(
+		np.char.rstrip(values, "kmwh/"), errors="coerce"
+		).astype(dtype)
+	return number * scale, label
+
+
+def str_to_float_legacy(df):
+	"""
+	Converts df values of df items from string to floats one cell at a
+	time. Superseded by str_to_float, kept as the reference implementation
+	for benchmark.py.
 
 	Parameters
 	----------
@@ -200,6 +787,7 @@ def strip_string(string):
 		print(err)
 
 
+@timed("plot_pvoutput")
 def plot(df, processed_file):
 	"""
 	Plots 'Generated' in KWh VS 'Month' and saves plot 
@@ -213,64 +801,39 @@ def plot(df, processed_file):
 	
 	try:
 		if not os.path.exists(
-		os.path.join(PWD,  "output_dir", f"{str(filename)}", "pvoutput")):
+		os.path.join(OUTPUT_DIR, f"{str(filename)}", "pvoutput")):
 			os.mkdir(
-				(os.path.join(PWD,  "output_dir", f"{str(filename)}", "pvoutput")
+				(os.path.join(OUTPUT_DIR, f"{str(filename)}", "pvoutput")
 				))
 			
 	except Exception as err:
 
 		print(f"{err} occured")
 
-	color = "red"
 	df_columns = list(df)
 	label = [df_columns[0], df_columns[1]]
-
-	figure_title = f"{plt.xlabel} VS {plt.ylabel}"
-	fig = plt.figure(figure_title)
-
-	fig.set_size_inches(13.6, 7.06)	
-	plot_no = df.shape
-
-	color="blue"
-	plt.xlabel(label[0])
-	plt.ylabel(label[1])
-	plt.grid()
-	plt.margins(x=0)
-	plt.ticklabel_format(useOffset=False, axis="y", style="plain")
-
-	plt.bar(df[label[0]], df[label[1]], label=label)
-	plt.legend()
+	x_axis = np.arange(len(df))
+	months = [str(month) for month in df[label[0]]]
 
 	bar_plot_name = os.path.join(
-		PWD,  "output_dir", f"{str(filename)}", "pvoutput", f"{filename}_bar.png"
+		OUTPUT_DIR, f"{str(filename)}", "pvoutput", f"{filename}_bar.png"
 		)
-	plt.savefig(bar_plot_name)
-	plt.close()
-
-	figure_title = f"{plt.xlabel} VS {plt.ylabel}"
-	fig = plt.figure(figure_title)
-	fig.set_size_inches(13.6, 7.06)	
-	plot_no = df.shape
-	color="blue"
-	plt.xlabel(label[0])
-	plt.ylabel(label[1] )
-	plt.grid()
-	plt.margins(x=0)
-	plt.ticklabel_format(useOffset=False, axis="y", style="plain")
-	plt.plot(
-		df[label[0]], df[label[1]], color=color, linewidth=1, label=label
+	render(
+		"bar", x_axis, [df[label[1]]], bar_plot_name, [label[1]], label[0],
+		label[1], xticklabels=months,
 		)
-	plt.legend()
 
 	line_plot_name = os.path.join(
-		PWD,  "output_dir", f"{str(filename)}", "pvoutput", f"{filename}_line.png"
+		OUTPUT_DIR, f"{str(filename)}", "pvoutput", f"{filename}_line.png"
+		)
+	render(
+		"line", x_axis, [df[label[1]]], line_plot_name, [label[1]], label[0],
+		label[1], xticklabels=months, colors=["blue"],
 		)
-	plt.savefig(line_plot_name)
-	plt.close()
 
 
 if __name__=="__main__":
+	configure_logging()
 	main()
 
 
@@ -0,0 +1,281 @@
+"""
+Renders the bar and line plots of the pipeline with the Agg backend.
+
+Building a figure, its axes, grid, legend and text is a large part of the
+cost of a plot, so each layout is built once per process as a
+PlotTemplate and only the bar heights, line data and text are updated for
+every site. No pyplot state is used, so plots can be rendered in worker
+processes.
+
+With PLOT_MODE "deferred" nothing is drawn: render writes the plot's data
+to a spec file next to the png instead, for render_service to draw on
+demand. With "off" plots are skipped altogether.
+"""
+import os
+import json
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from file_io import replacing
+
+FIGURE_SIZE = (13.6, 7.06)
+
+BAR_WIDTH = 0.3
+
+PNG_COMPRESS_LEVEL = 1
+
+PLOT_MODES = ["eager", "deferred", "off"]
+
+PLOT_MODE = os.environ.get("PV_PLOT_MODE", "eager")
+
+SPEC_EXTENSION = ".plot.json"
+
+TEMPLATES = {}
+
+
+class PlotTemplate():
+    """
+    A figure with the axes, artists and text of one plot layout, reused
+    for every plot with that layout.
+
+    Parameters
+    ----------
+    kind: str
+        "bar" or "line"
+
+    n_points: int
+        number of points of each series
+
+    labels: list
+        legend label of each series
+
+    xlabel, ylabel: str
+        axis labels
+
+    xticks, xticklabels: list
+        fixed ticks of the x axis, if any
+
+    colors: list
+        color of each series, defaults to the color cycle
+
+    text: bool
+        whether the plot has an annotation text box
+    """
+    def __init__(
+        self, kind, n_points, labels, xlabel, ylabel, xticks=None,
+        xticklabels=None, colors=None, text=False,
+        ):
+        self.kind = kind
+        self.xticks = xticks
+        self.xticklabels = xticklabels
+
+        self.figure = Figure(figsize=FIGURE_SIZE)
+        FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        colors = colors or [None] * len(labels)
+
+        zeros = np.zeros(n_points)
+        if kind == "bar":
+            width = BAR_WIDTH if len(labels) > 1 else 0.8
+            self.offsets = (
+                (np.arange(len(labels)) - (len(labels) - 1) / 2) * width
+                )
+            self.artists = [
+                self.ax.bar(
+                    zeros + offset, zeros, width=width, align="center",
+                    label=label, color=color,
+                    )
+                for offset, label, color in zip(self.offsets, labels, colors)
+                ]
+        elif kind == "line":
+            self.offsets = np.zeros(len(labels))
+            self.artists = [
+                self.ax.plot(
+                    zeros, zeros, color=color, linewidth=1, label=label
+                    )[0]
+                for label, color in zip(labels, colors)
+                ]
+        else:
+            raise ValueError(f"unknown plot kind {kind!r}")
+
+        self.ax.set_xlabel(xlabel)
+        self.ax.set_ylabel(ylabel)
+        self.ax.grid()
+        self.ax.margins(x=0)
+        self.ax.ticklabel_format(useOffset=False, axis="y", style="plain")
+        self.ax.legend()
+
+        self.text = None
+        if text:
+            self.text = self.figure.text(
+                .15, .7, "", backgroundcolor="white", fontfamily="monospace",
+                fontsize="x-small",
+                )
+
+    def draw(self, x, series, path, text=None, xticklabels=None):
+        """
+        Updates the plot with the data of one site and saves it.
+
+        Parameters
+        ----------
+        x: array like
+            x values shared by all series
+
+        series: list
+            y values of each series
+
+        path: str
+            path of the saved png
+
+        text: str
+            annotation text
+
+        xticklabels: list
+            labels of the ticks at x, for templates without fixed ticks
+        """
+        x = np.asarray(x, dtype="float64")
+        for artist, offset, y in zip(self.artists, self.offsets, series):
+            y = np.asarray(y, dtype="float64")
+            if self.kind == "bar":
+                width = artist.patches[0].get_width()
+                for rect, left, height in zip(
+                    artist.patches, x + offset - width / 2, y
+                    ):
+                    rect.set_x(left)
+                    rect.set_height(height)
+            else:
+                artist.set_data(x, y)
+
+        self.ax.relim()
+        self.ax.autoscale_view()
+        if self.xticks is not None:
+            self.ax.set_xticks(self.xticks, self.xticklabels)
+        elif xticklabels is not None:
+            self.ax.set_xticks(x, xticklabels)
+
+        if self.text is not None:
+            self.text.set_text(text or "")
+        with replacing(path) as tmp_path:
+            self.figure.savefig(
+                tmp_path, format="png",
+                pil_kwargs={"compress_level": PNG_COMPRESS_LEVEL},
+                )
+
+
+def render(
+    kind, x, series, path, labels, xlabel, ylabel, xticks=None,
+    xticklabels=None, colors=None, text=None,
+    ):
+    """
+    Renders a bar or line plot to path, reusing the process' template for
+    the layout. See PlotTemplate for the parameters.
+
+    xticklabels are fixed ticks of the layout when xticks is given, and
+    labels of the ticks at x otherwise.
+    """
+    if PLOT_MODE == "off":
+        return
+    if PLOT_MODE == "deferred":
+        write_spec(
+            path, kind=kind, x=x, series=series, labels=labels,
+            xlabel=xlabel, ylabel=ylabel, xticks=xticks,
+            xticklabels=xticklabels, colors=colors, text=text,
+            )
+        return
+
+    draw(
+        kind, x, series, path, labels, xlabel, ylabel, xticks=xticks,
+        xticklabels=xticklabels, colors=colors, text=text,
+        )
+
+
+def draw(
+    kind, x, series, path, labels, xlabel, ylabel, xticks=None,
+    xticklabels=None, colors=None, text=None,
+    ):
+    """Draws a plot to path whatever the PLOT_MODE, see render"""
+    x = np.asarray(x)
+    fixed_ticks = xticks is not None
+    key = (
+        kind, len(x), tuple(labels), xlabel, ylabel,
+        tuple(xticks) if fixed_ticks else None,
+        tuple(xticklabels) if fixed_ticks else None,
+        tuple(colors) if colors else None, text is not None,
+        )
+
+    template = TEMPLATES.get(key)
+    if template is None:
+        template = PlotTemplate(
+            kind, len(x), labels, xlabel, ylabel, xticks=xticks,
+            xticklabels=xticklabels if fixed_ticks else None, colors=colors,
+            text=text is not None,
+            )
+        TEMPLATES[key] = template
+
+    template.draw(
+        x, series, path, text=text,
+        xticklabels=None if fixed_ticks else xticklabels,
+        )
+
+
+def spec_path(path):
+    """Returns the path of the spec file of the png at path"""
+    return os.path.splitext(path)[0] + SPEC_EXTENSION
+
+
+def png_path(spec_file):
+    """Returns the path of the png described by a spec file"""
+    return spec_file[:-len(SPEC_EXTENSION)] + ".png"
+
+
+def write_spec(path, **spec):
+    """
+    Writes the arguments of render for the png at path to its spec file.
+    Arrays are stored as lists.
+    """
+    spec["x"] = np.asarray(spec["x"], dtype="float64").tolist()
+    spec["series"] = [
+        np.asarray(y, dtype="float64").tolist() for y in spec["series"]
+        ]
+    for name in ("labels", "xticks", "xticklabels", "colors"):
+        if spec[name] is not None:
+            spec[name] = [
+                value.item() if isinstance(value, np.generic) else value
+                for value in spec[name]
+                ]
+
+    with replacing(spec_path(path)) as tmp_path, open(tmp_path, "w") as file:
+        json.dump(spec, file)
+
+
+def render_spec(spec_file, force=False):
+    """
+    Draws the png described by a spec file unless it is already newer
+    than the spec.
+
+    Returns
+    -------
+    path: str
+        path of the png
+    """
+    path = png_path(spec_file)
+    if (
+        not force and os.path.exists(path)
+        and os.path.getmtime(path) >= os.path.getmtime(spec_file)
+        ):
+        return path
+
+    with open(spec_file) as file:
+        spec = json.load(file)
+
+    kind = spec.pop("kind")
+    x = spec.pop("x")
+    series = spec.pop("series")
+    labels = spec.pop("labels")
+    xlabel = spec.pop("xlabel")
+    ylabel = spec.pop("ylabel")
+
+    draw(kind, x, series, path, labels, xlabel, ylabel, **spec)
+    return path
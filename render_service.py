@@ -0,0 +1,170 @@
+"""
+Draws the plots recorded by a run with PV_PLOT_MODE=deferred, either from
+the command line or on first request through a small local http server.
+Drawn pngs are kept next to their spec and served from there afterwards.
+
+    python render_service.py render [site ...]
+    python render_service.py serve --port 8000
+"""
+import os
+import html
+import logging
+import argparse
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote
+
+from render import SPEC_EXTENSION, png_path, render_spec
+from instrument import configure_logging
+from artifact_index import load_index
+
+PARENT_FOLDER = os.path.join(os.path.dirname(__file__), "output_dir")
+
+
+def find_specs(output_dir, site):
+    """
+    Returns the spec files of all plots of a site.
+
+    Parameters
+    ----------
+    output_dir: str
+        output directory of the pipeline
+
+    site: str
+        name of the site folder in output_dir
+    """
+    spec_files = []
+    for root, dirs, files in os.walk(os.path.join(output_dir, site)):
+        for file in files:
+            if file.endswith(SPEC_EXTENSION):
+                spec_files.append(os.path.join(root, file))
+    return sorted(spec_files)
+
+
+def render_sites(output_dir, sites=None, force=False):
+    """
+    Draws the deferred plots of the given sites, or of every site. The
+    spec files are found with the artifact_index.ArtifactIndex of
+    output_dir.
+
+    Returns
+    -------
+    paths: list
+        paths of the drawn or already up to date pngs
+    """
+    index = load_index(output_dir)
+    paths = []
+    for site in sites or index.sites():
+        for spec_file, _ in index.artifacts(site).get("spec", []):
+            paths.append(render_spec(spec_file, force))
+    return paths
+
+
+class PlotRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves /<site>/ as a list of the site's plots and /<site>/<plot>.png
+    as the png, drawing it on first request.
+    """
+    output_dir = PARENT_FOLDER
+
+    def do_GET(self):
+        output_dir = os.path.realpath(self.output_dir)
+        path = os.path.realpath(
+            os.path.join(output_dir, unquote(self.path).lstrip("/"))
+            )
+        if os.path.commonpath([output_dir, path]) != output_dir:
+            self.send_error(403)
+            return
+
+        if os.path.isdir(path):
+            self.send_index(output_dir, path)
+            return
+
+        spec_file = os.path.splitext(path)[0] + SPEC_EXTENSION
+        if path.endswith(".png") and os.path.exists(spec_file):
+            path = render_spec(spec_file)
+
+        if not path.endswith(".png") or not os.path.exists(path):
+            self.send_error(404)
+            return
+
+        with open(path, "rb") as file:
+            body = file.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_index(self, output_dir, path):
+        """Sends an html list of the sites or of the plots of a site"""
+        if path == output_dir:
+            links = [
+                f"{site}/" for site in sorted(os.listdir(path))
+                if os.path.isdir(os.path.join(path, site))
+                ]
+        else:
+            site = os.path.relpath(path, output_dir).split(os.sep)[0]
+            links = [
+                "/".join(os.path.relpath(png_path(spec_file), path).split(os.sep))
+                for spec_file in find_specs(output_dir, site)
+                ]
+
+        body = "".join(
+            f'<li><a href="{html.escape(link)}">{html.escape(link)}</a></li>'
+            for link in links
+            )
+        body = f"<ul>{body}</ul>".encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.info(format % args)
+
+
+def serve(output_dir, host="127.0.0.1", port=8000):
+    """
+    Serves the plots of output_dir until interrupted. Requests are handled
+    one at a time as the figure templates are shared.
+    """
+    PlotRequestHandler.output_dir = output_dir
+    server = HTTPServer((host, port), PlotRequestHandler)
+    logging.info(f"serving plots of {output_dir} on http://{host}:{port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    configure_logging(log_file=None)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-o", "--output-dir", default=PARENT_FOLDER,
+        help="output directory of the pipeline",
+        )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    render_parser = commands.add_parser("render", help="draw deferred plots")
+    render_parser.add_argument(
+        "sites", nargs="*", help="sites to draw, defaults to every site"
+        )
+    render_parser.add_argument(
+        "--force", action="store_true",
+        help="redraw plots whose png is up to date",
+        )
+
+    serve_parser = commands.add_parser("serve", help="serve plots over http")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+
+    args = parser.parse_args()
+    if args.command == "render":
+        for path in render_sites(args.output_dir, args.sites, args.force):
+            print(path)
+    else:
+        serve(args.output_dir, args.host, args.port)
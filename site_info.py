@@ -0,0 +1,146 @@
+"""
+Metadata of the pv systems of the fleet, read from the PVGIS files.
+
+SiteInfo holds the system of one site as it is passed between stages,
+and SiteTable the systems of every site as one NumPy structured array,
+written once per run to sites.npy in the output directory.
+"""
+import os
+from dataclasses import dataclass, asdict
+
+import numpy as np
+
+from file_io import replacing
+
+SITE_TABLE_FILE = "sites.npy"
+
+SITE_DTYPE = np.dtype([
+    ("site", "U64"), ("lat", "float64"), ("lon", "float64"),
+    ("power", "float32"), ("losses", "float32"), ("angle", "float32"),
+    ])
+
+LOCATION_DECIMALS = 3
+
+
+@dataclass(slots=True)
+class SiteInfo():
+    """
+    The pv system of a site.
+
+    Parameters
+    ----------
+    site: str
+        name of the site
+
+    lat, lon: float
+        location in decimal degrees, north and east positive
+
+    power: float
+        nominal power in KW
+
+    losses: float
+        system losses in %
+
+    angle: float
+        slope angle in degrees
+    """
+    site: str
+    lat: float
+    lon: float
+    power: float
+    losses: float
+    angle: float
+
+    @classmethod
+    def from_pv_info(cls, site, pv_info):
+        """
+        Builds a SiteInfo from the (lat, lon, power, losses, angle) strings
+        of pvgis_script.parse_pvgis_file
+        """
+        return cls(site, *(float(value) for value in pv_info))
+
+    def to_dict(self):
+        return asdict(self)
+
+    def location(self):
+        """Returns the location as text, e.g. '45.812N,8.628E'"""
+        lat = f"{abs(self.lat):g}{'S' if self.lat < 0 else 'N'}"
+        lon = f"{abs(self.lon):g}{'W' if self.lon < 0 else 'E'}"
+        return f"{lat},{lon}"
+
+
+class SiteTable():
+    """
+    The pv systems of many sites, one row of SITE_DTYPE per site, with
+    lookup by site and by location.
+
+    Parameters
+    ----------
+    array: numpy.ndarray
+        structured array of SITE_DTYPE
+    """
+    def __init__(self, array):
+        self.array = np.asarray(array, dtype=SITE_DTYPE)
+        self.index = {site: i for i, site in enumerate(self.array["site"])}
+        self.locations = {}
+        keys = zip(
+            np.round(self.array["lat"], LOCATION_DECIMALS).tolist(),
+            np.round(self.array["lon"], LOCATION_DECIMALS).tolist(),
+            )
+        for i, key in enumerate(keys):
+            self.locations.setdefault(key, []).append(i)
+
+    @classmethod
+    def from_records(cls, site_infos):
+        """Builds a table from SiteInfo objects"""
+        array = np.array(
+            [
+                (info.site, info.lat, info.lon, info.power, info.losses,
+                    info.angle)
+                for info in site_infos
+                ],
+            dtype=SITE_DTYPE,
+            )
+        return cls(array)
+
+    @classmethod
+    def load(cls, output_dir):
+        """Reads the table written by save to output_dir"""
+        return cls(np.load(os.path.join(output_dir, SITE_TABLE_FILE)))
+
+    def save(self, output_dir):
+        """Writes the table to sites.npy in output_dir"""
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, SITE_TABLE_FILE)
+        with replacing(path) as tmp_path, open(tmp_path, "wb") as file:
+            np.save(file, self.array)
+
+    def __len__(self):
+        return len(self.array)
+
+    def __contains__(self, site):
+        return site in self.index
+
+    def __getitem__(self, site):
+        """Returns the SiteInfo of a site, raises KeyError if missing"""
+        row = self.array[self.index[site]]
+        return SiteInfo(
+            str(row["site"]), float(row["lat"]), float(row["lon"]),
+            float(row["power"]), float(row["losses"]), float(row["angle"]),
+            )
+
+    def get(self, site, default=None):
+        """Returns the SiteInfo of a site, or default if missing"""
+        if site not in self.index:
+            return default
+        return self[site]
+
+    def at(self, lat, lon):
+        """
+        Returns the sites at a location, compared to LOCATION_DECIMALS
+        decimals
+        """
+        key = round(lat, LOCATION_DECIMALS), round(lon, LOCATION_DECIMALS)
+        return [
+            str(self.array["site"][i]) for i in self.locations.get(key, [])
+            ]
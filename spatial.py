@@ -0,0 +1,252 @@
+"""
+Spatial queries over the sites of the fleet.
+
+A GridIndex buckets the site coordinates of the SiteTable into cells of
+GRID_CELL_DEGREES, so a bounding box or radius query only tests the sites
+of the cells it overlaps. FleetRegions combines the index with the
+monthly arrays saved by statistics.calculate_fleet_stats to answer
+"how do PVGIS and PVOUTPUT compare in this region" without reading any
+site folder.
+
+    python spatial.py bbox 45 5 50 10
+    python spatial.py radius 48.1 11.6 100
+"""
+import os
+import argparse
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from site_info import SiteTable
+from statistics import fleet_metrics, load_fleet_arrays
+
+PARENT_FOLDER = os.path.join(os.path.dirname(__file__), "output_dir")
+
+GRID_CELL_DEGREES = 1.0
+
+EARTH_RADIUS_KM = 6371.0
+
+# Multiplier of the grid row in a cell's key, larger than any column
+CELL_KEY_STRIDE = 1 << 32
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Returns the great circle distances in km from a point to points"""
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = (
+        np.sin((lats - lat) / 2) ** 2
+        + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+        )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+class GridIndex():
+    """
+    A uniform grid over site coordinates.
+
+    Parameters
+    ----------
+    lat, lon: numpy.ndarray
+        coordinates of the sites in decimal degrees
+
+    cell_degrees: float
+        size of a grid cell
+    """
+    def __init__(self, lat, lon, cell_degrees=GRID_CELL_DEGREES):
+        self.lat = np.asarray(lat, dtype="float64")
+        self.lon = np.asarray(lon, dtype="float64")
+        self.cell_degrees = cell_degrees
+
+        rows, cols = self.cells(self.lat, self.lon)
+        keys = rows * CELL_KEY_STRIDE + cols
+        self.order = np.argsort(keys, kind="stable")
+        unique, starts, counts = np.unique(
+            keys[self.order], return_index=True, return_counts=True
+            )
+        self.buckets = {
+            key: (start, start + count)
+            for key, start, count in zip(
+                unique.tolist(), starts.tolist(), counts.tolist()
+                )
+            }
+
+    def cells(self, lat, lon):
+        """Returns the grid row and column of coordinates"""
+        return (
+            np.floor(np.asarray(lat) / self.cell_degrees).astype("int64"),
+            np.floor(np.asarray(lon) / self.cell_degrees).astype("int64"),
+            )
+
+    def candidates(self, min_lat, min_lon, max_lat, max_lon):
+        """Returns the sites in the cells overlapping a bounding box"""
+        (row_0, row_1), (col_0, col_1) = self.cells(
+            [min_lat, max_lat], [min_lon, max_lon]
+            )
+        found = [
+            self.order[slice(*self.buckets[row * CELL_KEY_STRIDE + col])]
+            for row in range(row_0, row_1 + 1)
+            for col in range(col_0, col_1 + 1)
+            if row * CELL_KEY_STRIDE + col in self.buckets
+            ]
+        if not found:
+            return np.empty(0, dtype="int64")
+        return np.concatenate(found)
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        Returns the indices of the sites within a bounding box, edges
+        included
+        """
+        found = self.candidates(min_lat, min_lon, max_lat, max_lon)
+        inside = (
+            (self.lat[found] >= min_lat) & (self.lat[found] <= max_lat)
+            & (self.lon[found] >= min_lon) & (self.lon[found] <= max_lon)
+            )
+        return np.sort(found[inside])
+
+    def radius(self, lat, lon, km):
+        """
+        Returns the indices of the sites within km of a point. Regions
+        crossing the poles or the antimeridian are not supported.
+        """
+        dlat = np.degrees(km / EARTH_RADIUS_KM)
+        dlon = dlat / max(np.cos(np.radians(lat)), 1e-6)
+        found = self.candidates(lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+        inside = haversine_km(lat, lon, self.lat[found], self.lon[found]) <= km
+        return np.sort(found[inside])
+
+
+def region_stats(predicted, actual, lengths):
+    """
+    Aggregates the monthly arrays of the sites of a region.
+
+    Parameters
+    ----------
+    predicted, actual: numpy.ndarray
+        (sites x months) arrays of the region's sites
+
+    lengths: numpy.ndarray
+        number of months of each site
+
+    Returns
+    -------
+    stats: dict
+        number of sites, the bias of PVGIS over all sites, the mean and
+        median absolute error of the site means (p_error of main) and the
+        median of each statistic of statistics.fleet_metrics
+    """
+    stats = {"sites": len(actual)}
+    if not len(actual):
+        return stats
+
+    with np.errstate(divide="ignore", invalid="ignore"), \
+        warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean_actual = np.nanmean(actual, axis=1)
+        mean_predicted = np.nanmean(predicted, axis=1)
+        p_error = np.abs((mean_actual - mean_predicted) / mean_actual)
+        paired = ~(np.isnan(actual) | np.isnan(predicted))
+        stats["PVGIS Bias"] = (
+            predicted[paired].sum() / actual[paired].sum() - 1
+            )
+        stats["Mean Error"] = np.nanmean(p_error)
+        stats["Median Error"] = np.nanmedian(p_error)
+        for name, values in fleet_metrics(predicted, actual, lengths).items():
+            stats[f"Median {name}"] = np.nanmedian(values)
+    return {name: float(value) for name, value in stats.items()}
+
+
+class FleetRegions():
+    """
+    Region queries over the sites with both coordinates in the SiteTable
+    and monthly arrays from statistics.load_fleet_arrays.
+
+    Parameters
+    ----------
+    site_table: SiteTable
+
+    sites: list
+        site of each row of predicted and actual
+
+    predicted, actual: numpy.ndarray
+        (sites x months) arrays
+
+    lengths: numpy.ndarray
+        number of months of each site
+    """
+    def __init__(
+        self, site_table, sites, predicted, actual, lengths,
+        cell_degrees=GRID_CELL_DEGREES,
+        ):
+        rows = np.array(
+            [i for i, site in enumerate(sites) if site in site_table],
+            dtype="int64",
+            )
+        self.sites = [sites[i] for i in rows]
+        self.predicted = predicted[rows]
+        self.actual = actual[rows]
+        self.lengths = lengths[rows]
+
+        table_rows = [site_table.index[site] for site in self.sites]
+        self.lat = site_table.array["lat"][table_rows]
+        self.lon = site_table.array["lon"][table_rows]
+        self.index = GridIndex(self.lat, self.lon, cell_degrees)
+
+    @classmethod
+    def load(cls, output_dir, cell_degrees=GRID_CELL_DEGREES):
+        """Loads the sites.npy and monthly arrays of an output directory"""
+        return cls(
+            SiteTable.load(output_dir), *load_fleet_arrays(output_dir),
+            cell_degrees=cell_degrees,
+            )
+
+    def stats(self, rows):
+        """Returns region_stats of the sites at rows, and their names"""
+        stats = region_stats(
+            self.predicted[rows], self.actual[rows], self.lengths[rows]
+            )
+        return stats, [self.sites[i] for i in rows]
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Returns the stats and sites within a bounding box"""
+        return self.stats(self.index.bbox(min_lat, min_lon, max_lat, max_lon))
+
+    def radius(self, lat, lon, km):
+        """Returns the stats and sites within km of a point"""
+        return self.stats(self.index.radius(lat, lon, km))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter,
+        )
+    parser.add_argument(
+        "-o", "--output-dir", default=PARENT_FOLDER,
+        help="output directory of the pipeline",
+        )
+    parser.add_argument(
+        "--sites", action="store_true", help="also list the sites found"
+        )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bbox_parser = commands.add_parser("bbox", help="sites in a bounding box")
+    for name in ("min_lat", "min_lon", "max_lat", "max_lon"):
+        bbox_parser.add_argument(name, type=float)
+
+    radius_parser = commands.add_parser("radius", help="sites near a point")
+    for name in ("lat", "lon", "km"):
+        radius_parser.add_argument(name, type=float)
+
+    args = parser.parse_args()
+    regions = FleetRegions.load(args.output_dir)
+    if args.command == "bbox":
+        stats, sites = regions.bbox(
+            args.min_lat, args.min_lon, args.max_lat, args.max_lon
+            )
+    else:
+        stats, sites = regions.radius(args.lat, args.lon, args.km)
+
+    print(pd.Series(stats).to_string())
+    if args.sites:
+        print("\n".join(sites))
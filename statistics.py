@@ -1,37 +1,77 @@
 import os
+import sys
+import logging
+import warnings
 
 import pandas as pd
 import numpy as np
 
-def main(dir_):
+from manifest import Manifest, code_version
+import storage
+from storage import (
+    extension, frame_path, frame_stem, is_store_uri, list_frames, read_joined,
+    split_store_uri, write_frame,
+    )
+from store import open_store
+from artifact_index import load_index
+from instrument import count_rows, timed
+from file_io import replacing
+
+VERSION = code_version(__file__)
+
+N_MONTHS = 12
+
+FLEET_STATS_FILE = "fleet_stats.csv"
+
+FLEET_ARRAYS_FILE = "fleet_monthly.npz"
+
+
+def main(dir_, fleet=False):
+    if fleet:
+        calculate_fleet_stats(dir_)
+        return
+
+    manifest = Manifest(dir_)
     found_files = get_csv_files(dir_)
     for csv_file in found_files:
         try:
-            calculate_stats(csv_file)
+            calculate_stats(csv_file, manifest)
         except ValueError:
             raise
+    manifest.save()
 
 
-def get_csv_files(dir):
+def get_csv_files(dir, index=None, fmt=None):
     """
-    Recursively walks a dir and returns a list of all the csv files 
-    in all children directiories.
+    Returns the joined files, in fmt or else the intermediate format, of
+    every site folder of dir, from its artifact_index.ArtifactIndex,
+    loaded if not given. With the sqlite format the joined frames of the
+    store in dir are returned instead.
     """
-    found_files = []
-    for root, dirs, files in os.walk(dir):
-        for file in files:
-            if file.endswith(".csv") and file.startswith("joined"):
-                found_files.append(os.path.join(root, file))
-        else:
-            for dir in dirs:
-                dir = os.path.join(root, dir)
-                get_csv_files(dir)
-    return found_files
+    if (fmt or storage.INTERMEDIATE_FORMAT) == "sqlite":
+        return list_frames(dir, "joined")
+    return (index or load_index(dir)).find("joined", extension(fmt))
 
 
-def calculate_stats(csv_file):
-    df = pd.read_csv(csv_file, index_col=0)
-    df = df.T
+@timed("calculate_stats")
+def calculate_stats(csv_file, manifest=None):
+    """
+    Calculates error statistics of a joined file and writes them to
+    stats.csv in the same folder, or to the stats table of the store for a
+    joined frame in a store. If a manifest is given, the file is skipped
+    when it is unchanged since its stats were last calculated.
+    """
+    site_dir = os.path.dirname(frame_stem(csv_file))
+    stats_stem = os.path.join(site_dir, "stats")
+    stats_format = "sqlite" if is_store_uri(csv_file) else "csv"
+    stats_file = frame_path(stats_stem, stats_format)
+    key = f"stats/{os.path.basename(site_dir)}"
+    if manifest is not None and manifest.is_fresh(
+        key, [csv_file], [stats_file], VERSION):
+        return
+
+    df = read_joined(csv_file)
+    count_rows(len(df))
     df.columns = ["month", "predicted", "actual", "Error"]
 
     mean_actual = df["actual"].mean()
@@ -59,10 +99,239 @@ def calculate_stats(csv_file):
         'cv predicted': std_predicted/mean_predicted},
         index=[0]
     )
-    file_location = "\\".join(csv_file.split(".")[0].split("\\")[:-1])
-    statistics_df.to_csv(os.path.join(file_location, "stats.csv"))
+    write_frame(statistics_df, stats_stem, stats_format)
+
+    if manifest is not None:
+        manifest.record(key, [csv_file], [stats_file], VERSION)
+
+
+def load_joined(csv_files):
+    """
+    Stacks the predicted (PVGIS) and actual (PVOUTPUT) series of joined
+    files into two (sites x 12) arrays. Missing months are NaN.
+
+    Returns
+    -------
+    sites: list
+        site name of each row
+
+    predicted, actual: numpy.ndarray
+
+    lengths: numpy.ndarray
+        number of months in each joined file
+    """
+    predicted = np.full((len(csv_files), N_MONTHS), np.nan)
+    actual = np.full((len(csv_files), N_MONTHS), np.nan)
+    lengths = np.zeros(len(csv_files), dtype="int64")
+    sites = []
+
+    if csv_files and all(map(is_store_uri, csv_files)):
+        return load_joined_store(csv_files)
+
+    for i, csv_file in enumerate(csv_files):
+        values = read_joined(csv_file).to_numpy(dtype="float64")[:N_MONTHS]
+        predicted[i, :len(values)] = values[:, 1]
+        actual[i, :len(values)] = values[:, 2]
+        lengths[i] = len(values)
+        sites.append(os.path.basename(os.path.dirname(csv_file)))
+    return sites, predicted, actual, lengths
+
+
+def load_joined_store(uris):
+    """
+    Loads the joined frames of a store with a single query, see
+    load_joined
+    """
+    frames = [split_store_uri(uri) for uri in uris]
+    sites = [site for output_dir, kind, site in frames]
+    df = open_store(frames[0][0]).read_all("joined")
+    df = df[df["site"].isin(sites) & (df["row"] < N_MONTHS)]
+    values = df.drop(columns=["site", "row"]).to_numpy(dtype="float64")
+
+    index = pd.Index(sites).get_indexer(df["site"])
+    rows = df["row"].to_numpy()
+    predicted = np.full((len(sites), N_MONTHS), np.nan)
+    actual = np.full((len(sites), N_MONTHS), np.nan)
+    predicted[index, rows] = values[:, 1]
+    actual[index, rows] = values[:, 2]
+    lengths = np.bincount(index, minlength=len(sites))
+    return sites, predicted, actual, lengths
+
+
+def save_fleet_arrays(dir_, sites, predicted, actual, lengths, csv_files=None):
+    """
+    Writes the arrays of load_joined to fleet_monthly.npz in dir_, for
+    fleet wide queries without reading every joined file again. The
+    joined files they were loaded from are recorded, relative to dir_,
+    with their joined_stamps, to tell when the arrays are stale. Arrays
+    without any site do not replace a saved file.
+    """
+    csv_files = csv_files or []
+    path = os.path.join(dir_, FLEET_ARRAYS_FILE)
+    if not len(sites) and os.path.exists(path):
+        logging.warning(f"no joined files found, keeping {path}")
+        return
+    with replacing(path) as tmp_path, open(tmp_path, "wb") as file:
+        np.savez(
+            file, sites=np.array(sites, dtype=str), predicted=predicted,
+            actual=actual, lengths=lengths,
+            sources=np.array(
+                [os.path.relpath(csv_file, dir_) for csv_file in csv_files],
+                dtype=str,
+                ),
+            stamps=joined_stamps(csv_files),
+            )
+
+
+def joined_stamps(csv_files):
+    """
+    Returns the (files x 2) size and modification time of joined files,
+    or the row count and write time of joined frames in a store, zero for
+    a missing one
+    """
+    stamps = np.zeros((len(csv_files), 2), dtype="int64")
+    for i, csv_file in enumerate(csv_files):
+        if is_store_uri(csv_file):
+            recorded = storage.store_fingerprint(csv_file)
+            if recorded is not None:
+                stamps[i] = recorded["size"], recorded["mtime_ns"]
+        elif os.path.exists(csv_file):
+            stat = os.stat(csv_file)
+            stamps[i] = stat.st_size, stat.st_mtime_ns
+    return stamps
+
+
+def load_fleet_arrays(dir_, csv_files=None):
+    """
+    Returns the arrays of load_joined for every joined file under dir_,
+    from fleet_monthly.npz if it was written for the same joined files,
+    unchanged since, and else by loading and saving them. Unless given,
+    the joined files are those of the format of the files recorded in
+    fleet_monthly.npz, whatever the intermediate format of the process.
+    """
+    path = os.path.join(dir_, FLEET_ARRAYS_FILE)
+    sources = None
+    if os.path.exists(path):
+        with np.load(path) as arrays:
+            if "sources" in arrays:
+                sources = arrays["sources"].tolist()
+
+    if csv_files is None:
+        fmt = storage.path_format(sources[0]) if sources else None
+        csv_files = get_csv_files(dir_, fmt=fmt)
+    if sources is not None:
+        with np.load(path) as arrays:
+            fresh = (
+                sources == [
+                    os.path.relpath(csv_file, dir_) for csv_file in csv_files
+                    ]
+                and np.array_equal(arrays["stamps"], joined_stamps(csv_files))
+                )
+            if fresh:
+                return (
+                    arrays["sites"].tolist(), arrays["predicted"],
+                    arrays["actual"], arrays["lengths"],
+                    )
+    if os.path.exists(path):
+        logging.info(f"{path} is stale, loading the joined files again")
+
+    arrays = load_joined(csv_files)
+    save_fleet_arrays(dir_, *arrays, csv_files)
+    return arrays
+
+
+def fleet_metrics(predicted, actual, lengths=None):
+    """
+    Calculates the statistics of calculate_stats for every site at once.
+    NaNs are skipped like pandas does.
+
+    Parameters
+    ----------
+    predicted, actual: numpy.ndarray
+        (sites x months) arrays
+
+    lengths: numpy.ndarray
+        number of months of each site, used by SMAPE, defaults to the
+        number of columns
+
+    Returns
+    -------
+    metrics: dict
+        one array of length sites for each statistic
+    """
+    if lengths is None:
+        lengths = np.full(len(actual), actual.shape[1])
+
+    with np.errstate(divide="ignore", invalid="ignore"), \
+        warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean_actual = np.nanmean(actual, axis=1)
+        mean_predicted = np.nanmean(predicted, axis=1)
+        std_actual = np.nanstd(actual, axis=1, ddof=1)
+        std_predicted = np.nanstd(predicted, axis=1, ddof=1)
+
+        paired = ~(np.isnan(actual) | np.isnan(predicted))
+        actual_dev = np.where(paired, actual, np.nan)
+        actual_dev -= np.nanmean(actual_dev, axis=1, keepdims=True)
+        predicted_dev = np.where(paired, predicted, np.nan)
+        predicted_dev -= np.nanmean(predicted_dev, axis=1, keepdims=True)
+        corr_coefficient = (
+            np.nansum(actual_dev * predicted_dev, axis=1)
+            / np.sqrt(
+                np.nansum(actual_dev ** 2, axis=1)
+                * np.nansum(predicted_dev ** 2, axis=1)
+                )
+            )
+
+        diff = predicted - actual
+        mae = np.nanmean(np.abs(diff), axis=1)
+        smape = 100 / lengths * np.nansum(
+            2 * np.abs(diff) / (np.abs(predicted) + np.abs(actual)), axis=1
+            )
+        mape = np.nanmean(np.abs(diff / actual), axis=1) * 100
+        mase = mae / np.nanmean(np.abs(np.diff(actual, axis=1)), axis=1)
+        rmse = np.sqrt(np.nanmean(diff ** 2, axis=1))
+
+        return {
+            'Mean Actual': mean_actual,
+            'Mean Predicted': mean_predicted,
+            'MAE': mae,
+            'RMSE': rmse,
+            'SMAPE': smape,
+            'MAPE': mape,
+            'MASE': mase,
+            'Pearson Correlation Coefficient': corr_coefficient,
+            'rrmse': rmse / mean_actual,
+            'cv actual': std_actual / mean_actual,
+            'cv predicted': std_predicted / mean_predicted,
+            }
+
+
+def calculate_fleet_stats(dir_, csv_files=None):
+    """
+    Calculates the statistics of every joined file under dir_ in one
+    vectorized pass and writes them to a single fleet_stats.csv in dir_,
+    one row per site. The monthly arrays they are calculated from are
+    saved with save_fleet_arrays.
+
+    Returns
+    -------
+    statistics_df: pandas.DataFrame
+    """
+    if csv_files is None:
+        csv_files = get_csv_files(dir_)
+
+    sites, predicted, actual, lengths = load_joined(csv_files)
+    save_fleet_arrays(dir_, sites, predicted, actual, lengths, csv_files)
+    statistics_df = pd.DataFrame(
+        fleet_metrics(predicted, actual, lengths),
+        index=pd.Index(sites, name="Site"),
+        )
+    with replacing(os.path.join(dir_, FLEET_STATS_FILE)) as tmp_path:
+        statistics_df.to_csv(tmp_path)
+    return statistics_df
 
 
 if __name__ == "__main__":
     dir_ = os.path.join(os.path.dirname(__file__), "output_dir")
-    main(dir_)
\ No newline at end of file
+    main(dir_, fleet="--fleet" in sys.argv[1:])
\ No newline at end of file
@@ -0,0 +1,328 @@
+"""
+Reading and writing of the data frames passed between pipeline stages.
+
+Frames are addressed by a stem, the path of the file without extension,
+laid out as <output_dir>/<site>/<kind>/<site> for the parsed inputs and
+<output_dir>/<site>/joined_<site> or <output_dir>/<site>/<kind> for the
+rest. With the "sqlite" format the frames are rows of the consolidated
+store in the output directory (see store.py) and their paths are store
+uris, "<database>#<kind>/<site>", instead of file paths.
+"""
+import os
+from contextlib import contextmanager
+
+import pandas as pd
+
+from store import STORE_FILE, open_store
+from file_io import replacing
+
+FORMATS = {
+    "csv": ".csv", "parquet": ".parquet", "feather": ".feather",
+    "sqlite": ".sqlite",
+    }
+
+STORE_SEPARATOR = "#"
+
+INTERMEDIATE_FORMAT = os.environ.get("PV_INTERMEDIATE_FORMAT", "csv")
+
+
+def check_format(fmt):
+    """
+    Raises an error if fmt is not a known format or if the optional
+    dependency it needs is not installed.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(
+            f"unknown intermediate format {fmt!r}, expected one of "
+            f"{', '.join(FORMATS)}"
+            )
+
+    if fmt in ("parquet", "feather"):
+        try:
+            import pyarrow
+        except ImportError as err:
+            raise ImportError(
+                f"the {fmt} intermediate format requires pyarrow"
+                ) from err
+
+
+def extension(fmt=None):
+    """Returns the file extension of fmt, defaults to INTERMEDIATE_FORMAT"""
+    return FORMATS[fmt or INTERMEDIATE_FORMAT]
+
+
+def path_format(path):
+    """Returns the format of a frame's path, None if it is not a frame"""
+    if is_store_uri(path):
+        return "sqlite"
+    for fmt, fmt_extension in FORMATS.items():
+        if fmt != "sqlite" and path.endswith(fmt_extension):
+            return fmt
+    return None
+
+
+def frame_path(stem, fmt=None):
+    """
+    Returns the path of an intermediate file.
+
+    Parameters
+    ----------
+    stem: str
+        path of the file without extension
+
+    fmt: str
+        one of FORMATS, defaults to INTERMEDIATE_FORMAT
+    """
+    if (fmt or INTERMEDIATE_FORMAT) == "sqlite":
+        output_dir, kind, site = split_stem(stem)
+        return store_uri(output_dir, kind, site)
+    return stem + extension(fmt)
+
+
+def split_stem(stem):
+    """
+    Returns the output directory, kind and site of a frame's stem, see the
+    module docstring for the layout
+    """
+    parent, name = os.path.split(stem)
+    grandparent = os.path.dirname(parent)
+    if os.path.basename(grandparent) == name:
+        return os.path.dirname(grandparent), os.path.basename(parent), name
+
+    site = os.path.basename(parent)
+    if name == f"joined_{site}":
+        name = "joined"
+    return grandparent, name, site
+
+
+def join_stem(output_dir, kind, site):
+    """Returns the stem of a frame, the inverse of split_stem"""
+    if kind in ("pvgis", "pvoutput"):
+        return os.path.join(output_dir, site, kind, site)
+    if kind == "joined":
+        return os.path.join(output_dir, site, f"joined_{site}")
+    return os.path.join(output_dir, site, kind)
+
+
+def store_uri(output_dir, kind, site):
+    """Returns the path of a frame in the store of output_dir"""
+    return (
+        f"{os.path.join(output_dir, STORE_FILE)}{STORE_SEPARATOR}{kind}/{site}"
+        )
+
+
+def is_store_uri(path):
+    """Checks if path is the path of a frame in a store"""
+    return STORE_SEPARATOR in path and path.split(STORE_SEPARATOR)[0].endswith(
+        STORE_FILE
+        )
+
+
+def split_store_uri(path):
+    """Returns the output directory, kind and site of a store uri"""
+    database, key = path.rsplit(STORE_SEPARATOR, 1)
+    kind, site = key.split("/", 1)
+    return os.path.dirname(database), kind, site
+
+
+def frame_stem(path):
+    """Returns the stem of a frame's path, the inverse of frame_path"""
+    if is_store_uri(path):
+        return join_stem(*split_store_uri(path))
+    return os.path.splitext(path)[0]
+
+
+def exists(path):
+    """Checks if a frame or file exists"""
+    if is_store_uri(path):
+        output_dir, kind, site = split_store_uri(path)
+        return open_store(output_dir).fingerprint(kind, site) is not None
+    return os.path.exists(path)
+
+
+def store_fingerprint(path):
+    """
+    Returns the fingerprint of a frame in a store, see
+    store.FleetStore.fingerprint
+    """
+    output_dir, kind, site = split_store_uri(path)
+    return open_store(output_dir).fingerprint(kind, site)
+
+
+def list_frames(output_dir, kind):
+    """
+    Returns the paths of the frames of kind of every site in a store.
+    Only for the sqlite format, file formats are found by walking
+    output_dir.
+    """
+    return [
+        store_uri(output_dir, kind, site)
+        for site in open_store(output_dir).sites(kind)
+        ]
+
+
+def write_frame(df, stem, fmt=None):
+    """
+    Writes a data frame in the intermediate format. Parquet and feather
+    keep the dtypes of the columns, e.g. float32, and drop the index.
+    Files are written through file_io.replacing.
+
+    Returns
+    -------
+    path: str
+        path of the written file
+    """
+    fmt = fmt or INTERMEDIATE_FORMAT
+    path = frame_path(stem, fmt)
+
+    if fmt == "sqlite":
+        output_dir, kind, site = split_stem(stem)
+        open_store(output_dir).write(kind, site, df)
+        return path
+
+    check_format(fmt)
+    with replacing(path) as tmp_path:
+        if fmt == "csv":
+            df.to_csv(tmp_path)
+        elif fmt == "parquet":
+            df.reset_index(drop=True).to_parquet(tmp_path, index=False)
+        elif fmt == "feather":
+            df.reset_index(drop=True).to_feather(tmp_path)
+    return path
+
+
+@contextmanager
+def frame_writer(stem, fmt=None):
+    """
+    Writes a frame in the intermediate format chunk by chunk, so a frame
+    larger than memory never has to be held at once. Yields a function
+    appending a data frame of rows to the frame, each chunk must have the
+    same columns and dtypes. The frame is complete when the context
+    exits, files are written through file_io.replacing.
+
+    Yields
+    ------
+    append: function
+        taking a data frame
+    """
+    fmt = fmt or INTERMEDIATE_FORMAT
+    check_format(fmt)
+    if fmt == "sqlite":
+        output_dir, kind, site = split_stem(stem)
+        with open_store(output_dir).writer(kind, site) as append:
+            yield append
+        return
+
+    if fmt in ("parquet", "feather"):
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+
+    state = {"chunks": 0, "writer": None}
+    with replacing(frame_path(stem, fmt)) as tmp_path:
+        def append(df):
+            if fmt == "csv":
+                df.to_csv(
+                    tmp_path, mode="a" if state["chunks"] else "w",
+                    header=not state["chunks"],
+                    )
+            else:
+                table = pyarrow.Table.from_pandas(
+                    df.reset_index(drop=True), preserve_index=False
+                    )
+                if state["writer"] is None:
+                    open_writer = (
+                        pyarrow.parquet.ParquetWriter if fmt == "parquet"
+                        else pyarrow.ipc.new_file
+                        )
+                    state["writer"] = open_writer(tmp_path, table.schema)
+                state["writer"].write_table(table)
+            state["chunks"] += 1
+
+        try:
+            yield append
+        finally:
+            if state["writer"] is not None:
+                state["writer"].close()
+        if not state["chunks"]:
+            raise ValueError(f"no rows or columns written for {stem}")
+
+
+def read_frame(path):
+    """Reads an intermediate file, the format is taken from its extension"""
+    if is_store_uri(path):
+        output_dir, kind, site = split_store_uri(path)
+        df = open_store(output_dir).read(kind, site)
+        if df is None:
+            raise FileNotFoundError(path)
+        return df
+    if path.endswith(FORMATS["parquet"]):
+        return pd.read_parquet(path)
+    if path.endswith(FORMATS["feather"]):
+        return pd.read_feather(path)
+    return pd.read_csv(path)
+
+
+def read_frames(paths):
+    """
+    Reads many frames into one data frame with a "frame" column, the
+    position of each row's frame in paths. The frames of a store are read
+    with one query per kind, see store.FleetStore.read_many.
+
+    Raises
+    ------
+    FileNotFoundError
+        if a frame is missing
+    """
+    parts = []
+    stored = {}
+    for position, path in enumerate(paths):
+        if is_store_uri(path):
+            output_dir, kind, site = split_store_uri(path)
+            stored.setdefault((output_dir, kind), {})[site] = position
+        else:
+            parts.append(read_frame(path).assign(frame=position))
+
+    for (output_dir, kind), positions in stored.items():
+        store = open_store(output_dir)
+        missing = positions.keys() - set(store.sites(kind))
+        if missing:
+            raise FileNotFoundError(store_uri(output_dir, kind, min(missing)))
+        df = store.read_many(kind, list(positions))
+        df["frame"] = df["site"].map(positions)
+        parts.append(df.drop(columns=["site", "row"]))
+
+    if not parts:
+        return pd.DataFrame(columns=["frame"])
+    df = pd.concat(parts, ignore_index=True)
+    return df.sort_values("frame", kind="stable", ignore_index=True)
+
+
+def write_joined(df, stem, fmt=None):
+    """
+    Writes a joined data frame. As csv it is transposed and rounded to
+    2 decimals, with one row per column of df, as the stats stage has
+    always read it.
+
+    Returns
+    -------
+    path: str
+        path of the written file
+    """
+    fmt = fmt or INTERMEDIATE_FORMAT
+    if fmt == "csv":
+        path = frame_path(stem, fmt)
+        with replacing(path) as tmp_path:
+            df.T.round(2).to_csv(tmp_path)
+        return path
+    return write_frame(df, stem, fmt)
+
+
+def read_joined(path):
+    """
+    Reads a file written by write_joined back into a data frame with one
+    column per series.
+    """
+    if path.endswith(FORMATS["csv"]):
+        return pd.read_csv(path, index_col=0).T
+    return read_frame(path)
@@ -0,0 +1,239 @@
+"""
+Consolidated SQLite store of the frames passed between pipeline stages.
+
+With the "sqlite" intermediate format every frame of every site is kept in
+one database in the output directory instead of one file per site and
+stage. Each kind of frame (pvgis, pvoutput, joined, stats) is a table with
+a site and a row column, so fleet wide reads are single queries. The
+frames table records, for each site and kind, the columns, row count,
+write time and content hash of the frame, used by the manifest in place of
+a file's fingerprint.
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+STORE_FILE = "fleet.sqlite"
+
+STORES = {}
+
+# Sites bound per query by read_many, below SQLite's variable limit
+QUERY_SITES = 500
+
+sqlite3.register_adapter(np.float32, float)
+sqlite3.register_adapter(np.float64, float)
+sqlite3.register_adapter(np.int32, int)
+sqlite3.register_adapter(np.int64, int)
+
+
+def quote(name):
+    """Quotes a table or column name for SQL"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def open_store(output_dir):
+    """
+    Returns the store of an output directory. Connections are kept for the
+    life of the process and not shared with forked worker processes.
+    """
+    path = os.path.join(output_dir, STORE_FILE)
+    key = path, os.getpid()
+    if key not in STORES:
+        STORES[key] = FleetStore(path)
+    return STORES[key]
+
+
+class FleetStore():
+    """
+    A SQLite database of frames keyed by kind and site.
+
+    Parameters
+    ----------
+    path: str
+        path of the database file, created if missing
+    """
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(
+            path, timeout=60, isolation_level=None
+            )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS frames ("
+            "kind TEXT, site TEXT, columns TEXT, rows INTEGER, "
+            "written_ns INTEGER, sha1 TEXT, PRIMARY KEY (kind, site))"
+            )
+
+    def transaction(self):
+        """
+        Starts a write transaction, taking the database's write lock
+        before anything is read so concurrent writers from worker processes
+        see each other's tables and columns. Use as a context manager.
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def table_columns(self, kind):
+        """Returns the columns of the table of kind, empty if missing"""
+        return [
+            row[1] for row in self.connection.execute(
+                f"PRAGMA table_info({quote(kind)})"
+                )
+            ]
+
+    def write(self, kind, site, df):
+        """
+        Replaces the frame of kind for site with df. The index of df is
+        not stored.
+        """
+        with self.writer(kind, site) as append:
+            append(df)
+
+    @contextmanager
+    def writer(self, kind, site):
+        """
+        Replaces the frame of kind for site with the chunks of rows passed
+        to the yielded function, in one transaction. The chunks must have
+        the same columns, the frame's content hash is the same as for
+        write of the whole frame.
+        """
+        state = {"columns": None, "rows": 0, "digest": hashlib.sha1()}
+
+        def append(df):
+            columns = [str(column) for column in df.columns]
+            if state["columns"] is None:
+                state["columns"] = columns
+                self.prepare(kind, columns)
+                self.connection.execute(
+                    f"DELETE FROM {quote(kind)} WHERE site = ?", (site,)
+                    )
+            values = df.astype(object).where(df.notna(), None).to_numpy()
+            state["digest"].update(
+                pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()
+                )
+            start = state["rows"]
+            self.connection.executemany(
+                f"INSERT INTO {quote(kind)} (site, row, "
+                f"{', '.join(quote(column) for column in columns)}) VALUES "
+                f"({', '.join('?' * (len(columns) + 2))})",
+                (
+                    (site, start + row, *values[row])
+                    for row in range(len(values))
+                    ),
+                )
+            state["rows"] += len(values)
+
+        with self.transaction():
+            yield append
+            if state["columns"] is None:
+                raise ValueError(f"no rows or columns written for {kind}/{site}")
+            state["digest"].update(json.dumps(state["columns"]).encode())
+            self.connection.execute(
+                "INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    kind, site, json.dumps(state["columns"]), state["rows"],
+                    time.time_ns(), state["digest"].hexdigest(),
+                    ),
+                )
+
+    def prepare(self, kind, columns):
+        """
+        Creates the table of kind, or adds the columns it is missing, in
+        the running transaction
+        """
+        existing = self.table_columns(kind)
+        if not existing:
+            self.connection.execute(
+                f"CREATE TABLE {quote(kind)} (site TEXT, row INTEGER)"
+                )
+            self.connection.execute(
+                f"CREATE INDEX {quote(kind + '_site')} "
+                f"ON {quote(kind)} (site, row)"
+                )
+        for column in columns:
+            if column not in existing:
+                self.connection.execute(
+                    f"ALTER TABLE {quote(kind)} ADD COLUMN {quote(column)}"
+                    )
+
+    def read(self, kind, site):
+        """Returns the frame of kind for site, None if it is missing"""
+        row = self.connection.execute(
+            "SELECT columns FROM frames WHERE kind = ? AND site = ?",
+            (kind, site),
+            ).fetchone()
+        if row is None:
+            return None
+
+        columns = json.loads(row[0])
+        return pd.read_sql_query(
+            f"SELECT {', '.join(quote(column) for column in columns)} "
+            f"FROM {quote(kind)} WHERE site = ? ORDER BY row",
+            self.connection, params=(site,),
+            )
+
+    def read_all(self, kind):
+        """
+        Returns the frames of kind of every site in one data frame with
+        site and row columns, ordered by site and row
+        """
+        if not self.table_columns(kind):
+            return pd.DataFrame(columns=["site", "row"])
+        return pd.read_sql_query(
+            f"SELECT * FROM {quote(kind)} ORDER BY site, row",
+            self.connection,
+            )
+
+    def read_many(self, kind, sites):
+        """
+        Returns the frames of kind of sites in one data frame with site and
+        row columns, ordered by site and row, with one query per
+        QUERY_SITES sites
+        """
+        if not self.table_columns(kind):
+            return pd.DataFrame(columns=["site", "row"])
+        frames = []
+        for start in range(0, len(sites), QUERY_SITES):
+            batch = list(sites[start:start + QUERY_SITES])
+            frames.append(pd.read_sql_query(
+                f"SELECT * FROM {quote(kind)} WHERE site IN "
+                f"({', '.join('?' * len(batch))}) ORDER BY site, row",
+                self.connection, params=batch,
+                ))
+        if not frames:
+            return pd.DataFrame(columns=["site", "row"])
+        return pd.concat(frames, ignore_index=True)
+
+    def sites(self, kind):
+        """Returns the sites with a frame of kind"""
+        return [
+            row[0] for row in self.connection.execute(
+                "SELECT site FROM frames WHERE kind = ? ORDER BY site",
+                (kind,),
+                )
+            ]
+
+    def fingerprint(self, kind, site):
+        """
+        Returns the row count, write time and content hash of a frame in
+        the keys of manifest.fingerprint, None if it is missing
+        """
+        row = self.connection.execute(
+            "SELECT rows, written_ns, sha1 FROM frames "
+            "WHERE kind = ? AND site = ?",
+            (kind, site),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"size": row[0], "mtime_ns": row[1], "sha1": row[2]}
+
+    def close(self):
+        self.connection.close()